@@ -1,17 +1,24 @@
+from collections.abc import Sequence
+from datetime import timedelta
 from typing import Any
 
 from django import forms
 from django.contrib import admin
-from django.db.models import ForeignKey, Q, QuerySet
+from django.db.models import ForeignKey, QuerySet
 from django.http import HttpRequest
 from django.urls import reverse
 from django.utils.safestring import mark_safe
+from django.utils.timezone import localdate
 from django_json_widget.widgets import JSONEditorWidget  # pyright: ignore[reportMissingTypeStubs]
 
+from ads.admin.scoping import ClientScopedAdminMixin, scope_by_client
+from ads.admin.stats import CountersChangeList, get_counters, prefetch_banner_counters, recent_stats
 from ads.models import Banner, Campaign, User2Client
-from ads.permissions import check_client_permission
+from ads.permissions import ALL_ROLES, check_client_permission
 from ads.redis import REDIS_CLIENT
 
+REACH_DAYS = 30
+
 
 class BannerForm(forms.ModelForm):
     class Meta:
@@ -21,13 +28,16 @@ class BannerForm(forms.ModelForm):
 
 
 @admin.register(Banner)
-class BannerAdmin(admin.ModelAdmin[Banner]):
+class BannerAdmin(ClientScopedAdminMixin, admin.ModelAdmin[Banner]):
     form = BannerForm
-    list_display = ('name', 'campaign', 'client_info', 'is_active', 'created_at')
+    list_display = ('name', 'campaign', 'client_info', 'is_active', 'shows', 'clicks', 'ctr', 'created_at')
     list_filter = ('is_active', 'campaign__client')
     search_fields = ('name', 'campaign__name')
     readonly_fields = ('created_at',)
     list_select_related = ('campaign__client',)
+    # Совпадает с индексами banner_*_created_idx, id - чтобы Django не добавлял свою сортировку по -pk
+    ordering = ('-created_at', '-id')
+    client_field = 'campaign__client'
 
     def client_info(self, obj: Banner) -> str:
         return f'{obj.campaign.client.name} ({obj.campaign.client.tax_id})'
@@ -40,7 +50,7 @@ class BannerAdmin(admin.ModelAdmin[Banner]):
         if obj:
             return check_client_permission(
                 request.user,  # pyright: ignore[reportArgumentType]
-                obj.campaign.client,
+                obj.campaign.client_id,
                 (User2Client.ClientStaffRoles.ADMIN, User2Client.ClientStaffRoles.EDITOR),
             )
         return super().has_change_permission(request, obj)
@@ -49,51 +59,59 @@ class BannerAdmin(admin.ModelAdmin[Banner]):
         if obj:
             return check_client_permission(
                 request.user,  # pyright: ignore[reportArgumentType]
-                obj.campaign.client,
-                (
-                    User2Client.ClientStaffRoles.ADMIN,
-                    User2Client.ClientStaffRoles.EDITOR,
-                    User2Client.ClientStaffRoles.READER,
-                ),
+                obj.campaign.client_id,
+                ALL_ROLES,
             )
         return True
 
     def get_queryset(self, request: HttpRequest) -> QuerySet[Banner]:
-        qs = super().get_queryset(request).select_related('campaign__client__owner')
-        if not request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
-            return qs.filter(
-                Q(campaign__client__owner=request.user)
-                | Q(
-                    campaign__client__user2client__user=request.user,
-                    campaign__client__user2client__role__in=[
-                        User2Client.ClientStaffRoles.ADMIN,
-                        User2Client.ClientStaffRoles.EDITOR,
-                        User2Client.ClientStaffRoles.READER,
-                    ],
-                )
-            ).distinct()
-        return qs
+        return super().get_queryset(request).select_related('campaign__client')
 
     def formfield_for_foreignkey(self, db_field: ForeignKey[Any], request: HttpRequest | None, **kwargs: Any) -> forms.ModelChoiceField | None:
         if request and db_field.name == 'campaign':
-            if not request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
-                kwargs['queryset'] = Campaign.objects.filter(
-                    Q(client__owner=request.user)
-                    | Q(
-                        client__user2client__user=request.user,
-                        client__user2client__role__in=[
-                            User2Client.ClientStaffRoles.ADMIN,
-                            User2Client.ClientStaffRoles.EDITOR,
-                        ],
-                    )
-                ).distinct()
+            kwargs['queryset'] = scope_by_client(
+                request,
+                Campaign.objects.all(),
+                'client',
+                (User2Client.ClientStaffRoles.ADMIN, User2Client.ClientStaffRoles.EDITOR),
+            )
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
-    def clicks(self, obj: Banner) -> int | None:
-        return REDIS_CLIENT.get_clicks(obj.pk)
+    def get_changelist(self, request: HttpRequest, **kwargs: Any) -> type[CountersChangeList]:
+        return CountersChangeList
+
+    def prefetch_counters(self, objects: Sequence[Banner]) -> None:
+        prefetch_banner_counters(objects)
+
+    def clicks(self, obj: Banner) -> int:
+        return get_counters(obj, prefetch_banner_counters).clicks
+
+    clicks.short_description = 'Клики'  # pyright: ignore[reportFunctionMemberAccess]
+
+    def shows(self, obj: Banner) -> int:
+        return get_counters(obj, prefetch_banner_counters).shows
+
+    shows.short_description = 'Показы'  # pyright: ignore[reportFunctionMemberAccess]
+
+    def ctr(self, obj: Banner) -> str:
+        return f'{get_counters(obj, prefetch_banner_counters).ctr:.2f}%'
+
+    ctr.short_description = 'CTR'  # pyright: ignore[reportFunctionMemberAccess]
+
+    def reach(self, obj: Banner) -> str:
+        today = localdate()
+        return 'Сегодня: {}, за {} дней: {}'.format(
+            REDIS_CLIENT.get_reach('banner', obj.pk, today, today),
+            REACH_DAYS,
+            REDIS_CLIENT.get_reach('banner', obj.pk, today - timedelta(days=REACH_DAYS - 1), today),
+        )
+
+    reach.short_description = 'Охват (уникальные посетители)'  # pyright: ignore[reportFunctionMemberAccess]
+
+    def recent(self, obj: Banner) -> str:
+        return recent_stats('banner', obj.pk)
 
-    def shows(self, obj: Banner) -> int | None:
-        return REDIS_CLIENT.get_shows(obj.pk)
+    recent.short_description = 'Последние показы и клики'  # pyright: ignore[reportFunctionMemberAccess]
 
     def show_url(self, obj: Banner) -> str | None:
         url = reverse('show_banner', args=[obj.pk])
@@ -102,7 +120,7 @@ class BannerAdmin(admin.ModelAdmin[Banner]):
     show_url.allow_tags = True
 
     def get_readonly_fields(self, request: HttpRequest, obj: Banner | None = None):
-        readonly = ['created_at', 'clicks', 'shows', 'show_url']
+        readonly = ['created_at', 'clicks', 'shows', 'ctr', 'recent', 'reach', 'show_url']
         if obj and not request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
             readonly.append('campaign')
         return readonly
@@ -1,14 +1,20 @@
-from collections.abc import Callable
+from collections.abc import Callable, Sequence
+from datetime import timedelta
 from typing import Any
 
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin.options import InlineModelAdmin
-from django.db.models import ForeignKey, Q
+from django.db.models import ForeignKey
 from django.forms import ModelChoiceField, ModelForm
 from django.http import HttpRequest
+from django.utils.timezone import localdate
 
+from ads.admin.scoping import ClientScopedAdminMixin, scope_by_client
+from ads.admin.stats import CountersChangeList, get_counters, prefetch_campaign_counters, recent_stats
 from ads.models import Banner, Campaign, Client, User2Client
-from ads.permissions import check_client_permission
+from ads.permissions import ALL_ROLES, check_client_permission
+from ads.redis import REDIS_CLIENT
 
 
 class BannerInline(admin.TabularInline[Banner]):
@@ -23,11 +29,25 @@ class BannerInline(admin.TabularInline[Banner]):
 
 
 @admin.register(Campaign)
-class CampaignAdmin(admin.ModelAdmin[Campaign]):
+class CampaignAdmin(ClientScopedAdminMixin, admin.ModelAdmin[Campaign]):
     inlines = [BannerInline]
-    list_display = ('name', 'client', 'author', 'budget', 'start_date', 'end_date', 'is_active')
+    list_display = (
+        'name',
+        'client',
+        'author',
+        'budget',
+        'spent',
+        'shows',
+        'clicks',
+        'ctr',
+        'start_date',
+        'end_date',
+        'is_active',
+    )
     list_filter = ('is_active', 'client', 'start_date')
     search_fields = ('name', 'client__name')
+    # Совпадает с индексами campaign_*_start_idx
+    ordering = ('-start_date', '-id')
 
     def has_change_permission(self, request: HttpRequest, obj: Campaign | None = None) -> bool:
         if request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
@@ -35,7 +55,7 @@ class CampaignAdmin(admin.ModelAdmin[Campaign]):
         if obj:
             return check_client_permission(
                 request.user,  # pyright: ignore[reportArgumentType]
-                obj.client,
+                obj.client_id,
                 (User2Client.ClientStaffRoles.ADMIN, User2Client.ClientStaffRoles.EDITOR),
             )
         return super().has_change_permission(request, obj)
@@ -44,12 +64,8 @@ class CampaignAdmin(admin.ModelAdmin[Campaign]):
         if obj:
             return check_client_permission(
                 request.user,  # pyright: ignore[reportArgumentType]
-                obj.client,
-                (
-                    User2Client.ClientStaffRoles.ADMIN,
-                    User2Client.ClientStaffRoles.EDITOR,
-                    User2Client.ClientStaffRoles.READER,
-                ),
+                obj.client_id,
+                ALL_ROLES,
             )
         return True
 
@@ -59,34 +75,19 @@ class CampaignAdmin(admin.ModelAdmin[Campaign]):
         return []
 
     def get_queryset(self, request: HttpRequest):
-        qs = super().get_queryset(request).select_related('author', 'client__owner')
-        if not request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
-            return qs.filter(
-                Q(client__owner=request.user)
-                | Q(
-                    client__user2client__user=request.user,
-                    client__user2client__role__in=[
-                        User2Client.ClientStaffRoles.ADMIN,
-                        User2Client.ClientStaffRoles.EDITOR,
-                        User2Client.ClientStaffRoles.READER,
-                    ],
-                )
-            ).distinct()
-        return qs
+        return super().get_queryset(request).select_related('author', 'client')
 
     def formfield_for_foreignkey(
         self, db_field: ForeignKey[Client], request: HttpRequest | None, **kwargs: Any
     ) -> ModelChoiceField | None:
         if db_field.name == 'client' and request:
             # Фильтруем клиентов по правам доступа
-            if not request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
-                kwargs['queryset'] = Client.objects.filter(
-                    Q(owner=request.user)
-                    | Q(
-                        user2client__user=request.user,
-                        user2client__role__in=[User2Client.ClientStaffRoles.ADMIN, User2Client.ClientStaffRoles.EDITOR],
-                    )
-                ).distinct()
+            kwargs['queryset'] = scope_by_client(
+                request,
+                Client.objects.all(),
+                'pk',
+                (User2Client.ClientStaffRoles.ADMIN, User2Client.ClientStaffRoles.EDITOR),
+            )
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
     def save_model(self, request: HttpRequest, obj: Campaign, form: ModelForm, change: bool) -> None:
@@ -95,23 +96,64 @@ class CampaignAdmin(admin.ModelAdmin[Campaign]):
             obj.author = request.user  # pyright: ignore[reportAttributeAccessIssue]
         super().save_model(request, obj, form, change)
 
+    def reach(self, obj: Campaign) -> int | None:
+        """Уникальные посетители за все время кампании (в пределах хранения в Redis)"""
+        date_to = min(obj.end_date, localdate())
+        date_from = max(obj.start_date, localdate() - timedelta(days=settings.REDIS_REACH_TTL_DAYS - 1))
+        return REDIS_CLIENT.get_reach('campaign', obj.pk, date_from, date_to)
+
+    reach.short_description = 'Охват'  # pyright: ignore[reportFunctionMemberAccess]
+
+    def get_changelist(self, request: HttpRequest, **kwargs: Any) -> type[CountersChangeList]:
+        return CountersChangeList
+
+    def prefetch_counters(self, objects: Sequence[Campaign]) -> None:
+        prefetch_campaign_counters(objects)
+
+    def shows(self, obj: Campaign) -> int:
+        return get_counters(obj, prefetch_campaign_counters).shows
+
+    shows.short_description = 'Показы'  # pyright: ignore[reportFunctionMemberAccess]
+
+    def clicks(self, obj: Campaign) -> int:
+        return get_counters(obj, prefetch_campaign_counters).clicks
+
+    clicks.short_description = 'Клики'  # pyright: ignore[reportFunctionMemberAccess]
+
+    def ctr(self, obj: Campaign) -> str:
+        return f'{get_counters(obj, prefetch_campaign_counters).ctr:.2f}%'
+
+    ctr.short_description = 'CTR'  # pyright: ignore[reportFunctionMemberAccess]
+
+    def recent(self, obj: Campaign) -> str:
+        return recent_stats('campaign', obj.pk)
+
+    recent.short_description = 'Последние показы и клики'  # pyright: ignore[reportFunctionMemberAccess]
+
     def get_fields(self, request: HttpRequest, obj: Campaign | None = None) -> list[Callable[..., Any] | str]:
         fields: list[Callable[..., Any] | str] = [
             'name',
             'client',
             'budget',
+            'cost_model',
+            'price',
+            'spent',
+            'frequency_cap',
+            'frequency_period',
             'start_date',
             'end_date',
             'is_active',
             'created_at',
             'updated_at',
         ]
+        if obj:
+            fields[fields.index('spent') + 1 : fields.index('spent') + 1] = ['reach', 'recent']
         if obj or request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
             fields.insert(2, 'author')
         return fields
 
     def get_readonly_fields(self, request: HttpRequest, obj: Campaign | None = None):
-        readonly = ['created_at', 'updated_at']
+        readonly = ['spent', 'reach', 'recent', 'created_at', 'updated_at']
         if obj and not request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
             # Запрещаем редактирование автора и клиента после создания
             readonly += ['author', 'client']
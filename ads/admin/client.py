@@ -6,12 +6,13 @@ from django.contrib import admin
 from django.contrib.admin.options import InlineModelAdmin
 from django.contrib.auth.models import Group, User
 from django.core.exceptions import ValidationError
-from django.db.models import Q, QuerySet
+from django.db.models import QuerySet
 from django.http import HttpRequest
 from django.utils.timezone import now
 
+from ads.admin.scoping import ClientScopedAdminMixin
 from ads.models import Campaign, Client, User2Client
-from ads.permissions import check_client_permission
+from ads.permissions import ALL_ROLES, check_client_permission
 
 admin.site.unregister(Group)
 
@@ -91,13 +92,16 @@ class ClientCreationForm(forms.ModelForm):
 
 
 @admin.register(Client)
-class ClientAdmin(admin.ModelAdmin[Client]):
+class ClientAdmin(ClientScopedAdminMixin, admin.ModelAdmin[Client]):
     form = ClientCreationForm
     inlines = [User2ClientInline, CampaignInline]
     list_display = ('name', 'tax_id', 'owner', 'created_at', 'hidden')
     list_filter = ('hidden', 'created_at')
     search_fields = ('name', 'tax_id')
     fields = ('name', 'tax_id', 'owner')
+    # Совпадает с индексом client_created_idx
+    ordering = ('-created_at', '-id')
+    client_field = 'pk'
 
     def has_delete_permission(self, request: HttpRequest, obj: Client | None = None) -> bool:
         return False
@@ -108,7 +112,7 @@ class ClientAdmin(admin.ModelAdmin[Client]):
         if obj:
             return check_client_permission(
                 request.user,  # pyright: ignore[reportArgumentType]
-                obj,
+                obj.pk,
                 (User2Client.ClientStaffRoles.ADMIN,),
             )
         return super().has_change_permission(request, obj)
@@ -117,12 +121,8 @@ class ClientAdmin(admin.ModelAdmin[Client]):
         if obj:
             return check_client_permission(
                 request.user,  # pyright: ignore[reportArgumentType]
-                obj,
-                (
-                    User2Client.ClientStaffRoles.ADMIN,
-                    User2Client.ClientStaffRoles.EDITOR,
-                    User2Client.ClientStaffRoles.READER,
-                ),
+                obj.pk,
+                ALL_ROLES,
             )
         return True
 
@@ -160,14 +160,5 @@ class ClientAdmin(admin.ModelAdmin[Client]):
     def get_queryset(self, request: HttpRequest) -> QuerySet[Client]:
         qs = super().get_queryset(request).prefetch_related('campaign_set')
         if not request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
-            return (
-                qs.filter(hidden=False)
-                .filter(
-                    Q(owner=request.user)
-                    | Q(
-                        user2client__user=request.user,
-                    )
-                )
-                .distinct()
-            )
+            return qs.filter(hidden=False)
         return qs
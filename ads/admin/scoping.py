@@ -0,0 +1,34 @@
+from typing import Any
+
+from django.db.models import QuerySet
+from django.http import HttpRequest
+
+from ads.permissions import ALL_ROLES, get_client_ids
+
+
+class ClientScopedAdminMixin:
+    """Ограничение объектов админки клиентами, доступными пользователю.
+
+    Доступные клиенты берутся из карты ролей (get_client_roles), поэтому фильтр -
+    `client IN (...)` по индексу без JOIN с User2Client и без DISTINCT.
+    `client_field` - путь от модели до клиента.
+    """
+
+    client_field: str = 'client'
+
+    def get_queryset(self, request: HttpRequest) -> QuerySet[Any]:
+        return self.scope_queryset(request, super().get_queryset(request))  # pyright: ignore[reportAttributeAccessIssue]
+
+    def scope_queryset(
+        self, request: HttpRequest, qs: QuerySet[Any], roles: tuple[str, ...] = ALL_ROLES
+    ) -> QuerySet[Any]:
+        return scope_by_client(request, qs, self.client_field, roles)
+
+
+def scope_by_client(
+    request: HttpRequest, qs: QuerySet[Any], client_field: str, roles: tuple[str, ...] = ALL_ROLES
+) -> QuerySet[Any]:
+    """Фильтр queryset по клиентам, в которых у пользователя одна из ролей"""
+    if request.user.is_superuser:  # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
+        return qs
+    return qs.filter(**{f'{client_field}__in': get_client_ids(request.user, roles)})
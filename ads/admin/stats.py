@@ -0,0 +1,59 @@
+from collections.abc import Callable, Sequence
+from datetime import timedelta
+from typing import Any
+
+from django.contrib.admin.views.main import ChangeList
+from django.http import HttpRequest
+from django.utils.timezone import now
+
+from ads.models import Banner, Campaign
+from ads.redis import REDIS_CLIENT, Counters
+
+RECENT_PERIODS = (('час', timedelta(hours=1)), ('сутки', timedelta(days=1)))
+
+
+def recent_stats(kind: str, object_id: int) -> str:
+    """Показы, клики и CTR баннера или кампании за последний час и сутки по счетчикам Redis"""
+    end = now()
+    parts: list[str] = []
+    for name, period in RECENT_PERIODS:
+        stats = REDIS_CLIENT.get_stats(kind, object_id, end - period, end)
+        ctr = stats['clicks'] / stats['shows'] * 100 if stats['shows'] else 0.0
+        parts.append(f'За {name}: {stats["shows"]} показов, {stats["clicks"]} кликов, CTR {ctr:.2f}%')
+    return '; '.join(parts)
+
+
+class CountersChangeList(ChangeList):
+    """Список админки, загружающий счетчики Redis для всей страницы одним запросом.
+
+    ModelAdmin должен реализовать `prefetch_counters(objects)`, которая кладет
+    Counters в атрибут `counters` каждого объекта
+    """
+
+    def get_results(self, request: HttpRequest) -> None:
+        super().get_results(request)
+        self.model_admin.prefetch_counters(self.result_list)  # pyright: ignore[reportAttributeAccessIssue]
+
+
+def prefetch_banner_counters(banners: Sequence[Banner]) -> None:
+    counters = REDIS_CLIENT.get_banner_counters(banner.pk for banner in banners)
+    for banner in banners:
+        banner.counters = counters[banner.pk]  # pyright: ignore[reportAttributeAccessIssue]
+
+
+def prefetch_campaign_counters(campaigns: Sequence[Campaign]) -> None:
+    """Счетчики кампаний - суммы по их баннерам: один запрос к Postgres и один MGET на страницу"""
+    banners = list(Banner.objects.filter(campaign__in=campaigns).values_list('pk', 'campaign_id'))
+    counters = REDIS_CLIENT.get_banner_counters(banner_id for banner_id, _ in banners)
+    totals = {campaign.pk: Counters() for campaign in campaigns}
+    for banner_id, campaign_id in banners:
+        totals[campaign_id] += counters[banner_id]
+    for campaign in campaigns:
+        campaign.counters = totals[campaign.pk]  # pyright: ignore[reportAttributeAccessIssue]
+
+
+def get_counters(obj: Any, prefetch: Callable[[Sequence[Any]], None]) -> Counters:
+    """Счетчики из предзагрузки списка, на странице объекта - отдельным запросом"""
+    if not hasattr(obj, 'counters'):
+        prefetch([obj])
+    return obj.counters
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AdsConfig(AppConfig):
     name = 'ads'
     verbose_name = 'Реклама'
+
+    def ready(self) -> None:
+        import ads.signals  # noqa: F401  # pyright: ignore[reportUnusedImport]
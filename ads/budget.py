@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+from collections.abc import Iterable
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import TYPE_CHECKING, cast
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.functional import LazyObject
+
+from ads.ch import CostModel
+from ads.counters import CounterAggregator, Deltas
+from ads.invalidation import ALL, INVALIDATION_BUS
+from ads.redis import REDIS_CLIENT
+
+if TYPE_CHECKING:
+    from ads.decisioning import LineItem, RequestAttributes
+
+logger = logging.getLogger(__name__)
+
+MICROS = 1_000_000
+
+
+def to_micros(amount: Decimal) -> int:
+    return int((amount * MICROS).to_integral_value())
+
+
+def from_micros(amount: int) -> Decimal:
+    return Decimal(amount) / MICROS
+
+
+def sync_campaign_budget(
+    campaign_id: int, client_id: int, budget: Decimal, cost_model: str, price: Decimal, spent: Decimal
+) -> int:
+    """Бюджет и цены кампании в Redis. Возвращает расход по Redis, микрорублей"""
+    return REDIS_CLIENT.sync_budget(
+        campaign_id=campaign_id,
+        client_id=client_id,
+        limit=to_micros(budget),
+        show_cost=to_micros(price) // 1000 if cost_model == CostModel.CPM else 0,
+        click_cost=to_micros(price) if cost_model == CostModel.CPC else 0,
+        spent=to_micros(spent),
+    )
+
+
+@dataclass
+class BudgetTrackerStats:
+    exhausted_campaigns: int
+    refreshes: int
+    pending_debits: int
+
+
+class BudgetTracker:
+    """Учет расхода кампаний в Redis и проверка исчерпания бюджетов при показе.
+
+    Стоимость показов (CPM) и кликов (CPC) списывается атомарным Lua-скриптом,
+    который сразу помечает кампанию исчерпанной при превышении ее бюджета или
+    баланса клиента с кредитным лимитом. Воркеры держат множество исчерпанных
+    кампаний в памяти: оно перечитывается из Redis раз в `refresh_interval`
+    секунд, а новые исчерпания приходят через шину инвалидации. Поэтому
+    проверка при показе обходится без запросов к Redis.
+    """
+
+    def __init__(
+        self,
+        refresh_interval: float,
+        flush_interval: float,
+        flush_events: int,
+        max_pending: int,
+        flush_on_exit: bool,
+    ) -> None:
+        self.refresh_interval = refresh_interval
+        self._exhausted: frozenset[int] = frozenset()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid: int | None = None
+        self._refreshes = 0
+        self._aggregator: CounterAggregator | None = None
+        # Списания копятся так же, как счетчики показов (см. REDIS_COUNTER_FLUSH_INTERVAL)
+        if flush_interval:
+            self._aggregator = CounterAggregator(
+                flush=lambda deltas, uniques: self.flush_debits(deltas),
+                flush_interval=flush_interval,
+                flush_events=flush_events,
+                max_pending=max_pending,
+                flush_on_exit=flush_on_exit,
+            )
+
+    def is_exhausted(self, campaign_id: int) -> bool:
+        self._ensure_started()
+        return campaign_id in self._exhausted
+
+    def filter_candidates(self, candidates: list['LineItem'], attributes: 'RequestAttributes') -> list['LineItem']:
+        """Фильтр для DECISION_ENGINE"""
+        self._ensure_started()
+        exhausted = self._exhausted
+        return [item for item in candidates if item.campaign_id not in exhausted]
+
+    def debit_shows(self, campaign_ids: Iterable[int]) -> None:
+        self._debit(campaign_ids, 'shows')
+
+    def debit_click(self, campaign_id: int) -> None:
+        self._debit([campaign_id], 'clicks')
+
+    async def adebit_shows(self, campaign_ids: Iterable[int]) -> None:
+        await self._adebit(list(campaign_ids), 'shows')
+
+    async def adebit_click(self, campaign_id: int) -> None:
+        await self._adebit([campaign_id], 'clicks')
+
+    def flush_debits(self, deltas: Deltas) -> None:
+        for campaign_id in REDIS_CLIENT.debit_budgets(deltas):
+            INVALIDATION_BUS.publish('budget', campaign_id)
+
+    def invalidate(self, kind: str, object_id: int) -> None:
+        if kind == 'budget':
+            with self._lock:
+                self._exhausted |= {object_id}
+        elif kind == ALL:
+            self._wakeup.set()
+
+    def stats(self) -> BudgetTrackerStats:
+        return BudgetTrackerStats(
+            exhausted_campaigns=len(self._exhausted),
+            refreshes=self._refreshes,
+            pending_debits=self._aggregator.stats().pending_events if self._aggregator else 0,
+        )
+
+    def _debit(self, campaign_ids: Iterable[int], field: str) -> None:
+        if self._aggregator is not None:
+            for campaign_id in campaign_ids:
+                self._aggregator.incr(str(campaign_id), field=field)
+            return
+        deltas: Deltas = {}
+        for campaign_id in campaign_ids:
+            key = (str(campaign_id), field)
+            deltas[key] = deltas.get(key, 0) + 1
+        if deltas:
+            self.flush_debits(deltas)
+
+    async def _adebit(self, campaign_ids: list[int], field: str) -> None:
+        if self._aggregator is not None:
+            self._debit(campaign_ids, field)
+        else:
+            await sync_to_async(self._debit)(campaign_ids, field)
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='budget-refresh', daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                exhausted = frozenset(REDIS_CLIENT.get_exhausted_campaigns())
+            except Exception:
+                # Остаемся с последним известным множеством
+                logger.exception('Failed to refresh exhausted campaigns')
+            else:
+                with self._lock:
+                    self._exhausted = exhausted
+                    self._refreshes += 1
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+
+
+class LazyBudgetTracker(LazyObject):
+    def _setup(self) -> None:
+        tracker = BudgetTracker(
+            refresh_interval=settings.BUDGET_REFRESH_INTERVAL,
+            flush_interval=settings.REDIS_COUNTER_FLUSH_INTERVAL / 1000,
+            flush_events=settings.REDIS_COUNTER_FLUSH_EVENTS,
+            max_pending=settings.REDIS_COUNTER_MAX_PENDING,
+            flush_on_exit=settings.REDIS_COUNTER_FLUSH_ON_EXIT,
+        )
+        INVALIDATION_BUS.subscribe(tracker.invalidate)
+        self._wrapped = tracker
+
+
+BUDGET_TRACKER = cast(BudgetTracker, LazyBudgetTracker())
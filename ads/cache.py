@@ -0,0 +1,201 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Any, cast
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.functional import LazyObject
+
+from ads.frequency import FrequencyCap, frequency_cap
+from ads.invalidation import ALL, INVALIDATION_BUS
+from ads.models import Banner
+
+
+@dataclass(frozen=True, slots=True)
+class BannerSnapshot:
+    """Неизменяемый снимок баннера, достаточный для показа и перехода по клику"""
+
+    id: int
+    campaign_id: int
+    content: dict[str, Any]
+    click_url: str
+    is_active: bool
+    content_hash: str
+    frequency_cap: FrequencyCap | None = None
+
+    @property
+    def pk(self) -> int:
+        return self.id
+
+
+@dataclass
+class BannerCacheStats:
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+
+
+class BannerCache:
+    """LRU-кеш снимков баннеров, доступных для показа, с ограниченным временем жизни.
+
+    Отсутствующие и неактивные баннеры тоже кешируются (как None), чтобы
+    запросы на несуществующие id не доходили до Postgres.
+
+    Загрузка идет без блокировки, и инвалидация может прийти, пока она выполняется.
+    Каждая инвалидация получает номер поколения, для баннера и кампании запоминается
+    номер последней. Загруженный снимок не сохраняется, если его баннер или кампания
+    инвалидированы после начала загрузки: иначе в кеше остались бы прежние данные.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, BannerSnapshot | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._generation = 0
+        self._cleared_at = 0
+        self._banner_generations: dict[int, int] = {}
+        self._campaign_generations: dict[int, int] = {}
+
+    def get(self, banner_id: int) -> BannerSnapshot | None:
+        return self.get_many([banner_id]).get(banner_id)
+
+    def get_many(self, banner_ids: Iterable[int]) -> dict[int, BannerSnapshot | None]:
+        """Снимки по списку id. Промахи загружаются одним запросом"""
+        result, missing, generation = self._lookup(banner_ids)
+        if missing:
+            self._store(missing, self._load(missing), result, generation)
+        return result
+
+    async def aget(self, banner_id: int) -> BannerSnapshot | None:
+        return (await self.aget_many([banner_id])).get(banner_id)
+
+    async def aget_many(self, banner_ids: Iterable[int]) -> dict[int, BannerSnapshot | None]:
+        result, missing, generation = self._lookup(banner_ids)
+        if missing:
+            self._store(missing, await sync_to_async(self._load)(missing), result, generation)
+        return result
+
+    def invalidate(self, kind: str, object_id: int) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._generation += 1
+            if kind == ALL:
+                self._entries.clear()
+                self._cleared_at = self._generation
+                self._banner_generations.clear()
+                self._campaign_generations.clear()
+            elif kind == 'banner':
+                self._banner_generations[object_id] = self._generation
+                self._entries.pop(object_id, None)
+            elif kind == 'campaign':
+                self._campaign_generations[object_id] = self._generation
+                for banner_id in [
+                    banner_id
+                    for banner_id, (_, snapshot) in self._entries.items()
+                    if snapshot is not None and snapshot.campaign_id == object_id
+                ]:
+                    del self._entries[banner_id]
+
+    def stats(self) -> BannerCacheStats:
+        with self._lock:
+            return BannerCacheStats(
+                size=len(self._entries),
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                invalidations=self._invalidations,
+            )
+
+    def _lookup(self, banner_ids: Iterable[int]) -> tuple[dict[int, BannerSnapshot | None], list[int], int]:
+        """Найденные снимки, промахи и поколение, с которого начинается их загрузка"""
+        result: dict[int, BannerSnapshot | None] = {}
+        missing: list[int] = []
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            for banner_id in banner_ids:
+                entry = self._entries.get(banner_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(banner_id)
+                    self._hits += 1
+                    result[banner_id] = entry[1]
+                else:
+                    self._misses += 1
+                    missing.append(banner_id)
+        return result, missing, generation
+
+    def _store(
+        self,
+        missing: list[int],
+        loaded: dict[int, BannerSnapshot],
+        result: dict[int, BannerSnapshot | None],
+        generation: int,
+    ) -> None:
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for banner_id in missing:
+                snapshot = loaded.get(banner_id)
+                result[banner_id] = snapshot
+                if self._is_stale(banner_id, snapshot, generation):
+                    continue
+                self._entries[banner_id] = (expires_at, snapshot)
+                self._entries.move_to_end(banner_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def _is_stale(self, banner_id: int, snapshot: BannerSnapshot | None, generation: int) -> bool:
+        """Инвалидирован ли баннер после начала загрузки. Вызывается под блокировкой"""
+        invalidated_at = max(self._cleared_at, self._banner_generations.get(banner_id, 0))
+        if snapshot is not None:
+            invalidated_at = max(invalidated_at, self._campaign_generations.get(snapshot.campaign_id, 0))
+        return invalidated_at > generation
+
+    def _load(self, banner_ids: list[int]) -> dict[int, BannerSnapshot]:
+        rows = Banner.objects.filter(pk__in=banner_ids, is_active=True).values_list(
+            'pk',
+            'campaign_id',
+            'content',
+            'click_url',
+            'is_active',
+            'campaign__frequency_cap',
+            'campaign__frequency_period',
+        )
+        return {
+            banner_id: BannerSnapshot(
+                banner_id,
+                campaign_id,
+                content,
+                click_url,
+                is_active,
+                content_hash=_content_hash(content),
+                frequency_cap=frequency_cap(campaign_id, cap, period),
+            )
+            for banner_id, campaign_id, content, click_url, is_active, cap, period in rows
+        }
+
+
+def _content_hash(content: dict[str, Any]) -> str:
+    return hashlib.blake2b(json.dumps(content, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+class LazyBannerCache(LazyObject):
+    def _setup(self) -> None:
+        cache = BannerCache(max_size=settings.BANNER_CACHE_SIZE, ttl=settings.BANNER_CACHE_TTL)
+        INVALIDATION_BUS.subscribe(cache.invalidate)
+        self._wrapped = cache
+
+
+BANNER_CACHE = cast(BannerCache, LazyBannerCache())
@@ -1,13 +1,21 @@
-from datetime import datetime
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from datetime import UTC, date, datetime, time, timedelta
 from decimal import Decimal
 from enum import StrEnum
-from typing import Any, Dict, Iterable, Optional, cast
+from functools import cache
+from typing import Any, Dict, Iterable, NamedTuple, Optional, cast
 from uuid import UUID
 
+from asgiref.sync import sync_to_async
 from clickhouse_driver import Client  # pyright: ignore
 from django.conf import settings
+from django.db import models
 from django.utils.functional import LazyObject, cached_property
 
+from ads.ingest import BatchWriter
+from ads.journal import EventJournal, FsyncPolicy
+
 
 class DeviceType(StrEnum):
     mobile = 'mobile'
@@ -15,9 +23,11 @@ class DeviceType(StrEnum):
     tablet = 'tablet'
 
 
-class CostModel(StrEnum):
-    CPM = 'CPM'
-    CPC = 'CPC'
+class CostModel(models.TextChoices):
+    """Модель оплаты: поле Campaign.cost_model и колонка cost_model событий"""
+
+    CPM = 'CPM', 'За 1000 показов'
+    CPC = 'CPC', 'За клик'
 
 
 class NetworkType(StrEnum):
@@ -32,6 +42,132 @@ class ButtonType(StrEnum):
     video = 'video'
 
 
+class IngestMode(StrEnum):
+    sync = 'sync'
+    batch = 'batch'
+    journal = 'journal'
+
+
+class ShowEvent(NamedTuple):
+    """Показ в порядке колонок reklamito.shows.
+
+    Кортеж вместо словаря: на событие нет хеш-таблицы, а колонки пачки для
+    columnar INSERT получаются одним транспонированием (to_columns)
+    """
+
+    event_id: UUID
+    timestamp: datetime
+    banner_id: int
+    campaign_id: int
+    user_id: Optional[int] = None
+    ip_address: Optional[str] = None
+    user_agent: Optional[str] = None
+    country: Optional[str] = None
+    city: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    device_type: Optional[DeviceType] = None
+    os_family: Optional[str] = None
+    os_version: Optional[str] = None
+    browser_family: Optional[str] = None
+    browser_version: Optional[str] = None
+    screen_width: Optional[int] = None
+    screen_height: Optional[int] = None
+    language: Optional[str] = None
+    referer_domain: Optional[str] = None
+    referer_path: Optional[str] = None
+    is_robot: Optional[bool] = None
+    ad_position: Optional[str] = None
+    ad_size: Optional[str] = None
+    cost_model: Optional[CostModel] = None
+    session_id: Optional[str] = None
+    network_type: Optional[NetworkType] = None
+    connection_speed: Optional[int] = None
+    variant_id: Optional[int] = None
+
+
+class ClickEvent(NamedTuple):
+    """Клик в порядке колонок reklamito.clicks"""
+
+    show_event_id: UUID
+    timestamp: datetime
+    banner_id: int
+    campaign_id: int
+    click_x: Optional[int] = None
+    click_y: Optional[int] = None
+    element_id: Optional[str] = None
+    element_class: Optional[str] = None
+    referer_url: Optional[str] = None
+    http_method: Optional[str] = None
+    form_data: Optional[str] = None
+    time_to_click: Optional[float] = None
+    is_conversion: Optional[bool] = None
+    conversion_value: Optional[Decimal] = None
+    click_cost: Optional[Decimal] = None
+    button_type: Optional[ButtonType] = None
+    click_depth: Optional[int] = None
+    scroll_position: Optional[int] = None
+    hover_time: Optional[float] = None
+
+
+EventRecord = ShowEvent | ClickEvent
+
+
+def to_columns(events: Sequence[EventRecord]) -> list[list[Any]]:
+    """Пачка записей одной таблицы -> колонки для INSERT с columnar=True.
+
+    zip транспонирует на уровне C, это в разы быстрее поколоночного накопления в Python.
+    Колонки - списки: clickhouse_driver подготавливает значения на месте
+    """
+    return [list(column) for column in zip(*events)]
+
+
+class Granularity(StrEnum):
+    hour = 'hour'
+    day = 'day'
+
+
+class Dimension(StrEnum):
+    device_type = 'device_type'
+    os_family = 'os_family'
+    browser_family = 'browser_family'
+
+
+@dataclass(frozen=True, slots=True)
+class Stats:
+    shows: int = 0
+    clicks: int = 0
+    uniques: int = 0
+    click_cost: Decimal = Decimal(0)
+    conversions: int = 0
+    conversion_value: Decimal = Decimal(0)
+
+    @property
+    def ctr(self) -> float:
+        """CTR в процентах"""
+        return self.clicks / self.shows * 100 if self.shows else 0.0
+
+
+@dataclass(frozen=True, slots=True)
+class StatsPoint:
+    moment: datetime
+    stats: Stats
+
+
+@dataclass(frozen=True, slots=True)
+class BannerStats:
+    banner_id: int
+    campaign_id: int
+    stats: Stats
+
+
+@dataclass(frozen=True, slots=True)
+class BreakdownRow:
+    value: str
+    shows: int
+    uniques: int
+
+
 class ClickHouseWriteError(Exception):
     """Кастомное исключение для ошибок записи"""
 
@@ -85,13 +221,45 @@ class CHClient:
         session_id: Optional[str] = None,
         network_type: Optional[NetworkType] = None,
         connection_speed: Optional[int] = None,
+        variant_id: Optional[int] = None,
     ) -> None:
         """Логирование показа баннера"""
-        data = locals()
-        data.pop('self')
-        if data['is_robot'] is not None:
-            data['is_robot'] = int(data['is_robot'])
-        self._execute_insert(table='reklamito.shows', data=data, columns=data.keys())
+        event = ShowEvent(
+            event_id,
+            timestamp,
+            banner_id,
+            campaign_id,
+            user_id,
+            ip_address,
+            user_agent,
+            country,
+            city,
+            latitude,
+            longitude,
+            device_type,
+            os_family,
+            os_version,
+            browser_family,
+            browser_version,
+            screen_width,
+            screen_height,
+            language,
+            referer_domain,
+            referer_path,
+            is_robot,
+            ad_position,
+            ad_size,
+            cost_model,
+            session_id,
+            network_type,
+            connection_speed,
+            variant_id,
+        )
+        self._log_events(table='reklamito.shows', rows=[event])
+
+    def log_shows(self, events: Iterable[Dict[str, Any]]) -> None:
+        """Логирование нескольких показов одной вставкой. События - аргументы log_show"""
+        self._log_events(table='reklamito.shows', rows=[ShowEvent(**event) for event in events])
 
     def log_click(
         self,
@@ -116,24 +284,276 @@ class CHClient:
         hover_time: Optional[float] = None,
     ) -> None:
         """Логирование клика"""
-        data = locals()
-        data.pop('self')
-        if data['is_conversion'] is not None:
-            data['is_conversion'] = int(data['is_conversion'])
+        event = ClickEvent(
+            show_event_id,
+            timestamp,
+            banner_id,
+            campaign_id,
+            click_x,
+            click_y,
+            element_id,
+            element_class,
+            referer_url,
+            http_method,
+            form_data,
+            time_to_click,
+            is_conversion,
+            conversion_value,
+            click_cost,
+            button_type,
+            click_depth,
+            scroll_position,
+            hover_time,
+        )
+        self._log_events(table='reklamito.clicks', rows=[event])
+
+    async def alog_show(self, **kwargs: Any) -> None:
+        """Асинхронная версия log_show"""
+        await self._alog(self.log_show, **kwargs)
+
+    async def alog_shows(self, events: Iterable[Dict[str, Any]]) -> None:
+        """Асинхронная версия log_shows"""
+        await self._alog(self.log_shows, events)
+
+    async def alog_click(self, **kwargs: Any) -> None:
+        """Асинхронная версия log_click"""
+        await self._alog(self.log_click, **kwargs)
+
+    async def _alog(self, log: Callable[..., None], *args: Any, **kwargs: Any) -> None:
+        if settings.CH_INGEST_MODE == IngestMode.sync:
+            # Соединение clickhouse_driver блокирующее и не потокобезопасное, поэтому INSERT
+            # уходят в общий поток. Для ASGI рекомендуется режим batch или journal
+            await sync_to_async(log, thread_sensitive=True)(*args, **kwargs)
+        else:
+            log(*args, **kwargs)
 
-        self._execute_insert(table='reklamito.clicks', data=data, columns=data.keys())
+    def get_time_series(
+        self,
+        start: datetime,
+        end: datetime,
+        granularity: Granularity = Granularity.day,
+        campaign_id: Optional[int] = None,
+        banner_id: Optional[int] = None,
+    ) -> list[StatsPoint]:
+        """Показатели по часам или дням (UTC) за [start, end) из предагрегатов. Границы округляются до часа"""
+        rollup = _pick_rollup(start, end, granularity)
+        bucket = rollup.column if granularity == Granularity.hour or rollup.daily else f'toStartOfDay({rollup.column})'
+        where, params = rollup.where(campaign_id, banner_id)
+        rows = self.execute(
+            f'SELECT {bucket} AS moment, {_STATS_COLUMNS} FROM {rollup.table} '
+            f'WHERE {where} GROUP BY moment ORDER BY moment',
+            params,
+        )
+        return [StatsPoint(_to_datetime(moment), Stats(*values)) for moment, *values in rows]
+
+    def get_top_banners(
+        self,
+        start: datetime,
+        end: datetime,
+        campaign_id: Optional[int] = None,
+        order_by: str = 'shows',
+        limit: int = 10,
+    ) -> list[BannerStats]:
+        """Баннеры с наибольшим значением показателя order_by (поле Stats) за [start, end)"""
+        if order_by not in Stats.__dataclass_fields__:
+            raise ValueError(f'Unknown stats field {order_by}')
+        rollup = _pick_rollup(start, end)
+        where, params = rollup.where(campaign_id)
+        rows = self.execute(
+            f'SELECT banner_id, campaign_id, {_STATS_COLUMNS} FROM {rollup.table} WHERE {where} '
+            f'GROUP BY banner_id, campaign_id ORDER BY total_{order_by} DESC LIMIT %(limit)s',
+            params | {'limit': limit},
+        )
+        return [BannerStats(banner_id, campaign_id, Stats(*values)) for banner_id, campaign_id, *values in rows]
+
+    def get_breakdown(
+        self,
+        dimension: Dimension,
+        start: datetime,
+        end: datetime,
+        campaign_id: Optional[int] = None,
+        banner_id: Optional[int] = None,
+    ) -> list[BreakdownRow]:
+        """Показы и уникальные посетители по типу устройства, ОС или браузеру за [start, end).
+
+        Для периодов из целых дней (UTC) читается дневной предагрегат, иначе сырые показы
+        """
+        dimension = Dimension(dimension)
+        rollup = _pick_rollup(start, end)
+        if rollup.daily:
+            where, params = rollup.where(campaign_id, banner_id)
+            query = (
+                f'SELECT {dimension} AS value, sum(shows) AS total_shows, uniqMerge(uniques) '
+                f'FROM reklamito.breakdown_daily WHERE {where} GROUP BY value ORDER BY total_shows DESC'
+            )
+        else:
+            where, params = _Rollup('reklamito.shows', 'timestamp', start, end, daily=False).where(
+                campaign_id, banner_id
+            )
+            value = 'toString(device_type)' if dimension == Dimension.device_type else str(dimension)
+            if settings.CH_READ_EVENTS_V2:
+                table, unit = 'reklamito.shows_v2', _UNIT_EXPRESSION_V2
+            else:
+                table, unit, value = 'reklamito.shows', _UNIT_EXPRESSION, f"ifNull({value}, '')"
+            query = (
+                f'SELECT {value} AS value, count() AS shows, uniq({unit}) '
+                f'FROM {table} WHERE {where} GROUP BY value ORDER BY shows DESC'
+            )
+        return [BreakdownRow(value, shows, uniques) for value, shows, uniques in self.execute(query, params)]
+
+    def execute(
+        self, query: str, params: Optional[Dict[str, Any] | list[Dict[str, Any]]] = None
+    ) -> list[tuple[Any, ...]]:
+        """Произвольный запрос: чтение отчетов и миграции схемы"""
+        return self._client.execute(query, params)  # pyright: ignore
 
-    def _execute_insert(self, table: str, data: Dict[str, Any], columns: Iterable[str]) -> None:
-        """Выполнение INSERT запроса"""
+    def insert_rows(self, table: str, rows: list[Dict[str, Any]], dedup_token: Optional[str] = None) -> None:
+        """Вставка пачки однотипных строк-словарей одним INSERT"""
+        if rows:
+            columns = tuple(rows[0])
+            data = [[row[column] for row in rows] for column in columns]
+            self._execute_insert(table=table, data=data, columns=columns, dedup_token=dedup_token)
+
+    def insert_events(self, table: str, events: Sequence[EventRecord], dedup_token: Optional[str] = None) -> None:
+        """Вставка пачки записей ShowEvent или ClickEvent одним INSERT"""
+        if events:
+            self.insert_columns(table, type(events[0])._fields, to_columns(events), dedup_token=dedup_token)
+
+    def insert_columns(
+        self, table: str, columns: tuple[str, ...], data: list[list[Any]], dedup_token: Optional[str] = None
+    ) -> None:
+        """Вставка уже разложенных по колонкам данных, например подготовленных в другом процессе"""
+        if data and data[0]:
+            self._execute_insert(table=table, data=data, columns=columns, dedup_token=dedup_token)
+
+    def _log_events(self, table: str, rows: list[EventRecord]) -> None:
+        match settings.CH_INGEST_MODE:
+            case IngestMode.batch:
+                for row in rows:
+                    CH_BATCH_WRITER.put(table, row)
+            case IngestMode.journal:
+                try:
+                    for row in rows:
+                        CH_JOURNAL.append(table, row._asdict())
+                except OSError as e:
+                    raise ClickHouseWriteError(f'Failed to journal event for {table}: {str(e)}') from e
+            case _:
+                self.insert_events(table=table, events=rows)
+
+    def _execute_insert(
+        self,
+        table: str,
+        data: Sequence[Sequence[Any]],
+        columns: tuple[str, ...],
+        dedup_token: Optional[str] = None,
+    ) -> None:
+        """Выполнение INSERT запроса, данные - по колонкам"""
+        query_settings: dict[str, Any] = {}
+        if dedup_token:
+            query_settings['insert_deduplication_token'] = dedup_token
         try:
-            self._client.execute(f'INSERT INTO {table} ({", ".join(columns)}) VALUES', [data])  # pyright: ignore
+            self._client.execute(  # pyright: ignore
+                _insert_query(table, columns), data, columnar=True, settings=query_settings
+            )
         except Exception as e:
             raise ClickHouseWriteError(f'Failed to insert into {table}: {str(e)}') from e
 
 
+# Псевдонимы не совпадают с колонками: иначе ClickHouse подставит агрегат в агрегат
+_STATS_COLUMNS = ', '.join(
+    f'{function}({field}) AS total_{field}'
+    for function, field in (
+        ('sum', 'shows'),
+        ('sum', 'clicks'),
+        ('uniqMerge', 'uniques'),
+        ('sum', 'click_cost'),
+        ('sum', 'conversions'),
+        ('sum', 'conversion_value'),
+    )
+)
+# Посетитель для подсчета уникальных, как в материализованных представлениях ads/ch_migrations/0003_rollups.sql
+_UNIT_EXPRESSION = "ifNull(session_id, concat(ifNull(ip_address, ''), '|', ifNull(user_agent, '')))"
+# То же для reklamito.shows_v2, где пустые значения - '' и 0, а User-Agent заменен на ua_id
+_UNIT_EXPRESSION_V2 = "if(session_id != '', session_id, concat(ip_address, '|', toString(ua_id)))"
+
+
+@dataclass(frozen=True, slots=True)
+class _Rollup:
+    table: str
+    column: str
+    start: datetime
+    end: datetime
+    daily: bool
+
+    def where(self, campaign_id: Optional[int] = None, banner_id: Optional[int] = None) -> tuple[str, Dict[str, Any]]:
+        conditions = [f'{self.column} >= %(start)s', f'{self.column} < %(end)s']
+        # Колонки в UTC, а clickhouse_driver переводит datetime с зоной в зону сервера, поэтому без зоны
+        start = self.start.astimezone(UTC).replace(tzinfo=None)
+        end = self.end.astimezone(UTC).replace(tzinfo=None)
+        params: Dict[str, Any] = (
+            {'start': start.date(), 'end': end.date()} if self.daily else {'start': start, 'end': end}
+        )
+        if campaign_id is not None:
+            conditions.append('campaign_id = %(campaign_id)s')
+            params['campaign_id'] = campaign_id
+        if banner_id is not None:
+            conditions.append('banner_id = %(banner_id)s')
+            params['banner_id'] = banner_id
+        return ' AND '.join(conditions), params
+
+
+def _pick_rollup(start: datetime, end: datetime, granularity: Optional[Granularity] = None) -> _Rollup:
+    """Самый крупный предагрегат, способный ответить за [start, end): дневной, если границы - полночь UTC
+    и не нужна разбивка по часам, иначе часовой"""
+    start = start.astimezone(UTC).replace(minute=0, second=0, microsecond=0)
+    end_utc = end.astimezone(UTC)
+    end = end_utc.replace(minute=0, second=0, microsecond=0)
+    if end < end_utc:
+        end += timedelta(hours=1)
+    if granularity != Granularity.hour and start.hour == 0 and end.hour == 0:
+        return _Rollup('reklamito.stats_daily', 'day', start, end, daily=True)
+    return _Rollup('reklamito.stats_hourly', 'hour', start, end, daily=False)
+
+
+def _to_datetime(moment: datetime | date) -> datetime:
+    if not isinstance(moment, datetime):
+        return datetime.combine(moment, time.min, UTC)
+    return moment if moment.tzinfo else moment.replace(tzinfo=UTC)
+
+
+@cache
+def _insert_query(table: str, columns: tuple[str, ...]) -> str:
+    """Текст INSERT собирается один раз на таблицу и набор колонок"""
+    return f'INSERT INTO {table} ({", ".join(columns)}) VALUES'
+
+
 class LazyCHCLient(LazyObject):
     def _setup(self) -> None:
         self._wrapped = CHClient()
 
 
+class LazyBatchWriter(LazyObject):
+    def _setup(self) -> None:
+        # Отдельный клиент: соединение clickhouse_driver не потокобезопасно
+        self._wrapped = BatchWriter(
+            flush=CHClient().insert_events,
+            max_rows=settings.CH_BATCH_MAX_ROWS,
+            max_delay=settings.CH_BATCH_MAX_DELAY,
+            queue_size=settings.CH_BATCH_QUEUE_SIZE,
+        )
+
+
+class LazyEventJournal(LazyObject):
+    def _setup(self) -> None:
+        self._wrapped = EventJournal(
+            directory=settings.CH_JOURNAL_DIR,
+            fsync=FsyncPolicy(settings.CH_JOURNAL_FSYNC),
+            fsync_interval=settings.CH_JOURNAL_FSYNC_INTERVAL,
+            segment_max_bytes=settings.CH_JOURNAL_SEGMENT_MAX_BYTES,
+            segment_max_age=settings.CH_JOURNAL_SEGMENT_MAX_AGE,
+        )
+
+
 CH_CLIENT = cast(CHClient, LazyCHCLient())
+CH_BATCH_WRITER = cast(BatchWriter, LazyBatchWriter())
+CH_JOURNAL = cast(EventJournal, LazyEventJournal())
@@ -28,11 +28,13 @@ CREATE TABLE IF NOT EXISTS reklamito.shows
     cost_model       Nullable(Enum8('CPM' = 1, 'CPC' = 2)),
     session_id       Nullable(String),
     network_type     Nullable(Enum8('wifi' = 1, 'cellular' = 2, 'wired' = 3)),
-    connection_speed Nullable(UInt32)
+    connection_speed Nullable(UInt32),
+    variant_id       Nullable(UInt32)  -- Вариант эксперимента (experiments.Variant)
 )
 ENGINE = MergeTree()
 ORDER BY (timestamp, banner_id, campaign_id)
-TTL timestamp_date + INTERVAL 18 MONTH;
+TTL timestamp_date + INTERVAL 18 MONTH
+SETTINGS non_replicated_deduplication_window = 1000;  -- Для insert_deduplication_token из ship_events
 
 CREATE TABLE IF NOT EXISTS reklamito.clicks
 (
@@ -59,4 +61,10 @@ CREATE TABLE IF NOT EXISTS reklamito.clicks
 )
 ENGINE = MergeTree()
 ORDER BY (timestamp, banner_id, campaign_id)
-TTL timestamp_date + INTERVAL 18 MONTH;
+TTL timestamp_date + INTERVAL 18 MONTH
+SETTINGS non_replicated_deduplication_window = 1000;  -- Для insert_deduplication_token из ship_events
+
+ALTER TABLE reklamito.shows MODIFY SETTING non_replicated_deduplication_window = 1000;
+ALTER TABLE reklamito.clicks MODIFY SETTING non_replicated_deduplication_window = 1000;
+
+ALTER TABLE reklamito.shows ADD COLUMN IF NOT EXISTS variant_id Nullable(UInt32) AFTER connection_speed;
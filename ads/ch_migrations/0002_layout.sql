@@ -0,0 +1,98 @@
+-- Физическое устройство таблиц событий: помесячные партиции (TTL удаляет партиции целиком, а не переписывает
+-- куски), проекция показов в порядке кампания/баннер/время для отчетов по кампании, bloom-фильтры по id показа
+-- для связи кликов с показами (WHERE event_id IN (SELECT show_event_id FROM reklamito.clicks WHERE ...)).
+-- Ключ партиционирования и сортировки не меняется ALTER, поэтому таблицы пересоздаются с копированием данных.
+-- Запускать при остановленной записи событий (ship_events, CH_INGEST_MODE=journal копит события в журнале)
+
+-- Предагрегаты, если они уже были созданы из ch.sql: пересоздаются миграцией 0003. Таблицы удаляются вместе
+-- с представлениями: 0003 заполняет их заново из всех событий, и старые строки посчитались бы дважды
+DROP VIEW IF EXISTS reklamito.stats_hourly_shows_mv;
+DROP VIEW IF EXISTS reklamito.stats_hourly_clicks_mv;
+DROP VIEW IF EXISTS reklamito.stats_daily_shows_mv;
+DROP VIEW IF EXISTS reklamito.stats_daily_clicks_mv;
+DROP VIEW IF EXISTS reklamito.breakdown_daily_mv;
+DROP TABLE IF EXISTS reklamito.stats_hourly;
+DROP TABLE IF EXISTS reklamito.stats_daily;
+DROP TABLE IF EXISTS reklamito.breakdown_daily;
+
+DROP TABLE IF EXISTS reklamito.shows_new;
+CREATE TABLE reklamito.shows_new
+(
+    event_id         UUID,
+    timestamp        DateTime64(3, 'UTC'),
+    timestamp_date   Date MATERIALIZED toDate(timestamp),  -- Для TTL и партиций
+    banner_id        UInt32,
+    campaign_id      UInt32,
+    user_id          Nullable(UInt32),
+    ip_address       Nullable(String),
+    user_agent       Nullable(String),
+    country          Nullable(String),
+    city             Nullable(String),
+    latitude         Nullable(Float64),
+    longitude        Nullable(Float64),
+    device_type      Nullable(Enum8('mobile' = 1, 'desktop' = 2, 'tablet' = 3)),
+    os_family        Nullable(String),
+    os_version       Nullable(String),
+    browser_family   Nullable(String),
+    browser_version  Nullable(String),
+    screen_width     Nullable(UInt16),
+    screen_height    Nullable(UInt16),
+    language         Nullable(String),
+    referer_domain   Nullable(String),
+    referer_path     Nullable(String),
+    is_robot         Nullable(UInt8),
+    ad_position      Nullable(String),
+    ad_size          Nullable(String),
+    cost_model       Nullable(Enum8('CPM' = 1, 'CPC' = 2)),
+    session_id       Nullable(String),
+    network_type     Nullable(Enum8('wifi' = 1, 'cellular' = 2, 'wired' = 3)),
+    connection_speed Nullable(UInt32),
+    variant_id       Nullable(UInt32),  -- Вариант эксперимента (experiments.Variant)
+    INDEX event_id_bf event_id TYPE bloom_filter(0.01) GRANULARITY 4,
+    PROJECTION by_campaign (SELECT * ORDER BY (campaign_id, banner_id, timestamp))
+)
+ENGINE = MergeTree()
+PARTITION BY toYYYYMM(timestamp_date)
+ORDER BY (timestamp, banner_id, campaign_id)
+TTL timestamp_date + INTERVAL 18 MONTH
+SETTINGS non_replicated_deduplication_window = 1000, ttl_only_drop_parts = 1;
+
+INSERT INTO reklamito.shows_new SELECT * FROM reklamito.shows;
+EXCHANGE TABLES reklamito.shows AND reklamito.shows_new;
+DROP TABLE reklamito.shows_new;
+
+-- Кликов на порядки меньше, чем показов: сортировка сразу по кампании и баннеру, без проекции
+DROP TABLE IF EXISTS reklamito.clicks_new;
+CREATE TABLE reklamito.clicks_new
+(
+    show_event_id    UUID,
+    timestamp        DateTime64(3, 'UTC'),
+    timestamp_date   Date MATERIALIZED toDate(timestamp),  -- Для TTL и партиций
+    banner_id        UInt32,
+    campaign_id      UInt32,
+    click_x          Nullable(UInt16),
+    click_y          Nullable(UInt16),
+    element_id       Nullable(String),
+    element_class    Nullable(String),
+    referer_url      Nullable(String),
+    http_method      Nullable(String),
+    form_data        Nullable(String),
+    time_to_click    Nullable(Float64),
+    is_conversion    Nullable(UInt8),
+    conversion_value Nullable(Decimal(18, 6)),
+    click_cost       Nullable(Decimal(18, 6)),
+    button_type      Nullable(Enum8('text' = 1, 'image' = 2, 'video' = 3)),
+    click_depth      Nullable(UInt8),
+    scroll_position  Nullable(UInt16),
+    hover_time       Nullable(UInt32),
+    INDEX show_event_id_bf show_event_id TYPE bloom_filter(0.01) GRANULARITY 4
+)
+ENGINE = MergeTree()
+PARTITION BY toYYYYMM(timestamp_date)
+ORDER BY (campaign_id, banner_id, timestamp)
+TTL timestamp_date + INTERVAL 18 MONTH
+SETTINGS non_replicated_deduplication_window = 1000, ttl_only_drop_parts = 1;
+
+INSERT INTO reklamito.clicks_new SELECT * FROM reklamito.clicks;
+EXCHANGE TABLES reklamito.clicks AND reklamito.clicks_new;
+DROP TABLE reklamito.clicks_new;
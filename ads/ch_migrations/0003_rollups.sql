@@ -0,0 +1,182 @@
+-- Предагрегаты для отчетов (CHClient.get_time_series, get_top_banners, get_breakdown). Показы и клики попадают
+-- в одни таблицы через отдельные материализованные представления, строки с одним ключом схлопываются при слиянии.
+-- Уникальные посетители - по сессии, без нее по IP + User-Agent. Часы и дни - в UTC, как TIME_ZONE проекта
+CREATE TABLE IF NOT EXISTS reklamito.stats_hourly
+(
+    hour             DateTime('UTC'),
+    campaign_id      UInt32,
+    banner_id        UInt32,
+    shows            SimpleAggregateFunction(sum, UInt64),
+    clicks           SimpleAggregateFunction(sum, UInt64),
+    uniques          AggregateFunction(uniq, String),
+    click_cost       SimpleAggregateFunction(sum, Decimal(38, 6)),
+    conversions      SimpleAggregateFunction(sum, UInt64),
+    conversion_value SimpleAggregateFunction(sum, Decimal(38, 6))
+)
+ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(hour)
+ORDER BY (campaign_id, banner_id, hour)
+TTL hour + INTERVAL 18 MONTH;
+
+CREATE TABLE IF NOT EXISTS reklamito.stats_daily
+(
+    day              Date,
+    campaign_id      UInt32,
+    banner_id        UInt32,
+    shows            SimpleAggregateFunction(sum, UInt64),
+    clicks           SimpleAggregateFunction(sum, UInt64),
+    uniques          AggregateFunction(uniq, String),
+    click_cost       SimpleAggregateFunction(sum, Decimal(38, 6)),
+    conversions      SimpleAggregateFunction(sum, UInt64),
+    conversion_value SimpleAggregateFunction(sum, Decimal(38, 6))
+)
+ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(day)
+ORDER BY (campaign_id, banner_id, day)
+TTL day + INTERVAL 18 MONTH;
+
+-- Разбивка по устройствам, ОС и браузерам есть только у показов: в кликах этих полей нет
+CREATE TABLE IF NOT EXISTS reklamito.breakdown_daily
+(
+    day            Date,
+    campaign_id    UInt32,
+    banner_id      UInt32,
+    device_type    LowCardinality(String),
+    os_family      LowCardinality(String),
+    browser_family LowCardinality(String),
+    shows          SimpleAggregateFunction(sum, UInt64),
+    uniques        AggregateFunction(uniq, String)
+)
+ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(day)
+ORDER BY (campaign_id, banner_id, day, device_type, os_family, browser_family)
+TTL day + INTERVAL 18 MONTH;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS reklamito.stats_hourly_shows_mv TO reklamito.stats_hourly AS
+SELECT
+    toStartOfHour(toDateTime(timestamp, 'UTC')) AS hour,
+    campaign_id,
+    banner_id,
+    count() AS shows,
+    uniqState(ifNull(session_id, concat(ifNull(ip_address, ''), '|', ifNull(user_agent, '')))) AS uniques
+FROM reklamito.shows
+GROUP BY hour, campaign_id, banner_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS reklamito.stats_hourly_clicks_mv TO reklamito.stats_hourly AS
+SELECT
+    toStartOfHour(toDateTime(timestamp, 'UTC')) AS hour,
+    campaign_id,
+    banner_id,
+    count() AS clicks,
+    sum(ifNull(click_cost, 0)) AS click_cost,
+    countIf(is_conversion = 1) AS conversions,
+    sum(ifNull(conversion_value, 0)) AS conversion_value
+FROM reklamito.clicks
+GROUP BY hour, campaign_id, banner_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS reklamito.stats_daily_shows_mv TO reklamito.stats_daily AS
+SELECT
+    toDate(timestamp, 'UTC') AS day,
+    campaign_id,
+    banner_id,
+    count() AS shows,
+    uniqState(ifNull(session_id, concat(ifNull(ip_address, ''), '|', ifNull(user_agent, '')))) AS uniques
+FROM reklamito.shows
+GROUP BY day, campaign_id, banner_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS reklamito.stats_daily_clicks_mv TO reklamito.stats_daily AS
+SELECT
+    toDate(timestamp, 'UTC') AS day,
+    campaign_id,
+    banner_id,
+    count() AS clicks,
+    sum(ifNull(click_cost, 0)) AS click_cost,
+    countIf(is_conversion = 1) AS conversions,
+    sum(ifNull(conversion_value, 0)) AS conversion_value
+FROM reklamito.clicks
+GROUP BY day, campaign_id, banner_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS reklamito.breakdown_daily_mv TO reklamito.breakdown_daily AS
+SELECT
+    toDate(timestamp, 'UTC') AS day,
+    campaign_id,
+    banner_id,
+    ifNull(toString(device_type), '') AS device_type,
+    ifNull(os_family, '') AS os_family,
+    ifNull(browser_family, '') AS browser_family,
+    count() AS shows,
+    uniqState(ifNull(session_id, concat(ifNull(ip_address, ''), '|', ifNull(user_agent, '')))) AS uniques
+FROM reklamito.shows
+GROUP BY day, campaign_id, banner_id, device_type, os_family, browser_family;
+
+-- Представления видят только новые вставки. События до их создания переносятся здесь же: граница - время
+-- создания представлений, поэтому события, записанные после него, не учитываются дважды
+INSERT INTO reklamito.stats_hourly (hour, campaign_id, banner_id, shows, uniques)
+SELECT
+    toStartOfHour(toDateTime(timestamp, 'UTC')) AS hour,
+    campaign_id,
+    banner_id,
+    count(),
+    uniqState(ifNull(session_id, concat(ifNull(ip_address, ''), '|', ifNull(user_agent, ''))))
+FROM reklamito.shows
+WHERE timestamp < (SELECT min(metadata_modification_time) FROM system.tables
+                   WHERE database = 'reklamito' AND endsWith(name, '_mv'))
+GROUP BY hour, campaign_id, banner_id;
+
+INSERT INTO reklamito.stats_hourly
+    (hour, campaign_id, banner_id, clicks, click_cost, conversions, conversion_value)
+SELECT
+    toStartOfHour(toDateTime(timestamp, 'UTC')) AS hour,
+    campaign_id,
+    banner_id,
+    count(),
+    sum(ifNull(click_cost, 0)),
+    countIf(is_conversion = 1),
+    sum(ifNull(conversion_value, 0))
+FROM reklamito.clicks
+WHERE timestamp < (SELECT min(metadata_modification_time) FROM system.tables
+                   WHERE database = 'reklamito' AND endsWith(name, '_mv'))
+GROUP BY hour, campaign_id, banner_id;
+
+INSERT INTO reklamito.stats_daily (day, campaign_id, banner_id, shows, uniques)
+SELECT
+    toDate(timestamp, 'UTC') AS day,
+    campaign_id,
+    banner_id,
+    count(),
+    uniqState(ifNull(session_id, concat(ifNull(ip_address, ''), '|', ifNull(user_agent, ''))))
+FROM reklamito.shows
+WHERE timestamp < (SELECT min(metadata_modification_time) FROM system.tables
+                   WHERE database = 'reklamito' AND endsWith(name, '_mv'))
+GROUP BY day, campaign_id, banner_id;
+
+INSERT INTO reklamito.stats_daily
+    (day, campaign_id, banner_id, clicks, click_cost, conversions, conversion_value)
+SELECT
+    toDate(timestamp, 'UTC') AS day,
+    campaign_id,
+    banner_id,
+    count(),
+    sum(ifNull(click_cost, 0)),
+    countIf(is_conversion = 1),
+    sum(ifNull(conversion_value, 0))
+FROM reklamito.clicks
+WHERE timestamp < (SELECT min(metadata_modification_time) FROM system.tables
+                   WHERE database = 'reklamito' AND endsWith(name, '_mv'))
+GROUP BY day, campaign_id, banner_id;
+
+INSERT INTO reklamito.breakdown_daily
+    (day, campaign_id, banner_id, device_type, os_family, browser_family, shows, uniques)
+SELECT
+    toDate(timestamp, 'UTC') AS day,
+    campaign_id,
+    banner_id,
+    ifNull(toString(device_type), '') AS device,
+    ifNull(os_family, '') AS os,
+    ifNull(browser_family, '') AS browser,
+    count(),
+    uniqState(ifNull(session_id, concat(ifNull(ip_address, ''), '|', ifNull(user_agent, ''))))
+FROM reklamito.shows
+WHERE timestamp < (SELECT min(metadata_modification_time) FROM system.tables
+                   WHERE database = 'reklamito' AND endsWith(name, '_mv'))
+GROUP BY day, campaign_id, banner_id, device, os, browser;
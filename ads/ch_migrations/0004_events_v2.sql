@@ -0,0 +1,150 @@
+-- Вторая версия таблиц событий: LowCardinality для строк с небольшим числом значений, кодеки, значения по умолчанию
+-- вместо Nullable (лишний файл-маска на колонку), User-Agent заменен на id строки в reklamito.user_agents.
+-- Пока запись идет в v1, представления *_v2_mv дублируют в v2 каждую вставку, старые данные переносит
+-- команда backfill_events_v2. Чтение сырых событий переключается на v2 настройкой CH_READ_EVENTS_V2
+CREATE TABLE IF NOT EXISTS reklamito.shows_v2
+(
+    event_id         UUID,
+    timestamp        DateTime64(3, 'UTC') CODEC(DoubleDelta, ZSTD(1)),
+    timestamp_date   Date MATERIALIZED toDate(timestamp) CODEC(DoubleDelta, ZSTD(1)),
+    banner_id        UInt32 CODEC(ZSTD(1)),
+    campaign_id      UInt32 CODEC(ZSTD(1)),
+    user_id          UInt32 CODEC(ZSTD(1)),  -- 0 - аноним
+    ip_address       String CODEC(ZSTD(1)),
+    ua_id            UInt64 CODEC(ZSTD(1)),  -- halfMD5(User-Agent), 0 - нет заголовка
+    country          LowCardinality(String),
+    city             LowCardinality(String),
+    latitude         Float64 DEFAULT nan CODEC(Gorilla, ZSTD(1)),
+    longitude        Float64 DEFAULT nan CODEC(Gorilla, ZSTD(1)),
+    device_type      Enum8('' = 0, 'mobile' = 1, 'desktop' = 2, 'tablet' = 3),
+    os_family        LowCardinality(String),
+    os_version       LowCardinality(String),
+    browser_family   LowCardinality(String),
+    browser_version  LowCardinality(String),
+    screen_width     UInt16 CODEC(ZSTD(1)),
+    screen_height    UInt16 CODEC(ZSTD(1)),
+    language         LowCardinality(String),
+    referer_domain   LowCardinality(String),
+    referer_path     String CODEC(ZSTD(3)),
+    is_robot         UInt8,
+    ad_position      LowCardinality(String),
+    ad_size          LowCardinality(String),
+    cost_model       Enum8('' = 0, 'CPM' = 1, 'CPC' = 2),
+    session_id       String CODEC(ZSTD(1)),
+    network_type     Enum8('' = 0, 'wifi' = 1, 'cellular' = 2, 'wired' = 3),
+    connection_speed UInt32 CODEC(T64, ZSTD(1)),
+    variant_id       UInt32 CODEC(ZSTD(1)),  -- 0 - вне эксперимента
+    INDEX event_id_bf event_id TYPE bloom_filter(0.01) GRANULARITY 4,
+    -- Только колонки отчета по срезам за неполные дни (CHClient.get_breakdown): копия всех колонок
+    -- удвоила бы размер таблицы, а остальные отчеты по кампании читают предагрегаты
+    PROJECTION by_campaign (
+        SELECT campaign_id, banner_id, timestamp, device_type, os_family, browser_family, session_id, ip_address, ua_id
+        ORDER BY (campaign_id, banner_id, timestamp)
+    )
+)
+ENGINE = MergeTree()
+PARTITION BY toYYYYMM(timestamp_date)
+ORDER BY (timestamp, banner_id, campaign_id)
+TTL timestamp_date + INTERVAL 18 MONTH
+SETTINGS non_replicated_deduplication_window = 1000, ttl_only_drop_parts = 1;
+
+CREATE TABLE IF NOT EXISTS reklamito.clicks_v2
+(
+    show_event_id    UUID,
+    timestamp        DateTime64(3, 'UTC') CODEC(Delta, ZSTD(1)),
+    timestamp_date   Date MATERIALIZED toDate(timestamp) CODEC(Delta, ZSTD(1)),
+    banner_id        UInt32 CODEC(ZSTD(1)),
+    campaign_id      UInt32 CODEC(ZSTD(1)),
+    click_x          UInt16 CODEC(ZSTD(1)),
+    click_y          UInt16 CODEC(ZSTD(1)),
+    element_id       LowCardinality(String),
+    element_class    LowCardinality(String),
+    referer_url      String CODEC(ZSTD(3)),
+    http_method      LowCardinality(String),
+    form_data        String CODEC(ZSTD(3)),
+    time_to_click    Float64 DEFAULT nan CODEC(Gorilla, ZSTD(1)),
+    is_conversion    UInt8,
+    conversion_value Decimal(18, 6) CODEC(ZSTD(1)),
+    click_cost       Decimal(18, 6) CODEC(ZSTD(1)),
+    button_type      Enum8('' = 0, 'text' = 1, 'image' = 2, 'video' = 3),
+    click_depth      UInt8,
+    scroll_position  UInt16 CODEC(ZSTD(1)),
+    hover_time       UInt32 CODEC(ZSTD(1)),
+    INDEX show_event_id_bf show_event_id TYPE bloom_filter(0.01) GRANULARITY 4
+)
+ENGINE = MergeTree()
+PARTITION BY toYYYYMM(timestamp_date)
+ORDER BY (campaign_id, banner_id, timestamp)
+TTL timestamp_date + INTERVAL 18 MONTH
+SETTINGS non_replicated_deduplication_window = 1000, ttl_only_drop_parts = 1;
+
+-- Строки User-Agent по id. Уникальных строк на порядки меньше, чем показов; дубли схлопываются при слиянии
+CREATE TABLE IF NOT EXISTS reklamito.user_agents
+(
+    ua_id      UInt64,
+    user_agent String CODEC(ZSTD(3))
+)
+ENGINE = ReplacingMergeTree()
+ORDER BY ua_id;
+
+-- Порядок колонок совпадает с таблицами: backfill_events_v2 вставляет результат этих SELECT по позициям
+CREATE MATERIALIZED VIEW IF NOT EXISTS reklamito.shows_v2_mv TO reklamito.shows_v2 AS
+SELECT
+    event_id,
+    timestamp,
+    banner_id,
+    campaign_id,
+    ifNull(user_id, 0) AS user_id,
+    ifNull(ip_address, '') AS ip_address,
+    if(user_agent IS NULL, 0, halfMD5(assumeNotNull(user_agent))) AS ua_id,
+    ifNull(country, '') AS country,
+    ifNull(city, '') AS city,
+    ifNull(latitude, nan) AS latitude,
+    ifNull(longitude, nan) AS longitude,
+    ifNull(toString(device_type), '') AS device_type,
+    ifNull(os_family, '') AS os_family,
+    ifNull(os_version, '') AS os_version,
+    ifNull(browser_family, '') AS browser_family,
+    ifNull(browser_version, '') AS browser_version,
+    ifNull(screen_width, 0) AS screen_width,
+    ifNull(screen_height, 0) AS screen_height,
+    ifNull(language, '') AS language,
+    ifNull(referer_domain, '') AS referer_domain,
+    ifNull(referer_path, '') AS referer_path,
+    ifNull(is_robot, 0) AS is_robot,
+    ifNull(ad_position, '') AS ad_position,
+    ifNull(ad_size, '') AS ad_size,
+    ifNull(toString(cost_model), '') AS cost_model,
+    ifNull(session_id, '') AS session_id,
+    ifNull(toString(network_type), '') AS network_type,
+    ifNull(connection_speed, 0) AS connection_speed,
+    ifNull(variant_id, 0) AS variant_id
+FROM reklamito.shows;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS reklamito.clicks_v2_mv TO reklamito.clicks_v2 AS
+SELECT
+    show_event_id,
+    timestamp,
+    banner_id,
+    campaign_id,
+    ifNull(click_x, 0) AS click_x,
+    ifNull(click_y, 0) AS click_y,
+    ifNull(element_id, '') AS element_id,
+    ifNull(element_class, '') AS element_class,
+    ifNull(referer_url, '') AS referer_url,
+    ifNull(http_method, '') AS http_method,
+    ifNull(form_data, '') AS form_data,
+    ifNull(time_to_click, nan) AS time_to_click,
+    ifNull(is_conversion, 0) AS is_conversion,
+    ifNull(conversion_value, 0) AS conversion_value,
+    ifNull(click_cost, 0) AS click_cost,
+    ifNull(toString(button_type), '') AS button_type,
+    ifNull(click_depth, 0) AS click_depth,
+    ifNull(scroll_position, 0) AS scroll_position,
+    ifNull(hover_time, 0) AS hover_time
+FROM reklamito.clicks;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS reklamito.user_agents_mv TO reklamito.user_agents AS
+SELECT DISTINCT halfMD5(assumeNotNull(user_agent)) AS ua_id, assumeNotNull(user_agent) AS user_agent
+FROM reklamito.shows
+WHERE user_agent IS NOT NULL;
@@ -0,0 +1,143 @@
+import atexit
+import logging
+import os
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# (ключ, поле хеша). Поле None означает обычный счетчик (INCRBY), иначе HINCRBY
+CounterKey = tuple[str, str | None]
+Deltas = dict[CounterKey, int]
+# Ключ HyperLogLog -> элементы для PFADD
+Uniques = dict[str, set[str]]
+
+
+@dataclass
+class CounterAggregatorStats:
+    pending_keys: int
+    pending_events: int
+    flushes: int
+    flushed_events: int
+    lost_events: int
+
+
+class CounterAggregator:
+    """Локальная агрегация приращений счетчиков с периодической пакетной отправкой.
+
+    Приращения копятся в памяти воркера и отправляются одной транзакцией раз в
+    `flush_interval` секунд или по накоплении `flush_events` событий. Если
+    отправка не удалась, приращения возвращаются в буфер; при превышении
+    `max_pending` неотправленных событий буфер отправляется синхронно, а при
+    повторной ошибке отбрасывается. Таким образом при падении воркера или
+    Redis теряется не больше `max_pending` событий.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[Deltas, Uniques], None],
+        flush_interval: float,
+        flush_events: int,
+        max_pending: int,
+        flush_on_exit: bool,
+    ) -> None:
+        self._flush = flush
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.max_pending = max_pending
+        self.flush_on_exit = flush_on_exit
+        self._deltas: Deltas = {}
+        self._uniques: Uniques = {}
+        self._pending_events = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid: int | None = None
+
+        self._flushes = 0
+        self._flushed_events = 0
+        self._lost_events = 0
+
+    def incr(self, key: str, amount: int = 1, field: str | None = None) -> None:
+        """Приращение от одного события"""
+        self.merge({(key, field): amount}, {}, events=1)
+
+    def merge(self, deltas: Deltas, uniques: Uniques, events: int) -> None:
+        """Приращения и элементы для PFADD от events событий.
+
+        Событие (показ, клик) меняет несколько счетчиков, а лимиты flush_events и max_pending
+        считаются в событиях, поэтому число событий передает вызывающий
+        """
+        self._ensure_started()
+        with self._lock:
+            for counter_key, amount in deltas.items():
+                self._deltas[counter_key] = self._deltas.get(counter_key, 0) + amount
+            for key, members in uniques.items():
+                self._uniques.setdefault(key, set()).update(members)
+            self._pending_events += events
+            pending = self._pending_events
+        self._check_pending(pending)
+
+    def pending(self, key: str, field: str | None = None) -> int:
+        """Еще не отправленное приращение счетчика в этом воркере"""
+        with self._lock:
+            return self._deltas.get((key, field), 0)
+
+    def flush(self, drop_on_error: bool = False) -> None:
+        with self._flush_lock:
+            with self._lock:
+                deltas, uniques, events = self._deltas, self._uniques, self._pending_events
+                self._deltas, self._uniques, self._pending_events = {}, {}, 0
+            if not deltas and not uniques:
+                return
+            try:
+                self._flush(deltas, uniques)
+            except Exception:
+                logger.exception('Failed to flush %d counter increments', events)
+                with self._lock:
+                    if drop_on_error:
+                        self._lost_events += events
+                        return
+                    for counter_key, amount in deltas.items():
+                        self._deltas[counter_key] = self._deltas.get(counter_key, 0) + amount
+                    for key, members in uniques.items():
+                        self._uniques.setdefault(key, set()).update(members)
+                    self._pending_events += events
+                return
+            with self._lock:
+                self._flushes += 1
+                self._flushed_events += events
+
+    def stats(self) -> CounterAggregatorStats:
+        with self._lock:
+            return CounterAggregatorStats(
+                pending_keys=len(self._deltas) + len(self._uniques),
+                pending_events=self._pending_events,
+                flushes=self._flushes,
+                flushed_events=self._flushed_events,
+                lost_events=self._lost_events,
+            )
+
+    def _check_pending(self, pending: int) -> None:
+        if pending >= self.max_pending:
+            self.flush(drop_on_error=True)
+        elif pending >= self.flush_events:
+            self._wakeup.set()
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='counter-aggregator', daemon=True).start()
+            if self.flush_on_exit:
+                atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
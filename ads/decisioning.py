@@ -0,0 +1,315 @@
+import random
+import threading
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, cast
+
+from asgiref.sync import sync_to_async
+from django.utils.functional import LazyObject
+from django.utils.timezone import localdate, now
+
+from ads.budget import BUDGET_TRACKER
+from ads.frequency import FREQUENCY_CAPPER, FrequencyCap, frequency_cap
+from ads.invalidation import ALL, INVALIDATION_BUS
+from ads.models import Banner, Campaign
+from ads.pacing import PACING_GATE
+from experiments.models import TargetingGroup
+
+# Атрибуты запроса, по которым возможен таргетинг. Ключи TargetingGroup.criteria совпадают с ними
+ATTRIBUTES = ('placement', 'geo', 'device', 'os', 'language')
+
+
+@dataclass(frozen=True, slots=True)
+class RequestAttributes:
+    placement: str | None = None
+    geo: str | None = None
+    device: str | None = None
+    os: str | None = None
+    language: str | None = None
+    # Единица рандомизации (посетитель), для лимитов частоты показов. В таргетинге не участвует
+    user: str | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class Window:
+    """Время проведения эксперимента, как ExperimentTable.is_running"""
+
+    start_date: datetime
+    end_date: datetime | None
+
+    def contains(self, moment: datetime) -> bool:
+        return self.start_date <= moment and (self.end_date is None or moment <= self.end_date)
+
+
+@dataclass(frozen=True, slots=True)
+class LineItem:
+    """Баннер вместе с ограничениями одной группы таргетинга"""
+
+    banner_id: int
+    campaign_id: int
+    constraints: dict[str, frozenset[str]]
+    frequency_cap: FrequencyCap | None = None
+    # Эксперимент группы таргетинга: позиция действует только пока он идет
+    window: Window | None = None
+    # Позиция без таргетинга кампании с экспериментами: действует, пока не идет ни один из них
+    fallback_for: tuple[Window, ...] = ()
+
+    def is_live(self, moment: datetime) -> bool:
+        if self.window is not None and not self.window.contains(moment):
+            return False
+        return not any(window.contains(moment) for window in self.fallback_for)
+
+
+def _normalize(values: Any) -> frozenset[str]:
+    if isinstance(values, str):
+        values = [values]
+    return frozenset(str(value).lower() for value in values or ())
+
+
+def _iter_bits(mask: int) -> Iterable[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class TargetingIndex:
+    """Индекс баннеров, доступных для показа, по атрибутам таргетинга.
+
+    Каждая позиция (баннер + группа таргетинга) получает номер бита. Для каждого
+    атрибута хранятся битовые маски: по значению и маска позиций, которые этот
+    атрибут не ограничивают. Подбор кандидатов - несколько AND/OR над int,
+    без обращений к базе. Индекс обновляется по кампаниям: при изменении
+    кампании, ее баннеров или таргетинга перестраиваются только ее позиции.
+    """
+
+    def __init__(self) -> None:
+        self._items: list[LineItem | None] = []
+        self._free: list[int] = []
+        self._all = 0
+        self._postings: dict[str, dict[str, int]] = {attribute: {} for attribute in ATTRIBUTES}
+        self._unconstrained: dict[str, int] = dict.fromkeys(ATTRIBUTES, 0)
+        self._by_campaign: dict[int, list[int]] = {}
+        self._banner_campaigns: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return self._all.bit_count()
+
+    def campaign_of(self, banner_id: int) -> int | None:
+        return self._banner_campaigns.get(banner_id)
+
+    def replace_campaign(self, campaign_id: int, items: list[LineItem]) -> None:
+        self.remove_campaign(campaign_id)
+        bits: list[int] = []
+        for item in items:
+            bit = self._free.pop() if self._free else len(self._items)
+            if bit == len(self._items):
+                self._items.append(item)
+            else:
+                self._items[bit] = item
+            flag = 1 << bit
+            self._all |= flag
+            self._banner_campaigns[item.banner_id] = campaign_id
+            for attribute in ATTRIBUTES:
+                values = item.constraints.get(attribute)
+                if not values:
+                    self._unconstrained[attribute] |= flag
+                    continue
+                postings = self._postings[attribute]
+                for value in values:
+                    postings[value] = postings.get(value, 0) | flag
+            bits.append(bit)
+        if bits:
+            self._by_campaign[campaign_id] = bits
+
+    def remove_campaign(self, campaign_id: int) -> None:
+        for bit in self._by_campaign.pop(campaign_id, []):
+            flag = ~(1 << bit)
+            self._all &= flag
+            for attribute in ATTRIBUTES:
+                self._unconstrained[attribute] &= flag
+                postings = self._postings[attribute]
+                for value in list(postings):
+                    postings[value] &= flag
+                    if not postings[value]:
+                        del postings[value]
+            item = self._items[bit]
+            if item is not None:
+                self._banner_campaigns.pop(item.banner_id, None)
+            self._items[bit] = None
+            self._free.append(bit)
+
+    def candidates(self, attributes: RequestAttributes) -> list[LineItem]:
+        mask = self._all
+        for attribute in ATTRIBUTES:
+            value = getattr(attributes, attribute)
+            allowed = self._unconstrained[attribute]
+            if value is not None:
+                allowed |= self._postings[attribute].get(value.lower(), 0)
+            mask &= allowed
+            if not mask:
+                return []
+        return [cast(LineItem, self._items[bit]) for bit in _iter_bits(mask)]
+
+
+# Фильтр кандидатов (бюджет, пейсинг, частота показов): возвращает позиции, которые можно показать
+CandidateFilter = Callable[[list[LineItem], RequestAttributes], list[LineItem]]
+
+
+class DecisionEngine:
+    """Выбор баннера для запроса по индексу таргетинга"""
+
+    def __init__(self) -> None:
+        self._index = TargetingIndex()
+        self._lock = threading.Lock()
+        self._built_for: date | None = None
+        self._dirty_campaigns: set[int] = set()
+        self._dirty_banners: set[int] = set()
+        self._filters: list[CandidateFilter] = []
+        self._blocking_filters = False
+
+    @property
+    def size(self) -> int:
+        return len(self._index)
+
+    def add_filter(self, candidate_filter: CandidateFilter, blocking: bool = False) -> None:
+        """blocking - фильтр ходит в сеть, в асинхронном режиме выбор выполняется в потоке"""
+        self._filters.append(candidate_filter)
+        self._blocking_filters |= blocking
+
+    def select(self, attributes: RequestAttributes) -> LineItem | None:
+        if self._needs_refresh():
+            self._refresh()
+        return self._choose(attributes)
+
+    async def aselect(self, attributes: RequestAttributes) -> LineItem | None:
+        if self._needs_refresh():
+            await sync_to_async(self._refresh)()
+        if self._blocking_filters:
+            return await sync_to_async(self._choose, thread_sensitive=False)(attributes)
+        return self._choose(attributes)
+
+    def invalidate(self, kind: str, object_id: int) -> None:
+        with self._lock:
+            if kind == ALL:
+                self._built_for = None
+            elif kind == 'campaign':
+                self._dirty_campaigns.add(object_id)
+            elif kind == 'banner':
+                self._dirty_banners.add(object_id)
+
+    def _choose(self, attributes: RequestAttributes) -> LineItem | None:
+        with self._lock:
+            candidates = self._index.candidates(attributes)
+        # Окна экспериментов проверяются здесь, а не при сборке индекса: индекс перестраивается раз в день
+        if candidates:
+            moment = now()
+            candidates = [candidate for candidate in candidates if candidate.is_live(moment)]
+        for candidate_filter in self._filters:
+            if not candidates:
+                break
+            candidates = candidate_filter(candidates, attributes)
+        return random.choice(candidates) if candidates else None
+
+    def _needs_refresh(self) -> bool:
+        return self._built_for != localdate() or bool(self._dirty_campaigns or self._dirty_banners)
+
+    def _refresh(self) -> None:
+        with self._lock:
+            full = self._built_for != localdate()
+            dirty_campaigns, self._dirty_campaigns = self._dirty_campaigns, set()
+            dirty_banners, self._dirty_banners = self._dirty_banners, set()
+            # Баннер мог переехать в другую кампанию: обновляем и старую, и новую
+            dirty_campaigns |= {
+                campaign_id for campaign_id in map(self._index.campaign_of, dirty_banners) if campaign_id is not None
+            }
+
+        if full:
+            today = localdate()
+            index = TargetingIndex()
+            for campaign_id, items in _load_line_items(today).items():
+                index.replace_campaign(campaign_id, items)
+            with self._lock:
+                self._index = index
+                self._built_for = today
+            return
+
+        if dirty_banners:
+            dirty_campaigns |= set(Banner.objects.filter(pk__in=dirty_banners).values_list('campaign_id', flat=True))
+        loaded = _load_line_items(localdate(), dirty_campaigns)
+        with self._lock:
+            for campaign_id in dirty_campaigns:
+                self._index.replace_campaign(campaign_id, loaded.get(campaign_id, []))
+
+
+def _load_line_items(today: date, campaign_ids: set[int] | None = None) -> dict[int, list[LineItem]]:
+    """Позиции активных кампаний: по одной на пару баннер + активная группа таргетинга.
+
+    Группы загружаются вместе с окнами их экспериментов, в том числе еще не начавшихся и уже закончившихся:
+    время сверяется при подборе (LineItem.is_live)
+    """
+    campaigns = Campaign.objects.filter(is_active=True, start_date__lte=today, end_date__gte=today)
+    if campaign_ids is not None:
+        campaigns = campaigns.filter(pk__in=campaign_ids)
+
+    banners = Banner.objects.filter(is_active=True, campaign__in=campaigns).values_list(
+        'pk', 'campaign_id', 'content', 'campaign__frequency_cap', 'campaign__frequency_period'
+    )
+    groups = TargetingGroup.objects.filter(
+        is_active=True,
+        experiment__is_active=True,
+        experiment__campaign__in=campaigns,
+    ).values_list('experiment__campaign_id', 'criteria', 'experiment__start_date', 'experiment__end_date')
+
+    groups_by_campaign: dict[int, list[tuple[dict[str, frozenset[str]], Window]]] = {}
+    for campaign_id, criteria, start_date, end_date in groups:
+        constraints = {
+            attribute: _normalize(criteria.get(attribute)) for attribute in ATTRIBUTES if criteria.get(attribute)
+        }
+        groups_by_campaign.setdefault(campaign_id, []).append((constraints, Window(start_date, end_date)))
+
+    items: dict[int, list[LineItem]] = {}
+    for banner_id, campaign_id, content, cap, period in banners:
+        campaign_groups = groups_by_campaign.get(campaign_id, [])
+        # Пока не идет ни один эксперимент кампании (или групп нет), она показывается всем
+        windows = tuple(window for _, window in campaign_groups)
+        options: list[tuple[dict[str, frozenset[str]], Window | None, tuple[Window, ...]]] = [
+            (constraints, window, ()) for constraints, window in campaign_groups
+        ]
+        options.append(({}, None, windows))
+        for group_constraints, window, fallback_for in options:
+            constraints = dict(group_constraints)
+            # Места размещения можно задать и в контенте баннера
+            if placements := content.get('placements'):
+                placements = _normalize(placements)
+                if 'placement' in constraints:
+                    placements &= constraints['placement']
+                    if not placements:
+                        continue
+                constraints['placement'] = placements
+            items.setdefault(campaign_id, []).append(
+                LineItem(
+                    banner_id,
+                    campaign_id,
+                    constraints,
+                    frequency_cap(campaign_id, cap, period),
+                    window=window,
+                    fallback_for=fallback_for,
+                )
+            )
+    return items
+
+
+class LazyDecisionEngine(LazyObject):
+    def _setup(self) -> None:
+        engine = DecisionEngine()
+        engine.add_filter(BUDGET_TRACKER.filter_candidates)
+        engine.add_filter(PACING_GATE.filter_candidates)
+        # Последним: единственный фильтр с запросом к Redis, проверяет только оставшихся кандидатов
+        engine.add_filter(FREQUENCY_CAPPER.filter_candidates, blocking=True)
+        INVALIDATION_BUS.subscribe(engine.invalidate)
+        self._wrapped = engine
+
+
+DECISION_ENGINE = cast(DecisionEngine, LazyDecisionEngine())
@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import time
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, cast
+
+from django.utils.functional import LazyObject
+from django.utils.timezone import localtime
+
+from ads.redis import REDIS_CLIENT
+
+if TYPE_CHECKING:
+    from ads.decisioning import LineItem, RequestAttributes
+
+logger = logging.getLogger(__name__)
+
+# (id кампании, лимит показов, период в секундах)
+FrequencyCap = tuple[int, int, int]
+
+_WEEK = 7 * 24 * 60 * 60
+# 1 января 1970 - четверг: без сдвига недельные окна начинались бы по четвергам, а не по понедельникам
+_MONDAY_SHIFT = 3 * 24 * 60 * 60
+
+
+class FrequencyCapper:
+    """Ограничение числа показов кампании одному пользователю за период.
+
+    Счетчики лежат в хешах `fc:<период>:<окно>:<пользователь>` с полем на
+    кампанию, окна выровнены по местному времени (недели - с понедельника), ключ истекает вместе с окном.
+    Пользователь в ключе - 8 байт blake2b от единицы рандомизации (16 символов).
+
+    Память: небольшие хеши Redis хранит в listpack, это ~100 байт на ключ
+    с TTL и ~10 байт на кампанию. Ключей у пользователя не больше числа периодов (3),
+    поэтому пользователь, видевший за период 10 кампаний с лимитом, занимает
+    меньше 400 байт, а после окончания окна - ничего. 10 млн пользователей
+    за сутки - около 2-4 ГБ.
+    """
+
+    def exceeded(self, unit_id: str, caps: Iterable[FrequencyCap | None]) -> set[int]:
+        """Кампании, лимит которых пользователь исчерпал. Одна проверка на все кампании"""
+        return _exceeded(self.remaining(unit_id, caps))
+
+    async def aexceeded(self, unit_id: str, caps: Iterable[FrequencyCap | None]) -> set[int]:
+        return _exceeded(await self.aremaining(unit_id, caps))
+
+    def remaining(self, unit_id: str, caps: Iterable[FrequencyCap | None]) -> dict[int, int]:
+        """Сколько еще показов можно сделать пользователю по кампаниям с лимитом, например для слотов одной страницы"""
+        fields = self._fields(unit_id, caps)
+        if not fields:
+            return {}
+        try:
+            counts = REDIS_CLIENT.get_frequency_counts([(key, field) for key, field, *_ in fields])
+        except Exception:
+            # Лучше показать лишний раз, чем не показать ничего
+            logger.exception('Failed to check frequency caps')
+            return {}
+        return _remaining(fields, counts)
+
+    async def aremaining(self, unit_id: str, caps: Iterable[FrequencyCap | None]) -> dict[int, int]:
+        fields = self._fields(unit_id, caps)
+        if not fields:
+            return {}
+        try:
+            counts = await REDIS_CLIENT.aget_frequency_counts([(key, field) for key, field, *_ in fields])
+        except Exception:
+            logger.exception('Failed to check frequency caps')
+            return {}
+        return _remaining(fields, counts)
+
+    def record(self, unit_id: str, caps: Iterable[FrequencyCap | None]) -> None:
+        if fields := self._fields(unit_id, caps):
+            REDIS_CLIENT.increment_frequency_counts([(key, field, expire_at) for key, field, expire_at, *_ in fields])
+
+    async def arecord(self, unit_id: str, caps: Iterable[FrequencyCap | None]) -> None:
+        if fields := self._fields(unit_id, caps):
+            await REDIS_CLIENT.aincrement_frequency_counts(
+                [(key, field, expire_at) for key, field, expire_at, *_ in fields]
+            )
+
+    def filter_candidates(self, candidates: list['LineItem'], attributes: 'RequestAttributes') -> list['LineItem']:
+        """Фильтр для DECISION_ENGINE, обращается к Redis"""
+        if attributes.user is None:
+            return candidates
+        exceeded = self.exceeded(attributes.user, {item.frequency_cap for item in candidates})
+        if not exceeded:
+            return candidates
+        return [item for item in candidates if item.campaign_id not in exceeded]
+
+    def _fields(self, unit_id: str, caps: Iterable[FrequencyCap | None]) -> list[tuple[str, str, int, int, int]]:
+        """(ключ, поле, момент истечения, лимит, id кампании) для каждой кампании с лимитом"""
+        caps = [cap for cap in caps if cap is not None]
+        if not caps:
+            return []
+        user = hashlib.blake2b(unit_id.encode(), digest_size=8).hexdigest()
+        now = int(time.time())
+        offset = int(localtime().utcoffset().total_seconds())  # pyright: ignore[reportOptionalMemberAccess]
+        fields: list[tuple[str, str, int, int, int]] = []
+        for campaign_id, limit, period in caps:
+            shift = offset + (_MONDAY_SHIFT if period % _WEEK == 0 else 0)
+            window = (now + shift) // period
+            expire_at = (window + 1) * period - shift
+            fields.append((f'fc:{period}:{window}:{user}', str(campaign_id), expire_at, limit, campaign_id))
+        return fields
+
+
+def frequency_cap(campaign_id: int, limit: int | None, period: int) -> FrequencyCap | None:
+    return (campaign_id, limit, period) if limit else None
+
+
+def _remaining(fields: list[tuple[str, str, int, int, int]], counts: list[int]) -> dict[int, int]:
+    return {campaign_id: max(limit - count, 0) for (*_, limit, campaign_id), count in zip(fields, counts)}
+
+
+def _exceeded(remaining: dict[int, int]) -> set[int]:
+    return {campaign_id for campaign_id, left in remaining.items() if not left}
+
+
+class LazyFrequencyCapper(LazyObject):
+    def _setup(self) -> None:
+        self._wrapped = FrequencyCapper()
+
+
+FREQUENCY_CAPPER = cast(FrequencyCapper, LazyFrequencyCapper())
@@ -0,0 +1,156 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Запись события (ads.ch.ShowEvent или ClickEvent)
+Row = tuple[Any, ...]
+FlushCallback = Callable[[str, list[Row]], None]
+
+
+@dataclass
+class BatchWriterStats:
+    queue_depth: int
+    enqueued: int
+    dropped: int
+    batches: int
+    rows_written: int
+    rows_failed: int
+    last_batch_size: int
+    max_batch_size: int
+
+
+class BatchWriter:
+    """Буферизованная запись событий многострочными INSERT из фонового потока.
+
+    События складываются в ограниченную очередь, фоновый поток отправляет их
+    пачками по достижении `max_rows` строк или по истечении `max_delay` секунд.
+    При переполнении очереди событие отбрасывается и учитывается в `dropped`,
+    так же как события, пришедшие после close().
+    """
+
+    def __init__(self, flush: FlushCallback, max_rows: int, max_delay: float, queue_size: int) -> None:
+        self._flush = flush
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._queue: queue.Queue[tuple[str, Row]] = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+
+        self._enqueued = 0
+        self._dropped = 0
+        self._batches = 0
+        self._rows_written = 0
+        self._rows_failed = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+
+    def put(self, table: str, row: Row) -> bool:
+        """Постановка события в очередь. Возвращает False, если событие отброшено"""
+        self._ensure_started()
+        if self._stopped.is_set():
+            # Поток остановлен, очередь больше никто не отправит
+            with self._lock:
+                self._dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def stats(self) -> BatchWriterStats:
+        with self._lock:
+            return BatchWriterStats(
+                queue_depth=self._queue.qsize(),
+                enqueued=self._enqueued,
+                dropped=self._dropped,
+                batches=self._batches,
+                rows_written=self._rows_written,
+                rows_failed=self._rows_failed,
+                last_batch_size=self._last_batch_size,
+                max_batch_size=self._max_batch_size,
+            )
+
+    def close(self, timeout: float | None = None) -> None:
+        """Остановка фонового потока с отправкой всего, что осталось в очереди"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stopped.set()
+        thread.join(timeout)
+        if not thread.is_alive():
+            # События, поставленные одновременно с остановкой, уже после последней выборки потока
+            self._drain()
+
+    def _ensure_started(self) -> None:
+        # После fork (gunicorn) поток родителя в дочернем процессе не существует
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='ch-batch-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._write(self._collect())
+        self._drain()
+
+    def _drain(self) -> None:
+        while not self._queue.empty():
+            self._write(self._collect(block=False))
+
+    def _collect(self, block: bool = True) -> list[tuple[str, Row]]:
+        items: list[tuple[str, Row]] = []
+        deadline = time.monotonic() + self.max_delay
+        while len(items) < self.max_rows:
+            try:
+                if block:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    items.append(self._queue.get(timeout=timeout))
+                else:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, items: list[tuple[str, Row]]) -> None:
+        if not items:
+            return
+        by_table: dict[str, list[Row]] = {}
+        for table, row in items:
+            by_table.setdefault(table, []).append(row)
+
+        for table, rows in by_table.items():
+            try:
+                self._flush(table, rows)
+            except Exception:
+                logger.exception('Failed to flush %d rows into %s', len(rows), table)
+                with self._lock:
+                    self._rows_failed += len(rows)
+                continue
+            with self._lock:
+                self._batches += 1
+                self._rows_written += len(rows)
+                self._last_batch_size = len(rows)
+                self._max_batch_size = max(self._max_batch_size, len(rows))
@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from typing import cast
+
+from django.utils.functional import LazyObject
+
+from ads.redis import REDIS_CLIENT
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'reklamito:invalidate'
+ALL = '*'
+
+# (тип объекта, id) -> None. Тип ALL означает сброс всего
+Handler = Callable[[str, int], None]
+
+
+class InvalidationBus:
+    """Рассылка инвалидаций in-process кешей между воркерами через Redis pub/sub.
+
+    Сообщение `<pid>:<kind>:<id>` публикуется в общий канал, каждый процесс
+    слушает его в фоновом потоке и вызывает зарегистрированные обработчики.
+    Если соединение с Redis рвется, сообщения могли потеряться, поэтому после
+    переподключения обработчики получают полный сброс (ALL).
+    """
+
+    reconnect_delay = 1.0
+
+    def __init__(self) -> None:
+        self._handlers: list[Handler] = []
+        self._lock = threading.Lock()
+        self._pid: int | None = None
+
+    def subscribe(self, handler: Handler) -> None:
+        with self._lock:
+            self._handlers.append(handler)
+        self._ensure_listening()
+
+    def publish(self, kind: str, object_id: int = 0) -> None:
+        self._dispatch(kind, object_id)
+        try:
+            REDIS_CLIENT.publish(CHANNEL, f'{os.getpid()}:{kind}:{object_id}')
+        except Exception:
+            logger.exception('Failed to publish invalidation %s:%s', kind, object_id)
+
+    def _dispatch(self, kind: str, object_id: int) -> None:
+        for handler in list(self._handlers):
+            handler(kind, object_id)
+
+    def _ensure_listening(self) -> None:
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._listen, name='invalidation-listener', daemon=True).start()
+
+    def _listen(self) -> None:
+        pid = str(os.getpid())
+        connected_once = False
+        while True:
+            try:
+                pubsub = REDIS_CLIENT.pubsub()
+                pubsub.subscribe(CHANNEL)
+                if connected_once:
+                    self._dispatch(ALL, 0)
+                connected_once = True
+                for message in pubsub.listen():
+                    sender, kind, object_id = message['data'].decode().split(':')
+                    if sender != pid:
+                        self._dispatch(kind, int(object_id))
+            except Exception:
+                logger.exception('Invalidation listener disconnected')
+                time.sleep(self.reconnect_delay)
+
+
+class LazyInvalidationBus(LazyObject):
+    def _setup(self) -> None:
+        self._wrapped = InvalidationBus()
+
+
+INVALIDATION_BUS = cast(InvalidationBus, LazyInvalidationBus())
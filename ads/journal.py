@@ -0,0 +1,191 @@
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections.abc import Callable, Iterator
+from datetime import datetime
+from decimal import Decimal
+from enum import StrEnum
+from pathlib import Path
+from typing import IO, Any
+from uuid import UUID
+
+logger = logging.getLogger(__name__)
+
+Row = dict[str, Any]
+
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+
+# Колонки, которые при чтении из журнала нужно вернуть к исходным типам
+_DECODERS: dict[str, Callable[[Any], Any]] = {
+    'event_id': UUID,
+    'show_event_id': UUID,
+    'timestamp': datetime.fromisoformat,
+    'conversion_value': Decimal,
+    'click_cost': Decimal,
+}
+
+
+class FsyncPolicy(StrEnum):
+    always = 'always'  # fsync после каждой записи
+    interval = 'interval'  # fsync не реже раза в interval секунд
+    never = 'never'  # на усмотрение ОС
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _decode_row(row: Row) -> Row:
+    for column, decoder in _DECODERS.items():
+        value = row.get(column)
+        if value is not None:
+            row[column] = decoder(value)
+    return row
+
+
+class EventJournal:
+    """Локальный сегментированный append-only журнал событий.
+
+    Каждый процесс пишет в собственный сегмент `<host>-<pid>-<ns>.open`.
+    Сегмент закрывается (переименовывается в `.seg`) по размеру, по возрасту
+    или при завершении процесса; отправкой закрытых сегментов в ClickHouse
+    занимается команда `ship_events`.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        fsync: FsyncPolicy,
+        fsync_interval: float,
+        segment_max_bytes: int,
+        segment_max_age: float,
+    ) -> None:
+        self.directory = directory
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+        self._lock = threading.Lock()
+        self._file: IO[bytes] | None = None
+        self._path: Path | None = None
+        self._opened_at = 0.0
+        self._dirty = False
+        self._pid: int | None = None
+        self._stopped = threading.Event()
+
+    def append(self, table: str, row: Row) -> None:
+        line = json.dumps({'t': table, 'r': row}, default=_encode, ensure_ascii=False).encode() + b'\n'
+        with self._lock:
+            file = self._current_file()
+            file.write(line)
+            if self.fsync == FsyncPolicy.always:
+                file.flush()
+                os.fsync(file.fileno())
+            else:
+                self._dirty = True
+            if file.tell() >= self.segment_max_bytes:
+                self._seal()
+
+    def close(self) -> None:
+        """Сброс на диск и закрытие текущего сегмента"""
+        self._stopped.set()
+        with self._lock:
+            if self._pid == os.getpid():
+                self._seal()
+
+    def _current_file(self) -> IO[bytes]:
+        if self._pid != os.getpid():
+            # После fork файл и фоновый поток родителя не наследуются
+            self._file = None
+            self._path = None
+            self._pid = os.getpid()
+            self._stopped.clear()
+            threading.Thread(target=self._run, name='event-journal', daemon=True).start()
+            atexit.register(self.close)
+        if self._file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            name = f'{socket.gethostname()}-{os.getpid()}-{time.time_ns()}{OPEN_SUFFIX}'
+            self._path = self.directory / name
+            self._file = self._path.open('ab')
+            self._opened_at = time.monotonic()
+        return self._file
+
+    def _seal(self) -> None:
+        if self._file is None or self._path is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._path.rename(self._path.with_suffix(SEALED_SUFFIX))
+        self._file = None
+        self._path = None
+        self._dirty = False
+
+    def _run(self) -> None:
+        """Периодический fsync и закрытие сегментов по возрасту"""
+        period = min(self.fsync_interval, self.segment_max_age)
+        while not self._stopped.wait(period):
+            with self._lock:
+                if self._file is None:
+                    continue
+                try:
+                    if time.monotonic() - self._opened_at >= self.segment_max_age:
+                        self._seal()
+                    elif self._dirty and self.fsync == FsyncPolicy.interval:
+                        self._file.flush()
+                        os.fsync(self._file.fileno())
+                        self._dirty = False
+                except OSError:
+                    logger.exception('Failed to sync journal segment %s', self._path)
+
+
+def sealed_segments(directory: Path) -> list[Path]:
+    """Закрытые сегменты в порядке создания"""
+    return sorted(directory.glob(f'*{SEALED_SUFFIX}'), key=lambda path: path.stem.rsplit('-', 1)[-1].zfill(20))
+
+
+def seal_abandoned_segments(directory: Path, stale_after: float) -> list[Path]:
+    """Закрытие сегментов, чьи процессы-писатели завершились аварийно"""
+    sealed: list[Path] = []
+    hostname = socket.gethostname()
+    for path in directory.glob(f'*{OPEN_SUFFIX}'):
+        host, pid, _ = path.stem.rsplit('-', 2)
+        if host == hostname and _is_alive(int(pid)):
+            continue
+        if time.time() - path.stat().st_mtime < stale_after:
+            continue
+        sealed.append(path.rename(path.with_suffix(SEALED_SUFFIX)))
+    return sealed
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_segment(path: Path) -> Iterator[tuple[str, Row]]:
+    """Чтение событий сегмента. Оборванная последняя строка (сбой при записи) пропускается"""
+    with path.open('rb') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning('Skipping torn record in %s', path)
+                continue
+            yield record['t'], _decode_row(record['r'])
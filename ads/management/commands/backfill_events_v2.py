@@ -0,0 +1,77 @@
+import logging
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from ads.ch import CH_CLIENT
+
+logger = logging.getLogger(__name__)
+
+# Таблица v1 -> (таблица v2, представление, дублирующее в нее новые вставки)
+TABLES = {
+    'reklamito.shows': ('reklamito.shows_v2', 'shows_v2_mv'),
+    'reklamito.clicks': ('reklamito.clicks_v2', 'clicks_v2_mv'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Перенос событий, записанных до миграции 0004_events_v2, из таблиц v1 в v2 помесячно'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--month', type=int, action='append', help='Только указанные месяцы, YYYYMM')
+        parser.add_argument('--dry-run', action='store_true', help='Только сравнить число строк')
+
+    def handle(self, *args: Any, month: list[int] | None, dry_run: bool, **options: Any) -> None:
+        for source, (target, view) in TABLES.items():
+            rows = CH_CLIENT.execute(
+                'SELECT as_select, metadata_modification_time FROM system.tables '
+                'WHERE database = %(database)s AND name = %(name)s',
+                {'database': 'reklamito', 'name': view},
+            )
+            if not rows:
+                raise CommandError(f'{view} not found, apply ClickHouse migrations first')
+            select, cutoff = rows[0]
+            # Все, что записано после создания представления, уже попало в v2 через него
+            months = month or [
+                m
+                for (m,) in CH_CLIENT.execute(
+                    f'SELECT DISTINCT toYYYYMM(timestamp_date) AS m FROM {source} '
+                    'WHERE timestamp < %(cutoff)s ORDER BY m',
+                    {'cutoff': cutoff},
+                )
+            ]
+            for m in months:
+                self._backfill_month(source, target, select, cutoff, m, dry_run)
+            if source == 'reklamito.shows' and not dry_run:
+                self._backfill_user_agents(cutoff)
+
+    def _backfill_month(self, source: str, target: str, select: str, cutoff: Any, month: int, dry_run: bool) -> None:
+        """Месяц переносится заново, если число строк до границы в v1 и v2 расходится: повтор безопасен"""
+        condition = 'toYYYYMM(timestamp_date) = %(month)s AND timestamp < %(cutoff)s'
+        params = {'month': month, 'cutoff': cutoff}
+        ((expected,),) = CH_CLIENT.execute(f'SELECT count() FROM {source} WHERE {condition}', params)
+        ((copied,),) = CH_CLIENT.execute(f'SELECT count() FROM {target} WHERE {condition}', params)
+        if expected == copied:
+            self.stdout.write(f'{target} {month}: {copied} rows, up to date')
+            return
+        self.stdout.write(f'{target} {month}: {copied} of {expected} rows{", dry run" if dry_run else ""}')
+        if dry_run:
+            return
+        if copied:
+            # Частично перенесенный месяц: строки из представления (после границы) не трогаем
+            CH_CLIENT.execute(f'ALTER TABLE {target} DELETE WHERE {condition} SETTINGS mutations_sync = 2', params)
+        CH_CLIENT.execute(
+            f'INSERT INTO {target} SELECT * FROM ({select}) WHERE toYYYYMM(toDate(timestamp)) = %(month)s '
+            'AND timestamp < %(cutoff)s',
+            params,
+        )
+
+    def _backfill_user_agents(self, cutoff: Any) -> None:
+        # ReplacingMergeTree схлопнет повторы, поэтому переносим все строки целиком
+        CH_CLIENT.execute(
+            'INSERT INTO reklamito.user_agents '
+            'SELECT DISTINCT halfMD5(assumeNotNull(user_agent)), assumeNotNull(user_agent) FROM reklamito.shows '
+            'WHERE user_agent IS NOT NULL AND timestamp < %(cutoff)s',
+            {'cutoff': cutoff},
+        )
+        self.stdout.write('reklamito.user_agents: backfilled')
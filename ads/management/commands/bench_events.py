@@ -0,0 +1,160 @@
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import UTC, datetime
+from typing import Any
+from uuid import uuid4
+
+from clickhouse_driver import Client, defines  # pyright: ignore
+from clickhouse_driver.block import ColumnOrientedBlock, RowOrientedBlock  # pyright: ignore
+from clickhouse_driver.bufferedwriter import BufferedSocketWriter  # pyright: ignore
+from clickhouse_driver.connection import ServerInfo  # pyright: ignore
+from clickhouse_driver.streams.native import BlockOutputStream  # pyright: ignore
+from django.core.management.base import BaseCommand, CommandParser
+
+from ads.ch import CostModel, DeviceType, NetworkType, ShowEvent, _insert_query, to_columns
+
+# Типы колонок reklamito.shows (ads/ch_migrations/0002_layout.sql), для кодирования блока без сервера
+SHOW_TYPES = {
+    'event_id': 'UUID',
+    'timestamp': "DateTime64(3, 'UTC')",
+    'banner_id': 'UInt32',
+    'campaign_id': 'UInt32',
+    'user_id': 'Nullable(UInt32)',
+    'ip_address': 'Nullable(String)',
+    'user_agent': 'Nullable(String)',
+    'country': 'Nullable(String)',
+    'city': 'Nullable(String)',
+    'latitude': 'Nullable(Float64)',
+    'longitude': 'Nullable(Float64)',
+    'device_type': "Nullable(Enum8('mobile' = 1, 'desktop' = 2, 'tablet' = 3))",
+    'os_family': 'Nullable(String)',
+    'os_version': 'Nullable(String)',
+    'browser_family': 'Nullable(String)',
+    'browser_version': 'Nullable(String)',
+    'screen_width': 'Nullable(UInt16)',
+    'screen_height': 'Nullable(UInt16)',
+    'language': 'Nullable(String)',
+    'referer_domain': 'Nullable(String)',
+    'referer_path': 'Nullable(String)',
+    'is_robot': 'Nullable(UInt8)',
+    'ad_position': 'Nullable(String)',
+    'ad_size': 'Nullable(String)',
+    'cost_model': "Nullable(Enum8('CPM' = 1, 'CPC' = 2))",
+    'session_id': 'Nullable(String)',
+    'network_type': "Nullable(Enum8('wifi' = 1, 'cellular' = 2, 'wired' = 3))",
+    'connection_speed': 'Nullable(UInt32)',
+    'variant_id': 'Nullable(UInt32)',
+}
+
+# Прежний log_shows: словарь со всеми колонками на событие
+_SHOW_DEFAULTS: dict[str, Any] = ShowEvent._field_defaults
+
+
+def _dict_event(event: dict[str, Any]) -> dict[str, Any]:
+    row = _SHOW_DEFAULTS | event
+    if row['is_robot'] is not None:
+        row['is_robot'] = int(row['is_robot'])
+    return row
+
+
+def _encode_rows(rows: list[Any], context: Any) -> int:
+    """Как раньше: текст INSERT на каждую вставку, строки-словари транспонирует clickhouse_driver"""
+    _ = f'INSERT INTO reklamito.shows ({", ".join(rows[0].keys())}) VALUES'
+    return _write_block(RowOrientedBlock(list(SHOW_TYPES.items()), rows), context)
+
+
+def _encode_columns(events: list[Any], context: Any) -> int:
+    _ = _insert_query('reklamito.shows', ShowEvent._fields)
+    return _write_block(ColumnOrientedBlock(list(SHOW_TYPES.items()), to_columns(events)), context)
+
+
+class _Sink:
+    """Сокет, отбрасывающий данные: меряется только кодирование"""
+
+    size = 0
+
+    def sendall(self, data: bytes) -> None:
+        self.size += len(data)
+
+
+def _write_block(block: Any, context: Any) -> int:
+    sink = _Sink()
+    BlockOutputStream(BufferedSocketWriter(sink, 1 << 20), context).write(block)
+    return sink.size
+
+
+class Command(BaseCommand):
+    help = 'Стоимость подготовки и кодирования показов для INSERT: словари и строки против записей и колонок'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--events', type=int, default=100_000, help='Число событий')
+        parser.add_argument('--batch', type=int, default=1000, help='Размер пачки INSERT')
+
+    def handle(self, *args: Any, events: int, batch: int, **options: Any) -> None:
+        # Соединение не открывается: нужен только контекст с настройками для кодирования колонок
+        context = Client('localhost').connection.context
+        context.client_settings = Client('localhost').client_settings
+        revision = defines.CLIENT_REVISION
+        context.server_info = ServerInfo('ClickHouse', 24, 8, 0, revision, 'UTC', '', revision)
+
+        samples = [_sample_event() for _ in range(events)]
+        results = [
+            ('rows', *_measure(samples, batch, _dict_event, _encode_rows, context)),
+            ('columnar', *_measure(samples, batch, lambda event: ShowEvent(**event), _encode_columns, context)),
+        ]
+        self.stdout.write(f'{events} events, batch {batch}')
+        self.stdout.write(f'{"":<10}{"build ns/event":>16}{"retained B/event":>18}{"encode ns/event":>17}')
+        for name, build, retained, encode in results:
+            self.stdout.write(f'{name:<10}{build:>16.0f}{retained:>18.0f}{encode:>17.0f}')
+
+
+def _measure(
+    samples: list[dict[str, Any]],
+    batch: int,
+    build: Callable[[dict[str, Any]], Any],
+    encode: Callable[[list[Any], Any], int],
+    context: Any,
+) -> tuple[float, float, float]:
+    """(время сборки события, память на собранное событие, время кодирования на событие)"""
+    started = time.perf_counter()
+    built = [build(sample) for sample in samples]
+    build_time = time.perf_counter() - started
+    del built
+
+    tracemalloc.start()
+    built = [build(sample) for sample in samples]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for start in range(0, len(built), batch):
+        encode(built[start : start + batch], context)
+    encode_time = time.perf_counter() - started
+    return build_time / len(samples) * 1e9, retained / len(samples), encode_time / len(samples) * 1e9
+
+
+def _sample_event() -> dict[str, Any]:
+    """Показ с заполненными полями, как его собирают вьюхи"""
+    return {
+        'event_id': uuid4(),
+        'timestamp': datetime.now(UTC),
+        'banner_id': 12,
+        'campaign_id': 3,
+        'ip_address': '203.0.113.7',
+        'user_agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+        'country': 'RU',
+        'device_type': DeviceType.mobile,
+        'os_family': 'iOS',
+        'os_version': '17.4',
+        'browser_family': 'Mobile Safari',
+        'browser_version': '17.4',
+        'language': 'ru',
+        'referer_domain': 'example.com',
+        'referer_path': '/news/2024/06/article',
+        'is_robot': False,
+        'ad_position': 'top',
+        'cost_model': CostModel.CPM,
+        'session_id': 'b1946ac92492d2347c6235b4d2611184',
+        'network_type': NetworkType.cellular,
+    }
@@ -0,0 +1,67 @@
+import re
+from pathlib import Path
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from ads.ch import CH_CLIENT
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / 'ch_migrations'
+MIGRATIONS_TABLE = 'reklamito.schema_migrations'
+# Конец запроса - точка с запятой в конце строки, возможно с комментарием после нее
+STATEMENT_END = re.compile(r';[ \t]*(?:--[^\n]*)?(?:\n|$)')
+
+
+class Command(BaseCommand):
+    help = 'Применение миграций схемы ClickHouse из ads/ch_migrations по порядку имен файлов'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--list', action='store_true', dest='show_list', help='Показать миграции и их состояние')
+        parser.add_argument('--fake', metavar='NAME', help='Отметить миграцию примененной, не выполняя ее')
+
+    def handle(self, *args: Any, show_list: bool, fake: str | None, **options: Any) -> None:
+        CH_CLIENT.execute(
+            f'CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (name String, applied_at DateTime DEFAULT now()) '
+            'ENGINE = MergeTree() ORDER BY name'
+        )
+        applied = {name for (name,) in CH_CLIENT.execute(f'SELECT name FROM {MIGRATIONS_TABLE}')}
+        migrations = sorted(MIGRATIONS_DIR.glob('*.sql'))
+
+        if show_list:
+            for path in migrations:
+                self.stdout.write(f'[{"X" if path.stem in applied else " "}] {path.stem}')
+            return
+
+        if fake:
+            if fake not in {path.stem for path in migrations}:
+                raise CommandError(f'Unknown migration {fake}')
+            self._mark_applied(fake)
+            self.stdout.write(f'Faked {fake}')
+            return
+
+        for path in migrations:
+            if path.stem in applied:
+                continue
+            self.stdout.write(f'Applying {path.stem}...')
+            # В ClickHouse нет транзакций: при ошибке часть запросов уже выполнена, миграцию нужно
+            # доделать вручную и отметить через --fake
+            for number, statement in enumerate(split_statements(path.read_text()), start=1):
+                try:
+                    CH_CLIENT.execute(statement)
+                except Exception as e:
+                    raise CommandError(f'{path.stem}: statement {number} failed: {e}') from e
+            self._mark_applied(path.stem)
+        self.stdout.write('ClickHouse schema is up to date')
+
+    def _mark_applied(self, name: str) -> None:
+        CH_CLIENT.execute(f'INSERT INTO {MIGRATIONS_TABLE} (name) VALUES', [{'name': name}])
+
+
+def split_statements(sql: str) -> list[str]:
+    """Запросы файла миграции. Фрагменты только из комментариев пропускаются"""
+    statements: list[str] = []
+    for chunk in STATEMENT_END.split(sql):
+        code = [line for line in chunk.splitlines() if line.strip() and not line.strip().startswith('--')]
+        if code:
+            statements.append(chunk.strip())
+    return statements
@@ -0,0 +1,262 @@
+import csv
+import gzip
+import json
+import os
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from decimal import Decimal
+from itertools import batched
+from pathlib import Path
+from typing import IO, Any, get_args, get_type_hints
+from uuid import UUID
+
+import django
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from ads.ch import CHClient, ClickEvent, ClickHouseWriteError, EventRecord, ShowEvent, to_columns
+from ads.useragent import UA_PARSER
+
+TABLES: dict[str, tuple[str, type[EventRecord]]] = {
+    'shows': ('reklamito.shows', ShowEvent),
+    'clicks': ('reklamito.clicks', ClickEvent),
+}
+# Сколько ошибок разбора показать, остальные только считаются
+ERRORS_SHOWN = 10
+# Ошибки данных строки. JSONDecodeError и UnicodeDecodeError - подклассы ValueError,
+# decimal.InvalidOperation и OverflowError (слишком большой timestamp) - ArithmeticError
+ROW_ERRORS = (ValueError, TypeError, KeyError, ArithmeticError)
+
+
+def _to_datetime(value: Any) -> datetime:
+    """ISO 8601 или unix timestamp, в том числе строкой (CSV). Время без зоны считается UTC, как в ClickHouse"""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    moment = datetime.fromtimestamp(value, UTC) if isinstance(value, int | float) else datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=UTC)
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 't', 'yes', 'y')
+    return bool(value)
+
+
+_CONVERTERS: dict[Any, Callable[[Any], Any]] = {
+    UUID: lambda value: UUID(str(value)),
+    datetime: _to_datetime,
+    bool: _to_bool,
+    Decimal: lambda value: Decimal(str(value)),
+    int: int,
+    float: float,
+    str: str,
+}
+
+
+def _converters(record: type[EventRecord]) -> list[tuple[str, Callable[[Any], Any]]]:
+    """(колонка, преобразование) по аннотациям записи. Перечисления (DeviceType и т.п.) проверяются по значению"""
+    converters: list[tuple[str, Callable[[Any], Any]]] = []
+    for name, annotation in get_type_hints(record).items():
+        kind = next((arg for arg in get_args(annotation) if arg is not type(None)), annotation)
+        converters.append((name, _CONVERTERS.get(kind, kind)))
+    return converters
+
+
+@dataclass(slots=True)
+class ChunkResult:
+    rows: int
+    invalid: int
+    columns: list[list[Any]]
+    # (номер строки в пачке, ошибка) для первых ошибок
+    errors: list[tuple[int, str]] = field(default_factory=list)
+
+
+def parse_chunk(table: str, header: list[str] | None, lines: Iterable[Any]) -> ChunkResult:
+    """Разбор пачки строк в процессе пула: JSON (header None) или CSV, дополнение полей из User-Agent, колонки.
+
+    Пустые строки пропускаются здесь, а не при чтении файла: номера ошибок совпадают с номерами строк
+    """
+    record = TABLES[table][1]
+    converters = _converters(record)
+    events: list[EventRecord] = []
+    invalid = 0
+    errors: list[tuple[int, str]] = []
+    for index, line in enumerate(lines):
+        if not (line.strip() if header is None else line):
+            continue
+        try:
+            raw = json.loads(line) if header is None else dict(zip(header, line))
+            if not isinstance(raw, dict):
+                raise TypeError(f'expected an object, got {type(raw).__name__}')
+            values = {name: convert(raw[name]) for name, convert in converters if raw.get(name) not in (None, '')}
+            if record is ShowEvent and values.get('user_agent') and 'browser_family' not in values:
+                for name, value in UA_PARSER.parse(values['user_agent']).as_event_fields().items():
+                    values.setdefault(name, value)
+            events.append(record(**values))
+        except ROW_ERRORS as e:
+            invalid += 1
+            if len(errors) < ERRORS_SHOWN:
+                errors.append((index, f'{type(e).__name__}: {e}'))
+    return ChunkResult(rows=len(events), invalid=invalid, columns=to_columns(events), errors=errors)
+
+
+class Progress:
+    """Число импортированных пачек по файлам.
+
+    Пишется после каждого INSERT. Если команда упала между INSERT и записью прогресса,
+    повтор пачки отсекается ClickHouse по insert_deduplication_token
+    """
+
+    def __init__(self, path: Path | None, chunk_size: int) -> None:
+        self.path = path
+        state = json.loads(path.read_text()) if path and path.exists() else {'chunk_size': chunk_size, 'files': {}}
+        if state['chunk_size'] != chunk_size:
+            raise CommandError(f'Checkpoint {path} was written with --chunk-size {state["chunk_size"]}')
+        self.chunk_size = chunk_size
+        self.files: dict[str, int] = state['files']
+
+    def get(self, key: str) -> int:
+        return self.files.get(key, 0)
+
+    def set(self, key: str, chunks: int) -> None:
+        self.files[key] = chunks
+        if self.path:
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(json.dumps({'chunk_size': self.chunk_size, 'files': self.files}))
+            tmp.replace(self.path)
+
+
+@dataclass(slots=True)
+class Totals:
+    rows: int = 0
+    invalid: int = 0
+    errors_shown: int = 0
+
+
+class Command(BaseCommand):
+    help = (
+        'Загрузка событий из JSONL/CSV (в том числе .gz) в reklamito.shows или reklamito.clicks. '
+        'Разбор идет в пуле процессов, вставка - пачками по колонкам'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('paths', nargs='+', type=Path, help='Файлы, поля - колонки таблицы')
+        parser.add_argument('--table', choices=TABLES, required=True)
+        parser.add_argument(
+            '--format', dest='input_format', choices=('jsonl', 'csv'), help='По умолчанию по расширению файла'
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Процессов разбора')
+        parser.add_argument('--chunk-size', type=int, default=50_000, help='Строк в пачке (одном INSERT)')
+        parser.add_argument('--checkpoint', type=Path, help='Файл прогресса: повторный запуск продолжит с него')
+        parser.add_argument('--dry-run', action='store_true', help='Только разбор и отчет о скорости, без вставки')
+
+    def handle(
+        self,
+        *args: Any,
+        paths: list[Path],
+        table: str,
+        input_format: str | None,
+        workers: int,
+        chunk_size: int,
+        checkpoint: Path | None,
+        dry_run: bool,
+        **options: Any,
+    ) -> None:
+        self.progress = Progress(checkpoint, chunk_size)
+        self.client = CHClient()
+        self.dry_run = dry_run
+        self.verbose = options['verbosity'] > 1
+        totals = Totals()
+        started = time.perf_counter()
+        # django.setup нужен процессам, запущенным через spawn/forkserver, при fork ничего не делает
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            for path in paths:
+                file_started = time.perf_counter()
+                file_totals = self._import_file(pool, workers, path, table, input_format or _detect_format(path))
+                totals.rows += file_totals.rows
+                totals.invalid += file_totals.invalid
+                self.stdout.write(f'{path}: {_report(file_totals, time.perf_counter() - file_started)}')
+        if len(paths) > 1:
+            self.stdout.write(f'Total: {_report(totals, time.perf_counter() - started)}')
+
+    def _import_file(
+        self, pool: ProcessPoolExecutor, workers: int, path: Path, table: str, input_format: str
+    ) -> Totals:
+        totals = Totals()
+        key = f'{table}:{path.resolve()}'
+        done = self.progress.get(key)
+        # Ограниченное окно задач: файл не читается в память целиком, порядок пачек сохраняется для прогресса
+        pending: deque[tuple[int, Future[ChunkResult]]] = deque()
+        with _open(path, input_format) as file:
+            header, lines = _lines(file, input_format)
+            for chunk_no, chunk in enumerate(batched(lines, self.progress.chunk_size)):
+                if chunk_no < done:
+                    continue
+                pending.append((chunk_no, pool.submit(parse_chunk, table, header, chunk)))
+                if len(pending) >= workers * 2:
+                    self._finish_chunk(key, table, path, header, totals, *pending.popleft())
+            while pending:
+                self._finish_chunk(key, table, path, header, totals, *pending.popleft())
+        return totals
+
+    def _finish_chunk(
+        self,
+        key: str,
+        table: str,
+        path: Path,
+        header: list[str] | None,
+        totals: Totals,
+        chunk_no: int,
+        future: Future[ChunkResult],
+    ) -> None:
+        result = future.result()
+        totals.rows += result.rows
+        totals.invalid += result.invalid
+        for index, error in result.errors[: ERRORS_SHOWN - totals.errors_shown]:
+            line_no = chunk_no * self.progress.chunk_size + index + 1 + (header is not None)
+            self.stderr.write(f'{path}:{line_no}: {error}')
+            totals.errors_shown += 1
+        if self.dry_run:
+            return
+        table_name, record = TABLES[table]
+        try:
+            if result.rows:
+                self.client.insert_columns(
+                    table_name, record._fields, result.columns, dedup_token=f'import:{key}:{chunk_no}'
+                )
+        except ClickHouseWriteError as e:
+            raise CommandError(f'{e}. Rerun with the same --checkpoint to resume') from e
+        self.progress.set(key, chunk_no + 1)
+        if self.verbose:
+            self.stdout.write(f'{path}: chunk {chunk_no}, {result.rows} rows')
+
+
+def _detect_format(path: Path) -> str:
+    suffixes = [suffix for suffix in path.suffixes if suffix != '.gz']
+    return 'csv' if suffixes and suffixes[-1] == '.csv' else 'jsonl'
+
+
+def _open(path: Path, input_format: str) -> IO[Any]:
+    # JSON разбирается из байтов в процессах пула, CSV - модулем csv здесь: в полях бывают переводы строк
+    mode = 'rb' if input_format == 'jsonl' else 'rt'
+    if path.suffix == '.gz':
+        return gzip.open(path, mode, newline='') if mode == 'rt' else gzip.open(path, mode)
+    return path.open(mode, newline='') if mode == 'rt' else path.open(mode)
+
+
+def _lines(file: IO[Any], input_format: str) -> tuple[list[str] | None, Iterator[Any]]:
+    if input_format == 'jsonl':
+        return None, iter(file)
+    reader = csv.reader(file)
+    return next(reader, []), reader
+
+
+def _report(totals: Totals, elapsed: float) -> str:
+    rate = totals.rows / elapsed if elapsed else 0.0
+    return f'{totals.rows} rows, {totals.invalid} invalid, {elapsed:.1f}s, {rate:.0f} rows/s'
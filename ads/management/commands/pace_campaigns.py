@@ -0,0 +1,84 @@
+import logging
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.utils.timezone import localdate, now
+
+from ads.budget import to_micros
+from ads.invalidation import INVALIDATION_BUS
+from ads.models import Campaign
+from ads.pacing import PacingController, PacingState, target_share
+from ads.redis import REDIS_CLIENT
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Расчет долей пейсинга: равномерный расход бюджета кампаний между датами начала и окончания'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--once', action='store_true', help='Один шаг и завершение')
+        parser.add_argument('--interval', type=float, default=5.0, help='Шаг регулятора, секунд')
+        parser.add_argument('--kp', type=float, default=10.0, help='Пропорциональный коэффициент')
+        parser.add_argument('--ki', type=float, default=10.0, help='Интегральный коэффициент, 1/час')
+        parser.add_argument('--min-throttle', type=float, default=0.01, help='Минимальная доля запросов')
+
+    def handle(
+        self,
+        *args: Any,
+        once: bool,
+        interval: float,
+        kp: float,
+        ki: float,
+        min_throttle: float,
+        **options: Any,
+    ) -> None:
+        controller = PacingController(kp=kp, ki=ki, min_throttle=min_throttle)
+        # Интегралы переживают перезапуск команды, иначе после него кампании получат всплеск показов
+        states = {
+            campaign_id: PacingState(integral=integral)
+            for campaign_id, integral in REDIS_CLIENT.get_pacing_integrals().items()
+        }
+        last_step = time.monotonic()
+        while True:
+            step = time.monotonic()
+            try:
+                states = self._step(controller, states, dt=(step - last_step) / 3600)
+            except Exception:
+                if once:
+                    raise
+                logger.exception('Pacing step failed, will retry')
+            last_step = step
+            if once:
+                return
+            time.sleep(interval)
+
+    def _step(
+        self,
+        controller: PacingController,
+        states: dict[int, PacingState],
+        dt: float,
+    ) -> dict[int, PacingState]:
+        today = localdate()
+        campaigns = list(
+            Campaign.objects.filter(
+                is_active=True, start_date__lte=today, end_date__gte=today, budget__gt=0
+            ).values_list('pk', 'budget', 'start_date', 'end_date')
+        )
+        spent = REDIS_CLIENT.get_spent([campaign_id for campaign_id, *_ in campaigns])
+
+        moment = now()
+        new_states: dict[int, PacingState] = {}
+        for campaign_id, budget, start_date, end_date in campaigns:
+            error = target_share(start_date, end_date, moment) - spent[campaign_id] / to_micros(budget)
+            new_states[campaign_id] = controller.update(states.get(campaign_id, PacingState()), error, dt)
+
+        REDIS_CLIENT.set_pacing(
+            throttles={
+                campaign_id: state.throttle for campaign_id, state in new_states.items() if state.throttle < 1.0
+            },
+            integrals={campaign_id: state.integral for campaign_id, state in new_states.items() if state.integral},
+        )
+        INVALIDATION_BUS.publish('pacing')
+        return new_states
@@ -0,0 +1,78 @@
+import logging
+import time
+from datetime import timedelta
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import localdate
+
+from ads.budget import MICROS, from_micros, sync_campaign_budget, to_micros
+from ads.models import Campaign
+from ads.redis import REDIS_CLIENT
+from billing.models import ClientBalance
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Сверка расхода кампаний в Redis с Postgres и обновление бюджетов и лимитов в Redis'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--once', action='store_true', help='Один проход и завершение')
+        parser.add_argument('--interval', type=float, default=60.0, help='Пауза между проходами, секунд')
+
+    def handle(self, *args: Any, once: bool, interval: float, **options: Any) -> None:
+        while True:
+            try:
+                self._reconcile()
+            except Exception:
+                if once:
+                    raise
+                logger.exception('Budget reconciliation failed, will retry')
+            if once:
+                return
+            time.sleep(interval)
+
+    def _reconcile(self) -> None:
+        # Закончившиеся вчера кампании тоже сверяем: в Redis мог остаться расход за последние минуты
+        campaigns = list(
+            Campaign.objects.filter(end_date__gte=localdate() - timedelta(days=1)).values_list(
+                'pk', 'client_id', 'budget', 'cost_model', 'price', 'spent'
+            )
+        )
+
+        # Сначала лимиты клиентов, чтобы sync_budget пересчитал исчерпание уже по ним
+        client_ids = {client_id for _, client_id, *_ in campaigns}
+        for client_id in client_ids:
+            self._settle_client(client_id)
+
+        spent_by_campaign: dict[int, int] = {}
+        for campaign_id, client_id, budget, cost_model, price, spent in campaigns:
+            spent_by_campaign[campaign_id] = sync_campaign_budget(
+                campaign_id, client_id, budget, cost_model, price, spent
+            )
+
+        # update() без сигналов: сверка не должна инвалидировать кеши воркеров
+        for campaign_id, spent in spent_by_campaign.items():
+            Campaign.objects.filter(pk=campaign_id).update(spent=from_micros(spent))
+
+        self.stdout.write(f'Reconciled {len(spent_by_campaign)} campaigns of {len(client_ids)} clients')
+
+    def _settle_client(self, client_id: int) -> None:
+        """Списание накопленного в Redis расхода с баланса клиента"""
+        with transaction.atomic():
+            balance = ClientBalance.objects.select_for_update().filter(client_id=client_id).first()
+            if balance is None:
+                # Без баланса лимит клиента не проверяется, только бюджеты кампаний
+                REDIS_CLIENT.settle_client(client_id, 0, None)
+                return
+            # Баланс хранится в копейках, остаток меньше копейки ждет следующей сверки
+            unbilled = REDIS_CLIENT.get_unbilled(client_id)
+            billed = unbilled - unbilled % (MICROS // 100)
+            if billed:
+                ClientBalance.objects.filter(pk=balance.pk).update(amount=F('amount') - from_micros(billed))
+                balance.refresh_from_db(fields=['amount'])
+            # Redis обновляется внутри транзакции: если он недоступен, списание в Postgres откатится
+            REDIS_CLIENT.settle_client(client_id, billed, to_micros(balance.amount + balance.credit_limit))
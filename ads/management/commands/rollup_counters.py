@@ -0,0 +1,66 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from django.utils.timezone import localtime, now
+
+from ads.redis import REDIS_CLIENT
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Свертка минутных счетчиков Redis в часовые и дневные и установка сроков хранения'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--once', action='store_true', help='Один проход и завершение')
+        parser.add_argument('--interval', type=float, default=60.0, help='Пауза между проходами, секунд')
+        parser.add_argument(
+            '--delay',
+            type=float,
+            default=120.0,
+            help='Сколько секунд ждать после конца часа: воркеры с агрегацией досылают счетчики с задержкой',
+        )
+        parser.add_argument(
+            '--recheck-hours',
+            type=int,
+            default=6,
+            help='Сколько уже свернутых часов проверять на опоздавшие события в каждом проходе',
+        )
+
+    def handle(self, *args: Any, once: bool, interval: float, delay: float, recheck_hours: int, **options: Any) -> None:
+        while True:
+            try:
+                self._rollup(timedelta(seconds=delay), recheck_hours)
+            except Exception:
+                if once:
+                    raise
+                logger.exception('Counter rollup failed, will retry')
+            if once:
+                return
+            time.sleep(interval)
+
+    def _rollup(self, delay: timedelta, recheck_hours: int) -> None:
+        current_hour = _hour_start(now() - delay)
+        rolled_until = REDIS_CLIENT.get_rolled_until()
+        # Без отметки начинаем с самых старых минут, которые еще могут храниться
+        hour = rolled_until or _hour_start(current_hour - timedelta(hours=settings.REDIS_STATS_MINUTES_TTL_HOURS))
+        # Свернутые часы повторяются: сворачиваются только объекты с событиями, пришедшими после свертки
+        if rolled_until:
+            hour = _hour_start(hour - timedelta(hours=recheck_hours))
+        while hour < current_hour:
+            next_hour = _hour_start(hour + timedelta(hours=1))
+            rolled = REDIS_CLIENT.rollup_counters(hour)
+            # Отметка после каждого часа: при сбое следующий проход продолжит с него
+            if rolled_until is None or next_hour > rolled_until:
+                REDIS_CLIENT.set_rolled_until(next_hour)
+            if rolled:
+                self.stdout.write(f'Rolled up {rolled} counters for {hour:%Y-%m-%d %H:00}')
+            hour = next_hour
+
+
+def _hour_start(moment: datetime) -> datetime:
+    return localtime(moment).replace(minute=0, second=0, microsecond=0)
@@ -0,0 +1,85 @@
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from ads.ch import CHClient, ClickHouseWriteError
+from ads.journal import Row, read_segment, seal_abandoned_segments, sealed_segments
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = 'shipper.checkpoint'
+CHECKPOINT_HISTORY = 1000
+
+
+class Checkpoint:
+    """Список уже отправленных сегментов.
+
+    Защищает от повторной вставки, если шиппер упал между INSERT и удалением
+    сегмента. Повтор INSERT до записи чекпоинта отсекается ClickHouse по
+    insert_deduplication_token.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.shipped: list[str] = json.loads(path.read_text())['shipped'] if path.exists() else []
+
+    def __contains__(self, segment: str) -> bool:
+        return segment in self.shipped
+
+    def add(self, segment: str) -> None:
+        self.shipped = [*self.shipped, segment][-CHECKPOINT_HISTORY:]
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'shipped': self.shipped}))
+        tmp.replace(self.path)
+
+
+class Command(BaseCommand):
+    help = 'Отправка закрытых сегментов журнала событий в ClickHouse'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--once', action='store_true', help='Отправить накопленное и завершиться')
+        parser.add_argument('--interval', type=float, default=5.0, help='Пауза между проходами, секунд')
+        parser.add_argument('--chunk-size', type=int, default=50_000, help='Строк в одном INSERT')
+
+    def handle(self, *args: Any, once: bool, interval: float, chunk_size: int, **options: Any) -> None:
+        directory: Path = settings.CH_JOURNAL_DIR
+        directory.mkdir(parents=True, exist_ok=True)
+        client = CHClient()
+        checkpoint = Checkpoint(directory / CHECKPOINT_NAME)
+
+        while True:
+            seal_abandoned_segments(directory, stale_after=settings.CH_JOURNAL_SEGMENT_MAX_AGE * 2)
+            for segment in sealed_segments(directory):
+                try:
+                    self._ship(client, checkpoint, segment, chunk_size)
+                except ClickHouseWriteError:
+                    # Сохраняем порядок: следующий сегмент только после успешной отправки текущего
+                    logger.exception('Failed to ship segment %s, will retry', segment.name)
+                    break
+            if once:
+                return
+            time.sleep(interval)
+
+    def _ship(self, client: CHClient, checkpoint: Checkpoint, segment: Path, chunk_size: int) -> None:
+        if segment.name not in checkpoint:
+            rows_by_table: dict[str, list[Row]] = {}
+            for table, row in read_segment(segment):
+                rows_by_table.setdefault(table, []).append(row)
+
+            for table, rows in rows_by_table.items():
+                for chunk_no, start in enumerate(range(0, len(rows), chunk_size)):
+                    client.insert_rows(
+                        table,
+                        rows[start : start + chunk_size],
+                        dedup_token=f'{segment.name}:{table}:{chunk_no}',
+                    )
+            checkpoint.add(segment.name)
+            self.stdout.write(
+                f'{segment.name}: ' + ', '.join(f'{table} {len(rows)}' for table, rows in rows_by_table.items())
+            )
+        segment.unlink()
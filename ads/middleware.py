@@ -0,0 +1,97 @@
+from collections.abc import Awaitable, Callable
+from importlib import import_module
+from typing import Any
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.handlers.exception import convert_exception_to_response
+from django.http import HttpRequest, HttpResponseBase
+from django.urls import resolve
+from django.utils.module_loading import import_string
+
+
+class AdServingMiddleware:
+    """Облегченный конвейер обработки запросов показа и клика.
+
+    Должен стоять первым в MIDDLEWARE. Запросы с путями из ADS_SERVING_PATHS
+    не идут дальше по основному стеку (сессии, CSRF, аутентификация, сообщения),
+    а проходят только через ADS_MIDDLEWARE и сразу попадают во вьюху.
+    Остальные запросы, включая админку, обрабатываются полным стеком.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable[[HttpRequest], Any]) -> None:
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.paths = tuple(settings.ADS_SERVING_PATHS)
+        self.serve = self._build_chain()
+
+    def __call__(self, request: HttpRequest) -> Any:
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.path_info.startswith(self.paths):
+            return self.serve(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        if request.path_info.startswith(self.paths):
+            return await self.serve(request)
+        return await self.get_response(request)
+
+    def _build_chain(self) -> Callable[[HttpRequest], Any]:
+        handler = convert_exception_to_response(self._aserve if self.async_mode else self._serve)
+        for middleware_path in reversed(settings.ADS_MIDDLEWARE):
+            handler = convert_exception_to_response(import_string(middleware_path)(handler))
+        return handler
+
+    def _serve(self, request: HttpRequest) -> HttpResponseBase:
+        match = resolve(request.path_info)
+        request.resolver_match = match
+        view = match.func
+        if iscoroutinefunction(view):
+            view = async_to_sync(view)
+        return view(request, *match.args, **match.kwargs)
+
+    async def _aserve(self, request: HttpRequest) -> HttpResponseBase:
+        match = resolve(request.path_info)
+        request.resolver_match = match
+        view: Callable[..., Awaitable[HttpResponseBase]] = match.func
+        if not iscoroutinefunction(view):
+            view = sync_to_async(match.func, thread_sensitive=True)
+        return await view(request, *match.args, **match.kwargs)
+
+
+def _session(request: HttpRequest) -> Any | None:
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not settings.ADS_ATTRIBUTE_USERS or not session_key:
+        return None
+    return import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+
+
+def attributed_user_id(request: HttpRequest) -> int | None:
+    """Id пользователя из сессионной куки для атрибуции показа.
+
+    Работает только при включенном ADS_ATTRIBUTE_USERS и только для запросов
+    с сессионной кукой, поэтому анонимный трафик не платит за загрузку сессии.
+    Хеш пароля не сверяется: результат годится для статистики, но не для
+    проверки прав.
+    """
+    session = _session(request)
+    if session is None:
+        return None
+    user_id = session.get(SESSION_KEY)
+    return int(user_id) if user_id else None
+
+
+async def aattributed_user_id(request: HttpRequest) -> int | None:
+    """Асинхронная версия attributed_user_id"""
+    session = _session(request)
+    if session is None:
+        return None
+    user_id = await session.aget(SESSION_KEY)
+    return int(user_id) if user_id else None
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 15:32
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0002_banner_click_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='cost_model',
+            field=models.CharField(choices=[('CPM', 'За 1000 показов'), ('CPC', 'За клик')], default='CPM', max_length=3, verbose_name='Модель оплаты'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.0'), max_digits=10, verbose_name='Цена (₽)'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='spent',
+            field=models.DecimalField(decimal_places=6, default=Decimal('0.0'), help_text='Обновляется из Redis командой reconcile_budgets', max_digits=12, verbose_name='Израсходовано (₽)'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0003_campaign_cost_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='frequency_cap',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Сколько раз один пользователь может увидеть кампанию за период. Пусто - без ограничения', null=True, verbose_name='Лимит показов на пользователя'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='frequency_period',
+            field=models.PositiveIntegerField(choices=[(3600, 'Час'), (86400, 'Сутки'), (604800, 'Неделя')], default=86400, verbose_name='Период лимита показов'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0004_campaign_frequency_cap'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='banner',
+            index=models.Index(fields=['campaign', '-created_at', '-id'], name='banner_campaign_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='banner',
+            index=models.Index(fields=['-created_at', '-id'], name='banner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['client', '-start_date', '-id'], name='campaign_client_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['-start_date', '-id'], name='campaign_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['-created_at', '-id'], name='client_created_idx'),
+        ),
+    ]
@@ -1,13 +1,17 @@
+from decimal import Decimal
 from typing import Any
 
 from django.contrib.auth.models import User
 from django.db import models
 
+from ads.ch import CostModel
+
 
 class Client(models.Model):
     class Meta:
         verbose_name = 'Клиент'
         verbose_name_plural = 'Клиенты'
+        indexes = [models.Index(fields=['-created_at', '-id'], name='client_created_idx')]
 
     name = models.CharField('Название', max_length=255)
     tax_id = models.CharField('ИНН', max_length=12, unique=True)
@@ -38,11 +42,39 @@ class Campaign(models.Model):
     class Meta:
         verbose_name = 'Кампания'
         verbose_name_plural = 'Кампании'
+        # Списки админки: фильтр по клиентам пользователя с сортировкой по дате начала
+        indexes = [
+            models.Index(fields=['client', '-start_date', '-id'], name='campaign_client_start_idx'),
+            models.Index(fields=['-start_date', '-id'], name='campaign_start_idx'),
+        ]
+
+    class FrequencyPeriods(models.IntegerChoices):
+        HOUR = 60 * 60, 'Час'
+        DAY = 24 * 60 * 60, 'Сутки'
+        WEEK = 7 * 24 * 60 * 60, 'Неделя'
 
     name = models.CharField('Название', max_length=255)
     client = models.ForeignKey(Client, on_delete=models.PROTECT)
     author = models.ForeignKey(User, on_delete=models.PROTECT)
     budget = models.DecimalField('Бюджет (₽)', max_digits=10, decimal_places=2)
+    cost_model = models.CharField('Модель оплаты', max_length=3, choices=CostModel, default=CostModel.CPM)
+    price = models.DecimalField('Цена (₽)', max_digits=10, decimal_places=2, default=Decimal('0.0'))
+    spent = models.DecimalField(
+        'Израсходовано (₽)',
+        max_digits=12,
+        decimal_places=6,
+        default=Decimal('0.0'),
+        help_text='Обновляется из Redis командой reconcile_budgets',
+    )
+    frequency_cap = models.PositiveSmallIntegerField(
+        'Лимит показов на пользователя',
+        null=True,
+        blank=True,
+        help_text='Сколько раз один пользователь может увидеть кампанию за период. Пусто - без ограничения',
+    )
+    frequency_period = models.PositiveIntegerField(
+        'Период лимита показов', choices=FrequencyPeriods, default=FrequencyPeriods.DAY
+    )
     start_date = models.DateField('Дата начала')
     end_date = models.DateField('Дата окончания')
     is_active = models.BooleanField('Активна', default=True)
@@ -57,6 +89,11 @@ class Banner(models.Model):
     class Meta:
         verbose_name = 'Баннер'
         verbose_name_plural = 'Баннеры'
+        # Списки админки: фильтр по кампаниям доступных клиентов с сортировкой по дате создания
+        indexes = [
+            models.Index(fields=['campaign', '-created_at', '-id'], name='banner_campaign_created_idx'),
+            models.Index(fields=['-created_at', '-id'], name='banner_created_idx'),
+        ]
 
     name = models.CharField('Служебное название', max_length=255)
     campaign = models.ForeignKey(Campaign, on_delete=models.PROTECT, related_name='banners')
@@ -0,0 +1,128 @@
+import logging
+import os
+import random
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import TYPE_CHECKING, cast
+
+from django.conf import settings
+from django.utils.functional import LazyObject
+from django.utils.timezone import get_current_timezone
+
+from ads.invalidation import ALL, INVALIDATION_BUS
+from ads.redis import REDIS_CLIENT
+
+if TYPE_CHECKING:
+    from ads.decisioning import LineItem, RequestAttributes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class PacingState:
+    integral: float = 0.0
+    throttle: float = 1.0
+
+
+class PacingController:
+    """PI-регулятор доли запросов, в которых кампания участвует в подборе баннера.
+
+    Ошибка - отставание фактического расхода от целевой кривой в долях бюджета:
+    положительная, если кампания недотрачивает. Пропорциональная часть
+    реагирует на текущее отклонение, интегральная подбирает установившуюся
+    долю для кампаний, которым трафика больше, чем нужно. Интеграл не
+    накапливается, пока доля упирается в границы (anti-windup).
+    """
+
+    def __init__(self, kp: float, ki: float, min_throttle: float) -> None:
+        self.kp = kp
+        self.ki = ki
+        self.min_throttle = min_throttle
+
+    def update(self, state: PacingState, error: float, dt: float) -> PacingState:
+        """dt - время с прошлого шага, часов"""
+        integral = state.integral + error * dt
+        throttle = 1.0 + self.kp * error + self.ki * integral
+        if throttle >= 1.0:
+            return PacingState(integral if error < 0 else state.integral, 1.0)
+        if throttle <= self.min_throttle:
+            return PacingState(integral if error > 0 else state.integral, self.min_throttle)
+        return PacingState(integral, throttle)
+
+
+def target_share(start_date: date, end_date: date, moment: datetime) -> float:
+    """Доля бюджета, которую кампания должна израсходовать к моменту при равномерном расходе"""
+    tz = get_current_timezone()
+    start = datetime.combine(start_date, time.min, tz)
+    end = datetime.combine(end_date + timedelta(days=1), time.min, tz)
+    return min(max((moment - start) / (end - start), 0.0), 1.0)
+
+
+class PacingGate:
+    """Случайный фильтр кандидатов по долям, рассчитанным командой pace_campaigns.
+
+    Доли перечитываются из Redis раз в `refresh_interval` секунд и сразу после
+    публикации новых значений. Кампании без доли не ограничиваются.
+
+    Подключен только к DECISION_ENGINE: показы баннеров по id (show_banner, show_banners)
+    не ограничиваются, их расход регулятор учитывает через долю в подборе.
+    """
+
+    def __init__(self, refresh_interval: float) -> None:
+        self.refresh_interval = refresh_interval
+        self._throttles: dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid: int | None = None
+
+    def filter_candidates(self, candidates: list['LineItem'], attributes: 'RequestAttributes') -> list['LineItem']:
+        """Фильтр для DECISION_ENGINE. Решение принимается один раз на кампанию"""
+        self._ensure_started()
+        throttles = self._throttles
+        passed: dict[int, bool] = {}
+        result: list[LineItem] = []
+        for item in candidates:
+            campaign_passed = passed.get(item.campaign_id)
+            if campaign_passed is None:
+                throttle = throttles.get(item.campaign_id, 1.0)
+                campaign_passed = passed[item.campaign_id] = throttle >= 1.0 or random.random() < throttle
+            if campaign_passed:
+                result.append(item)
+        return result
+
+    def invalidate(self, kind: str, object_id: int) -> None:
+        if kind in ('pacing', ALL):
+            self._wakeup.set()
+
+    @property
+    def throttled(self) -> int:
+        return sum(throttle < 1.0 for throttle in self._throttles.values())
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='pacing-refresh', daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self._throttles = REDIS_CLIENT.get_throttles()
+            except Exception:
+                logger.exception('Failed to refresh pacing throttles')
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+
+
+class LazyPacingGate(LazyObject):
+    def _setup(self) -> None:
+        gate = PacingGate(refresh_interval=settings.PACING_REFRESH_INTERVAL)
+        INVALIDATION_BUS.subscribe(gate.invalidate)
+        self._wrapped = gate
+
+
+PACING_GATE = cast(PacingGate, LazyPacingGate())
@@ -1,11 +1,63 @@
-from django.contrib.auth.models import User
+from django.conf import settings
+from django.contrib.auth.models import AbstractBaseUser, AnonymousUser, User
+from django.core.cache import cache
+from django.db.models import CharField, Value
 
 from ads.models import Client, User2Client
 
+# Роль владельца клиента в карте ролей: владельцу доступно все
+OWNER = 'owner'
 
-def check_client_permission(user: User, client: Client, roles: tuple[User2Client.ClientStaffRoles, ...]) -> bool:
-    if user.is_superuser:
-        return True
-    if client.owner == user:
+ALL_ROLES = (
+    User2Client.ClientStaffRoles.ADMIN,
+    User2Client.ClientStaffRoles.EDITOR,
+    User2Client.ClientStaffRoles.READER,
+)
+
+
+def get_client_roles(user: User | AbstractBaseUser | AnonymousUser) -> dict[int, str]:
+    """Роли пользователя по клиентам {id клиента: роль}, один запрос к базе.
+
+    Карта кешируется на объекте пользователя (то есть на время запроса) и в общем
+    для воркеров кеше Django (Redis) на CLIENT_ROLES_CACHE_TTL секунд. При изменении
+    персонала или владельца клиента записи кеша удаляются сигналами
+    """
+    if not user.is_authenticated:
+        return {}
+    roles: dict[int, str] | None = getattr(user, '_client_roles', None)
+    if roles is not None:
+        return roles
+    key = _cache_key(user.pk)
+    roles = cache.get(key)
+    if roles is None:
+        owned = Client.objects.filter(owner=user).values_list('pk', Value(OWNER, output_field=CharField()))
+        staff = User2Client.objects.filter(user=user).values_list('client_id', 'role')
+        roles = {}
+        # Владелец не может быть в персонале своего клиента, но на всякий случай его роль важнее
+        for client_id, role in sorted(staff.union(owned, all=True), key=lambda row: row[1] == OWNER):
+            roles[client_id] = role
+        cache.set(key, roles, settings.CLIENT_ROLES_CACHE_TTL)
+    user._client_roles = roles  # pyright: ignore[reportAttributeAccessIssue]
+    return roles
+
+
+def get_client_ids(user: User | AbstractBaseUser | AnonymousUser, roles: tuple[str, ...] = ALL_ROLES) -> list[int]:
+    """Клиенты, в которых у пользователя одна из ролей (или он владелец), для фильтров get_queryset"""
+    return [client_id for client_id, role in get_client_roles(user).items() if role == OWNER or role in roles]
+
+
+def check_client_permission(
+    user: User | AbstractBaseUser | AnonymousUser, client_id: int, roles: tuple[str, ...]
+) -> bool:
+    if getattr(user, 'is_superuser', False):
         return True
-    return User2Client.objects.filter(client=client, user=user, role__in=roles).exists()
+    role = get_client_roles(user).get(client_id)
+    return role is not None and (role == OWNER or role in roles)
+
+
+def invalidate_client_roles(*user_ids: int | None) -> None:
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids if user_id is not None])
+
+
+def _cache_key(user_id: int) -> str:
+    return f'ads:client_roles:{user_id}'
@@ -1,21 +1,189 @@
-
+import json
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import UTC, date, datetime, timedelta
 from typing import Any, cast
+from uuid import UUID
 
 from django.conf import settings
 from django.utils.functional import LazyObject, cached_property
+from django.utils.timezone import localtime, now
 from redis import StrictRedis
+from redis.asyncio import StrictRedis as AsyncStrictRedis
+from redis.asyncio.client import Pipeline as AsyncPipeline
+from redis.client import Pipeline, PubSub
+from redis.commands.core import Script
+
+from ads.counters import CounterAggregator, Deltas, Uniques
+
+# Бюджеты хранятся в микрорублях. Хеш campaign:<id>:budget: limit, spent, client, show_cost, click_cost;
+# хеш client:<id>:budget: limit (баланс + кредитный лимит), unbilled (еще не списано с баланса в Postgres).
+# Скрипты обращаются к ключам клиента по id из хеша кампании, поэтому требуют Redis без кластера
+EXHAUSTED_CAMPAIGNS_KEY = 'budget:exhausted'
+# Доли пейсинга и интегралы регулятора по кампаниям, пишет pace_campaigns
+PACING_THROTTLES_KEY = 'pacing:throttles'
+PACING_INTEGRALS_KEY = 'pacing:integrals'
+# Счетчики по времени, хеши: stats:<объект>:m:<YYYYMMDDHH> (поле <MM>:<метрика>), stats:<объект>:h:<YYYYMMDD>
+# (<HH>:<метрика>), stats:<объект>:d:<YYYYMM> (<DD>:<метрика>), объект - banner:<id> или campaign:<id>.
+# Минуты пишутся вместе с событием (с TTL минут), часы и дни заполняет rollup_counters. Хеш
+# stats:index:<YYYYMMDDHH> - объекты с числом событий за час, по нему свертка находит минутные хеши без SCAN;
+# stats:rolled:<YYYYMMDDHH> - число событий объекта на момент последней свертки
+STATS_METRICS = ('shows', 'clicks')
+STATS_ROLLED_KEY = 'stats:rolled'
+
+# KEYS: хеш кампании, исчерпанные кампании. ARGV: id кампании, показов, кликов.
+# Возвращает кампании, исчерпанные этим списанием
+DEBIT_SCRIPT = """
+local budget = redis.call('HMGET', KEYS[1], 'show_cost', 'click_cost', 'limit', 'client')
+local amount = (tonumber(budget[1]) or 0) * tonumber(ARGV[2]) + (tonumber(budget[2]) or 0) * tonumber(ARGV[3])
+if amount == 0 then
+    return {}
+end
+local exhausted = {}
+local spent = redis.call('HINCRBY', KEYS[1], 'spent', amount)
+if budget[3] and spent >= tonumber(budget[3]) and redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+    table.insert(exhausted, ARGV[1])
+end
+if budget[4] then
+    local client_key = 'client:' .. budget[4] .. ':budget'
+    local unbilled = redis.call('HINCRBY', client_key, 'unbilled', amount)
+    local limit = redis.call('HGET', client_key, 'limit')
+    if limit and unbilled >= tonumber(limit) then
+        for _, campaign_id in ipairs(redis.call('SMEMBERS', 'client:' .. budget[4] .. ':campaigns')) do
+            if redis.call('SADD', KEYS[2], campaign_id) == 1 then
+                table.insert(exhausted, campaign_id)
+            end
+        end
+    end
+end
+return exhausted
+"""
+
+# KEYS: хеш кампании, хеш клиента, кампании клиента, исчерпанные кампании.
+# ARGV: id кампании, id клиента, бюджет, стоимость показа, стоимость клика, израсходовано по Postgres.
+# Расход из Postgres используется, только если в Redis его нет (например, после потери данных)
+SYNC_SCRIPT = """
+redis.call('HSET', KEYS[1], 'limit', ARGV[3], 'client', ARGV[2], 'show_cost', ARGV[4], 'click_cost', ARGV[5])
+redis.call('HSETNX', KEYS[1], 'spent', ARGV[6])
+redis.call('SADD', KEYS[3], ARGV[1])
+local spent = tonumber(redis.call('HGET', KEYS[1], 'spent'))
+local client = redis.call('HMGET', KEYS[2], 'unbilled', 'limit')
+if spent >= tonumber(ARGV[3]) or (client[2] and (tonumber(client[1]) or 0) >= tonumber(client[2])) then
+    redis.call('SADD', KEYS[4], ARGV[1])
+else
+    redis.call('SREM', KEYS[4], ARGV[1])
+end
+return spent
+"""
+
+# KEYS: хеш клиента. ARGV: сумма, списанная с баланса в Postgres, новый лимит ('' - без лимита)
+SETTLE_SCRIPT = """
+redis.call('HINCRBY', KEYS[1], 'unbilled', -tonumber(ARGV[1]))
+if ARGV[2] == '' then
+    redis.call('HDEL', KEYS[1], 'limit')
+else
+    redis.call('HSET', KEYS[1], 'limit', ARGV[2])
+end
+"""
+
+# KEYS: минутный, часовой и дневной хеши объекта, хеш свернутых счетчиков индекса.
+# ARGV: поле часа, поле дня, TTL минут, часов и дней в секундах, объект, его счетчик в индексе.
+# В минутном хеше поля rolled:<метрика> - уже перенесенные суммы, в часы и дни добавляется только разница:
+# повтор после сбоя ничего не удвоит, а повторная свертка часа подберет опоздавшие события
+ROLLUP_SCRIPT = """
+local values = redis.call('HGETALL', KEYS[1])
+local totals, rolled = {}, {}
+for i = 1, #values, 2 do
+    local metric = string.match(values[i], '^rolled:(.+)$')
+    if metric then
+        rolled[metric] = tonumber(values[i + 1])
+    else
+        metric = string.match(values[i], '^%d%d:(.+)$')
+        if metric then
+            totals[metric] = (totals[metric] or 0) + tonumber(values[i + 1])
+        end
+    end
+end
+-- Час, свернутый прежней версией скрипта (отметка rolled = 1), считается перенесенным целиком
+local legacy = redis.call('HGET', KEYS[1], 'rolled') and next(rolled) == nil
+local changed = 0
+for metric, total in pairs(totals) do
+    local delta = total - (rolled[metric] or 0)
+    if delta ~= 0 and not legacy then
+        redis.call('HINCRBY', KEYS[2], ARGV[1] .. ':' .. metric, delta)
+        redis.call('HINCRBY', KEYS[3], ARGV[2] .. ':' .. metric, delta)
+        changed = 1
+    end
+    redis.call('HSET', KEYS[1], 'rolled:' .. metric, total)
+end
+redis.call('HSET', KEYS[4], ARGV[6], ARGV[7])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+redis.call('EXPIRE', KEYS[4], ARGV[3])
+return changed
+"""
+
+# KEYS: хеши бакетов. ARGV: JSON-список полей (без метрики) для каждого ключа, JSON-список метрик.
+# Возвращает суммы по метрикам в порядке ARGV[2]
+RANGE_SCRIPT = """
+local slots = cjson.decode(ARGV[1])
+local metrics = cjson.decode(ARGV[2])
+local totals = {}
+for m = 1, #metrics do
+    totals[m] = 0
+end
+for i, key in ipairs(KEYS) do
+    local fields = {}
+    for _, slot in ipairs(slots[i]) do
+        for _, metric in ipairs(metrics) do
+            table.insert(fields, slot .. ':' .. metric)
+        end
+    end
+    local values = redis.call('HMGET', key, unpack(fields))
+    for j = 1, #values do
+        if values[j] then
+            local m = (j - 1) % #metrics + 1
+            totals[m] = totals[m] + tonumber(values[j])
+        end
+    end
+end
+return totals
+"""
+
+
+@dataclass(frozen=True, slots=True)
+class Counters:
+    shows: int = 0
+    clicks: int = 0
+
+    @property
+    def ctr(self) -> float:
+        """CTR в процентах"""
+        return self.clicks / self.shows * 100 if self.shows else 0.0
+
+    def __add__(self, other: 'Counters') -> 'Counters':
+        return Counters(self.shows + other.shows, self.clicks + other.clicks)
 
 
 class RedisClient:
     @cached_property
     def _redis(self) -> StrictRedis:
+        return StrictRedis(**self._connection_kwargs())
+
+    @cached_property
+    def _aredis(self) -> AsyncStrictRedis:
+        # Пул соединений привязан к event loop воркера, поэтому только для ASGI
+        return AsyncStrictRedis(**self._connection_kwargs())
+
+    def _connection_kwargs(self) -> dict[str, Any]:
         ssl: dict[str, Any] = {}
         if settings.REDIS_SSL_CERTIFICATE_PATH:
             ssl |= {
                 'ssl': True,
                 'ssl_ca_certs': settings.REDIS_SSL_CERTIFICATE_PATH,
             }
-        return StrictRedis(
+        return dict(
             db=settings.REDIS_DATABASE,
             password=settings.REDIS_PASSWORD,
             host=settings.REDIS_HOST,
@@ -23,19 +191,356 @@ class RedisClient:
             **ssl,
         )
 
+    def increment_shows(self, banner_id: int, campaign_id: int | None = None, unit_id: str | None = None) -> None:
+        """Счетчик показов баннера. С unit_id посетитель учитывается в охвате баннера и кампании за день"""
+        self._apply(*self._shows([(banner_id, campaign_id)], unit_id))
+
+    def increment_shows_many(self, shows: Iterable[tuple[int, int | None]], unit_id: str | None = None) -> None:
+        """Показы (id баннера, id кампании) одного посетителя"""
+        self._apply(*self._shows(shows, unit_id))
+
+    def get_shows(self, banner_id: int, include_pending: bool = False) -> int:
+        return self._get_counter(f'banner:{banner_id}:shows', include_pending)
+
+    def increment_clicks(self, banner_id: int, campaign_id: int | None = None) -> None:
+        self._apply(self._clicks(banner_id, campaign_id), {}, 1)
+
+    def get_clicks(self, banner_id: int, include_pending: bool = False) -> int:
+        return self._get_counter(f'banner:{banner_id}:clicks', include_pending)
+
+    def get_banner_counters(self, banner_ids: Iterable[int]) -> dict[int, Counters]:
+        """Показы и клики нескольких баннеров одним MGET"""
+        banner_ids = list(banner_ids)
+        if not banner_ids:
+            return {}
+        keys = [f'banner:{banner_id}:{metric}' for banner_id in banner_ids for metric in ('shows', 'clicks')]
+        values = [int(value or 0) for value in self._redis.mget(keys)]  # pyright: ignore
+        return {
+            banner_id: Counters(shows=values[2 * i], clicks=values[2 * i + 1]) for i, banner_id in enumerate(banner_ids)
+        }
+
+    async def aincrement_shows(
+        self, banner_id: int, campaign_id: int | None = None, unit_id: str | None = None
+    ) -> None:
+        await self._aapply(*self._shows([(banner_id, campaign_id)], unit_id))
+
+    async def aincrement_shows_many(self, shows: Iterable[tuple[int, int | None]], unit_id: str | None = None) -> None:
+        await self._aapply(*self._shows(shows, unit_id))
+
+    async def aincrement_clicks(self, banner_id: int, campaign_id: int | None = None) -> None:
+        await self._aapply(self._clicks(banner_id, campaign_id), {}, 1)
+
+    def claim_click(self, show_uuid: UUID, expire_at: int) -> bool:
+        """Первый ли это клик по показу. Ключ живет, пока действует токен клика: позже токен отклоняется сам"""
+        return bool(self._redis.set(f'click:{show_uuid}', 1, nx=True, exat=expire_at))
+
+    async def aclaim_click(self, show_uuid: UUID, expire_at: int) -> bool:
+        return bool(await self._aredis.set(f'click:{show_uuid}', 1, nx=True, exat=expire_at))
+
+    def get_reach(self, kind: str, object_id: int, date_from: date, date_to: date) -> int:
+        """Оценка числа уникальных посетителей баннера или кампании (kind) за период, включительно.
+
+        PFCOUNT по нескольким ключам считает мощность их объединения, не изменяя их.
+        Погрешность HyperLogLog - 0.81%
+        """
+        days = (date_to - date_from).days + 1
+        if days <= 0:
+            return 0
+        keys = [_reach_key(kind, object_id, date_from + timedelta(days=day)) for day in range(days)]
+        return int(self._redis.pfcount(*keys))  # pyright: ignore
+
+    def get_stats(self, kind: str, object_id: int, start: datetime, end: datetime) -> dict[str, int]:
+        """Показы и клики баннера или кампании (kind) за [start, end) с точностью до минуты.
+
+        Свернутые часы и дни читаются из крупных бакетов, остальное - из минутных;
+        суммирует скрипт на стороне Redis, один запрос на любой период.
+        Минуты хранятся REDIS_STATS_MINUTES_TTL_HOURS после свертки: неполные часы
+        старше этого срока не учитываются
+        """
+        buckets = _stats_buckets(f'stats:{kind}:{object_id}', start, min(end, now()), self.get_rolled_until())
+        if not buckets:
+            return dict.fromkeys(STATS_METRICS, 0)
+        totals = self._range_script(
+            keys=list(buckets), args=[json.dumps(list(buckets.values())), json.dumps(STATS_METRICS)]
+        )
+        return {metric: int(total) for metric, total in zip(STATS_METRICS, totals)}  # pyright: ignore
+
+    def rollup_counters(self, hour: datetime, batch_size: int = 1000) -> int:
+        """Свертка минутных счетчиков часа в часовые и дневные. Возвращает число объектов, у которых они изменились.
+
+        Сворачиваются только объекты, получившие события после прошлой свертки часа,
+        поэтому повторный вызов для уже свернутого часа дешев и переносит опоздавшие события
+        """
+        hour = localtime(hour)
+        index_key = f'stats:index:{hour:%Y%m%d%H}'
+        rolled_key = f'stats:rolled:{hour:%Y%m%d%H}'
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hgetall(index_key)
+        pipe.hgetall(rolled_key)
+        counts, rolled_counts = pipe.execute()
+        objects = [(name.decode(), count) for name, count in counts.items() if rolled_counts.get(name) != count]
+        ttls = [
+            int(timedelta(hours=settings.REDIS_STATS_MINUTES_TTL_HOURS).total_seconds()),
+            int(timedelta(days=settings.REDIS_STATS_HOURS_TTL_DAYS).total_seconds()),
+            int(timedelta(days=settings.REDIS_STATS_DAYS_TTL_DAYS).total_seconds()),
+        ]
+        rolled = 0
+        for offset in range(0, len(objects), batch_size):
+            pipe = self._redis.pipeline(transaction=False)
+            for name, count in objects[offset : offset + batch_size]:
+                self._rollup_script(
+                    keys=[
+                        f'stats:{name}:m:{hour:%Y%m%d%H}',
+                        f'stats:{name}:h:{hour:%Y%m%d}',
+                        f'stats:{name}:d:{hour:%Y%m}',
+                        rolled_key,
+                    ],
+                    args=[f'{hour:%H}', f'{hour:%d}', *ttls, name, count],
+                    client=pipe,
+                )
+            rolled += sum(pipe.execute())
+        return rolled
+
+    def get_rolled_until(self) -> datetime | None:
+        """Начало первого не свернутого часа"""
+        value = self._redis.get(STATS_ROLLED_KEY)
+        return localtime(datetime.fromtimestamp(int(value), tz=UTC)) if value else None  # pyright: ignore
+
+    def set_rolled_until(self, moment: datetime) -> None:
+        self._redis.set(STATS_ROLLED_KEY, int(moment.timestamp()))
 
-    def increment_shows(self, banner_id: int) -> None:
-        self._redis.incr(f'banner:{banner_id}:shows')
+    def apply_increments(self, deltas: Deltas, uniques: Uniques | None = None) -> None:
+        """Отправка накопленных приращений и элементов охвата одной транзакцией.
 
-    def get_shows(self, banner_id: int) -> int:
-        return int(self._redis.get(f'banner:{banner_id}:shows') or 0)  # pyright: ignore
+        MULTI/EXEC: при ошибке не применяется ничего, и повтор отправки не учтет часть событий дважды
+        """
+        pipe = self._redis.pipeline(transaction=True)
+        _pipeline_increments(pipe, deltas, uniques or {})
+        pipe.execute()
+
+    def debit_budgets(self, deltas: Deltas) -> list[int]:
+        """Списание стоимости показов и кликов. Ключ - id кампании, поле - shows или clicks.
+
+        Возвращает кампании, бюджет которых (или баланс клиента) исчерпан этим списанием
+        """
+        counts: dict[str, dict[str | None, int]] = {}
+        for (campaign_id, field), amount in deltas.items():
+            counts.setdefault(campaign_id, {})[field] = amount
+        # Транзакция по той же причине, что в apply_increments: списания повторяются после ошибки
+        pipe = self._redis.pipeline(transaction=True)
+        for campaign_id, events in counts.items():
+            self._debit_script(
+                keys=[f'campaign:{campaign_id}:budget', EXHAUSTED_CAMPAIGNS_KEY],
+                args=[campaign_id, events.get('shows', 0), events.get('clicks', 0)],
+                client=pipe,
+            )
+        return [int(campaign_id) for exhausted in pipe.execute() for campaign_id in exhausted]
+
+    def sync_budget(
+        self,
+        campaign_id: int,
+        client_id: int,
+        limit: int,
+        show_cost: int,
+        click_cost: int,
+        spent: int,
+    ) -> int:
+        """Обновление бюджета и цен кампании, пересчет исчерпания. Возвращает расход по Redis"""
+        return int(
+            self._sync_script(  # pyright: ignore
+                keys=[
+                    f'campaign:{campaign_id}:budget',
+                    f'client:{client_id}:budget',
+                    f'client:{client_id}:campaigns',
+                    EXHAUSTED_CAMPAIGNS_KEY,
+                ],
+                args=[campaign_id, client_id, limit, show_cost, click_cost, spent],
+            )
+        )
 
-    def increment_clicks(self, banner_id: int) -> None:
-        self._redis.incr(f'banner:{banner_id}:clicks')
+    def get_unbilled(self, client_id: int) -> int:
+        return int(self._redis.hget(f'client:{client_id}:budget', 'unbilled') or 0)  # pyright: ignore
 
-    def get_clicks(self, banner_id: int) -> int:
-        return int(self._redis.get(f'banner:{banner_id}:clicks') or 0)  # pyright: ignore
+    def settle_client(self, client_id: int, amount: int, limit: int | None) -> None:
+        """Перенос списанной в Postgres суммы из unbilled и установка нового лимита клиента"""
+        self._settle_script(keys=[f'client:{client_id}:budget'], args=[amount, '' if limit is None else limit])
 
+    def get_exhausted_campaigns(self) -> set[int]:
+        return {int(campaign_id) for campaign_id in self._redis.smembers(EXHAUSTED_CAMPAIGNS_KEY)}  # pyright: ignore
+
+    def get_spent(self, campaign_ids: list[int]) -> dict[int, int]:
+        """Расход кампаний по Redis, микрорублей"""
+        pipe = self._redis.pipeline(transaction=False)
+        for campaign_id in campaign_ids:
+            pipe.hget(f'campaign:{campaign_id}:budget', 'spent')
+        return {campaign_id: int(spent or 0) for campaign_id, spent in zip(campaign_ids, pipe.execute())}
+
+    def get_throttles(self) -> dict[int, float]:
+        return {int(k): float(v) for k, v in self._redis.hgetall(PACING_THROTTLES_KEY).items()}  # pyright: ignore
+
+    def get_pacing_integrals(self) -> dict[int, float]:
+        return {int(k): float(v) for k, v in self._redis.hgetall(PACING_INTEGRALS_KEY).items()}  # pyright: ignore
+
+    def set_pacing(self, throttles: dict[int, float], integrals: dict[int, float]) -> None:
+        """Замена всех долей и интегралов пейсинга одной транзакцией"""
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.delete(PACING_THROTTLES_KEY, PACING_INTEGRALS_KEY)
+        if throttles:
+            pipe.hset(PACING_THROTTLES_KEY, mapping=throttles)  # pyright: ignore
+        if integrals:
+            pipe.hset(PACING_INTEGRALS_KEY, mapping=integrals)  # pyright: ignore
+        pipe.execute()
+
+    def get_frequency_counts(self, fields: list[tuple[str, str]]) -> list[int]:
+        """Счетчики частоты показов (ключ, поле) одним пайплайном"""
+        pipe = self._redis.pipeline(transaction=False)
+        for key, field in fields:
+            pipe.hget(key, field)
+        return [int(count or 0) for count in pipe.execute()]
+
+    async def aget_frequency_counts(self, fields: list[tuple[str, str]]) -> list[int]:
+        pipe = self._aredis.pipeline(transaction=False)
+        for key, field in fields:
+            pipe.hget(key, field)  # pyright: ignore
+        return [int(count or 0) for count in await pipe.execute()]
+
+    def increment_frequency_counts(self, fields: list[tuple[str, str, int]]) -> None:
+        """Приращение счетчиков (ключ, поле, момент истечения ключа) одним пайплайном"""
+        pipe = self._redis.pipeline(transaction=False)
+        for key, field, expire_at in fields:
+            pipe.hincrby(key, field, 1)
+            pipe.expireat(key, expire_at)
+        pipe.execute()
+
+    async def aincrement_frequency_counts(self, fields: list[tuple[str, str, int]]) -> None:
+        pipe = self._aredis.pipeline(transaction=False)
+        for key, field, expire_at in fields:
+            pipe.hincrby(key, field, 1)  # pyright: ignore
+            pipe.expireat(key, expire_at)
+        await pipe.execute()
+
+    @cached_property
+    def _debit_script(self) -> Script:
+        return self._redis.register_script(DEBIT_SCRIPT)
+
+    @cached_property
+    def _sync_script(self) -> Script:
+        return self._redis.register_script(SYNC_SCRIPT)
+
+    @cached_property
+    def _settle_script(self) -> Script:
+        return self._redis.register_script(SETTLE_SCRIPT)
+
+    @cached_property
+    def _rollup_script(self) -> Script:
+        return self._redis.register_script(ROLLUP_SCRIPT)
+
+    @cached_property
+    def _range_script(self) -> Script:
+        return self._redis.register_script(RANGE_SCRIPT)
+
+    def publish(self, channel: str, message: str) -> None:
+        self._redis.publish(channel, message)
+
+    def pubsub(self) -> PubSub:
+        return self._redis.pubsub(ignore_subscribe_messages=True)
+
+    def _shows(self, shows: Iterable[tuple[int, int | None]], unit_id: str | None) -> tuple[Deltas, Uniques, int]:
+        """Приращения, элементы охвата и число показов"""
+        deltas: Deltas = {}
+        uniques: Uniques = {}
+        moment = localtime()
+        today = moment.date()
+        events = 0
+        for banner_id, campaign_id in shows:
+            events += 1
+            counter_key = (f'banner:{banner_id}:shows', None)
+            deltas[counter_key] = deltas.get(counter_key, 0) + 1
+            _add_stats(deltas, f'banner:{banner_id}', 'shows', moment)
+            if campaign_id is not None:
+                _add_stats(deltas, f'campaign:{campaign_id}', 'shows', moment)
+            if unit_id is None:
+                continue
+            uniques.setdefault(_reach_key('banner', banner_id, today), set()).add(unit_id)
+            if campaign_id is not None:
+                uniques.setdefault(_reach_key('campaign', campaign_id, today), set()).add(unit_id)
+        return deltas, uniques, events
+
+    def _clicks(self, banner_id: int, campaign_id: int | None) -> Deltas:
+        deltas: Deltas = {(f'banner:{banner_id}:clicks', None): 1}
+        moment = localtime()
+        _add_stats(deltas, f'banner:{banner_id}', 'clicks', moment)
+        if campaign_id is not None:
+            _add_stats(deltas, f'campaign:{campaign_id}', 'clicks', moment)
+        return deltas
+
+    def _apply(self, deltas: Deltas, uniques: Uniques, events: int) -> None:
+        if settings.REDIS_COUNTER_FLUSH_INTERVAL:
+            COUNTER_AGGREGATOR.merge(deltas, uniques, events)
+        else:
+            self.apply_increments(deltas, uniques)
+
+    async def _aapply(self, deltas: Deltas, uniques: Uniques, events: int) -> None:
+        if settings.REDIS_COUNTER_FLUSH_INTERVAL:
+            COUNTER_AGGREGATOR.merge(deltas, uniques, events)
+        else:
+            # MULTI/EXEC, как в apply_increments
+            pipe = self._aredis.pipeline(transaction=True)
+            _pipeline_increments(pipe, deltas, uniques)
+            await pipe.execute()
+
+    def _get_counter(self, key: str, include_pending: bool) -> int:
+        value = int(self._redis.get(key) or 0)  # pyright: ignore
+        if include_pending and settings.REDIS_COUNTER_FLUSH_INTERVAL:
+            # Только приращения текущего воркера, остальные воркеры досылают свои сами
+            value += COUNTER_AGGREGATOR.pending(key)
+        return value
+
+
+def _reach_key(kind: str, object_id: int, day: date) -> str:
+    return f'{kind}:{object_id}:reach:{day:%Y%m%d}'
+
+
+def _add_stats(deltas: Deltas, name: str, metric: str, moment: datetime) -> None:
+    """Минутный бакет события и отметка объекта в индексе часа"""
+    hour = f'{moment:%Y%m%d%H}'
+    for key in ((f'stats:{name}:m:{hour}', f'{moment:%M}:{metric}'), (f'stats:index:{hour}', name)):
+        deltas[key] = deltas.get(key, 0) + 1
+
+
+def _stats_buckets(prefix: str, start: datetime, end: datetime, rolled_until: datetime | None) -> dict[str, list[str]]:
+    """Разбиение периода на бакеты: ключ хеша -> поля. Крупный бакет берется, если он целиком
+    входит в период и уже свернут"""
+    rolled_until = min(end, rolled_until) if rolled_until else None
+    buckets: dict[str, list[str]] = {}
+    moment = localtime(start).replace(second=0, microsecond=0)
+    while moment < end:
+        if rolled_until and moment.hour == moment.minute == 0 and moment + timedelta(days=1) <= rolled_until:
+            key, slot, step = f'{prefix}:d:{moment:%Y%m}', f'{moment:%d}', timedelta(days=1)
+        elif rolled_until and moment.minute == 0 and moment + timedelta(hours=1) <= rolled_until:
+            key, slot, step = f'{prefix}:h:{moment:%Y%m%d}', f'{moment:%H}', timedelta(hours=1)
+        else:
+            key, slot, step = f'{prefix}:m:{moment:%Y%m%d%H}', f'{moment:%M}', timedelta(minutes=1)
+        buckets.setdefault(key, []).append(slot)
+        moment = localtime(moment + step)
+    return buckets
+
+
+def _pipeline_increments(pipe: Pipeline | AsyncPipeline, deltas: Deltas, uniques: Uniques) -> None:
+    stats_keys: set[str] = set()
+    for (key, field), amount in deltas.items():
+        if field is None:
+            pipe.incrby(key, amount)  # pyright: ignore
+        else:
+            pipe.hincrby(key, field, amount)  # pyright: ignore
+            if key.startswith('stats:'):
+                stats_keys.add(key)
+    # Минутные хеши и индексы часов живут не дольше срока минут, даже если rollup_counters не работает
+    for key in stats_keys:
+        pipe.expire(key, timedelta(hours=settings.REDIS_STATS_MINUTES_TTL_HOURS))  # pyright: ignore
+    for key, members in uniques.items():
+        pipe.pfadd(key, *members)  # pyright: ignore
+        pipe.expire(key, timedelta(days=settings.REDIS_REACH_TTL_DAYS))  # pyright: ignore
 
 
 class LazyRedisClient(LazyObject):
@@ -43,4 +548,16 @@ class LazyRedisClient(LazyObject):
         self._wrapped = RedisClient()
 
 
+class LazyCounterAggregator(LazyObject):
+    def _setup(self) -> None:
+        self._wrapped = CounterAggregator(
+            flush=REDIS_CLIENT.apply_increments,
+            flush_interval=settings.REDIS_COUNTER_FLUSH_INTERVAL / 1000,
+            flush_events=settings.REDIS_COUNTER_FLUSH_EVENTS,
+            max_pending=settings.REDIS_COUNTER_MAX_PENDING,
+            flush_on_exit=settings.REDIS_COUNTER_FLUSH_ON_EXIT,
+        )
+
+
 REDIS_CLIENT = cast(RedisClient, LazyRedisClient())
+COUNTER_AGGREGATOR = cast(CounterAggregator, LazyCounterAggregator())
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, cast
+
+from django.conf import settings
+from django.template import Context
+from django.template.loader import get_template
+from django.utils.functional import LazyObject
+from django.utils.html import escape
+
+from ads.cache import BannerSnapshot
+
+BANNER_TEMPLATE = 'ads/banner.html'
+
+# Значения, которые меняются от показа к показу. Все остальное в шаблоне
+# зависит только от контента баннера и рендерится один раз
+SLOTS = ('click_url', 'show_uuid')
+
+
+def _marker(slot: str) -> str:
+    return f'__reklamito_slot_{slot}__'
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledBanner:
+    content_hash: str
+    template: Any
+    parts: tuple[str, ...]
+    slots: tuple[str, ...]
+
+    def render(self, values: dict[str, str]) -> str:
+        chunks = [self.parts[0]]
+        for slot, part in zip(self.slots, self.parts[1:]):
+            chunks.append(escape(values[slot]))
+            chunks.append(part)
+        return ''.join(chunks)
+
+
+class BannerRenderer:
+    """Рендер баннеров через предкомпилированный HTML-скелет.
+
+    Шаблон рендерится один раз на версию контента баннера с маркерами вместо
+    слотов, результат режется по маркерам. На показ остается экранировать
+    значения слотов и склеить строки. Скелет пересобирается при смене хеша
+    контента или объекта шаблона (перезагрузка шаблонов в DEBUG).
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._compiled: OrderedDict[int, CompiledBanner] = OrderedDict()
+        self._lock = threading.Lock()
+        self.compilations = 0
+
+    def render(self, banner: BannerSnapshot, **values: str) -> str:
+        # Обертка бэкенда создается на каждый вызов, закешированный загрузчиком объект - внутри
+        template = get_template(BANNER_TEMPLATE).template  # pyright: ignore[reportAttributeAccessIssue]
+        with self._lock:
+            compiled = self._compiled.get(banner.id)
+        if compiled is None or compiled.content_hash != banner.content_hash or compiled.template is not template:
+            compiled = self._compile(banner, template)
+        return compiled.render(values)
+
+    def _compile(self, banner: BannerSnapshot, template: Any) -> CompiledBanner:
+        context = Context({'banner': banner, **{slot: _marker(slot) for slot in SLOTS}})
+        html: str = template.render(context)
+
+        parts: list[str] = []
+        slots: list[str] = []
+        position = 0
+        while True:
+            found = [(html.find(_marker(slot), position), slot) for slot in SLOTS]
+            found = [(index, slot) for index, slot in found if index >= 0]
+            if not found:
+                break
+            index, slot = min(found)
+            parts.append(html[position:index])
+            slots.append(slot)
+            position = index + len(_marker(slot))
+        parts.append(html[position:])
+
+        compiled = CompiledBanner(
+            content_hash=banner.content_hash, template=template, parts=tuple(parts), slots=tuple(slots)
+        )
+        with self._lock:
+            self.compilations += 1
+            self._compiled[banner.id] = compiled
+            self._compiled.move_to_end(banner.id)
+            while len(self._compiled) > self.max_size:
+                self._compiled.popitem(last=False)
+        return compiled
+
+
+class LazyBannerRenderer(LazyObject):
+    def _setup(self) -> None:
+        self._wrapped = BannerRenderer(max_size=settings.BANNER_CACHE_SIZE)
+
+
+BANNER_RENDERER = cast(BannerRenderer, LazyBannerRenderer())
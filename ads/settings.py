@@ -6,9 +6,43 @@ CH_PASSWORD: str
 CH_USER: str
 CH_DATABASE: str
 CH_SSL_CERTIFICATE_PATH: Path | None
+CH_INGEST_MODE: str
+CH_BATCH_MAX_ROWS: int
+CH_BATCH_MAX_DELAY: float
+CH_BATCH_QUEUE_SIZE: int
+CH_JOURNAL_DIR: Path
+CH_JOURNAL_FSYNC: str
+CH_JOURNAL_FSYNC_INTERVAL: float
+CH_JOURNAL_SEGMENT_MAX_BYTES: int
+CH_JOURNAL_SEGMENT_MAX_AGE: float
+CH_READ_EVENTS_V2: bool
 
 REDIS_DATABASE: int
 REDIS_PASSWORD: str
 REDIS_HOST: str
 REDIS_PORT: int
 REDIS_SSL_CERTIFICATE_PATH: Path | None
+REDIS_COUNTER_FLUSH_INTERVAL: int
+REDIS_COUNTER_FLUSH_EVENTS: int
+REDIS_COUNTER_MAX_PENDING: int
+REDIS_COUNTER_FLUSH_ON_EXIT: bool
+REDIS_REACH_TTL_DAYS: int
+REDIS_STATS_MINUTES_TTL_HOURS: int
+REDIS_STATS_HOURS_TTL_DAYS: int
+REDIS_STATS_DAYS_TTL_DAYS: int
+BUDGET_REFRESH_INTERVAL: float
+PACING_REFRESH_INTERVAL: float
+
+ADS_ASYNC_VIEWS: bool
+ADS_BATCH_MAX_SLOTS: int
+ADS_SERVING_PATHS: list[str]
+ADS_MIDDLEWARE: list[str]
+ADS_ATTRIBUTE_USERS: bool
+ADS_GEO_HEADER: str
+EXPERIMENT_UNIT_COOKIE: str
+CLIENT_ROLES_CACHE_TTL: int
+
+BANNER_CACHE_SIZE: int
+BANNER_CACHE_TTL: float
+UA_CACHE_SIZE: int
+CLICK_TOKEN_TTL: int
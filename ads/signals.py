@@ -0,0 +1,63 @@
+import logging
+from typing import Any
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from ads.budget import sync_campaign_budget
+from ads.invalidation import INVALIDATION_BUS
+from ads.models import Banner, Campaign, Client, User2Client
+from ads.permissions import invalidate_client_roles
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def invalidate_banner(sender: type[Banner], instance: Banner, **kwargs: Any) -> None:
+    banner_id = instance.pk
+    transaction.on_commit(lambda: INVALIDATION_BUS.publish('banner', banner_id))
+
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+def invalidate_campaign(sender: type[Campaign], instance: Campaign, **kwargs: Any) -> None:
+    campaign_id = instance.pk
+    transaction.on_commit(lambda: INVALIDATION_BUS.publish('campaign', campaign_id))
+
+
+@receiver(post_save, sender=Campaign)
+def sync_budget(sender: type[Campaign], instance: Campaign, **kwargs: Any) -> None:
+    # Без хеша бюджета в Redis списания не идут: новая кампания не ждет reconcile_budgets
+    args = (instance.pk, instance.client_id, instance.budget, instance.cost_model, instance.price, instance.spent)
+
+    def sync() -> None:
+        try:
+            sync_campaign_budget(*args)
+        except Exception:
+            # Сохранение не ломаем, бюджет обновит следующая сверка
+            logger.exception('Failed to sync budget of campaign %s', args[0])
+
+    transaction.on_commit(sync)
+
+
+@receiver(post_save, sender=User2Client)
+@receiver(post_delete, sender=User2Client)
+def invalidate_staff_roles(sender: type[User2Client], instance: User2Client, **kwargs: Any) -> None:
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_client_roles(user_id))
+
+
+@receiver(pre_save, sender=Client)
+def remember_previous_owner(sender: type[Client], instance: Client, **kwargs: Any) -> None:
+    previous = Client.objects.filter(pk=instance.pk).values_list('owner_id', flat=True).first() if instance.pk else None
+    instance._previous_owner_id = previous  # pyright: ignore[reportAttributeAccessIssue]
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def invalidate_owner_roles(sender: type[Client], instance: Client, **kwargs: Any) -> None:
+    # При смене владельца сбрасываются роли и нового, и прежнего
+    owner_ids = {instance.owner_id, getattr(instance, '_previous_owner_id', None)}
+    transaction.on_commit(lambda: invalidate_client_roles(*owner_ids))
@@ -0,0 +1,981 @@
+import json
+import os
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import UTC, date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, ClassVar
+from unittest import mock
+from uuid import uuid4
+from zoneinfo import ZoneInfo
+
+import fakeredis
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import localdate, localtime, now
+
+from ads.budget import sync_campaign_budget
+from ads.cache import BannerCache, BannerSnapshot
+from ads.ch import (
+    BreakdownRow,
+    CHClient,
+    ClickHouseWriteError,
+    CostModel,
+    DeviceType,
+    Dimension,
+    Granularity,
+    ShowEvent,
+    _pick_rollup,
+    to_columns,
+)
+from ads.counters import CounterAggregator, Deltas, Uniques
+from ads.decisioning import DecisionEngine, LineItem, RequestAttributes, TargetingIndex, Window
+from ads.frequency import FrequencyCapper, frequency_cap
+from ads.ingest import BatchWriter, Row
+from ads.invalidation import ALL
+from ads.journal import EventJournal, FsyncPolicy, read_segment, sealed_segments
+from ads.management.commands.ch_migrate import MIGRATIONS_DIR, split_statements
+from ads.management.commands.import_events import parse_chunk
+from ads.models import Banner, Campaign, Client, User2Client
+from ads.pacing import PacingController, PacingGate, PacingState, target_share
+from ads.permissions import ALL_ROLES, OWNER, check_client_permission, get_client_roles
+from ads.redis import REDIS_CLIENT, RedisClient
+from ads.rendering import BANNER_RENDERER, BANNER_TEMPLATE, BannerRenderer
+from ads.tokens import InvalidClickToken, sign_click, verify_click
+from ads.useragent import UserAgentParser
+from ads.views import handle_click
+from experiments.models import Experiment, TargetingGroup
+
+
+class FakeRedisMixin:
+    """REDIS_CLIENT поверх fakeredis (Lua-скрипты выполняет lupa)"""
+
+    def setUp(self) -> None:
+        super().setUp()  # pyright: ignore[reportAttributeAccessIssue]
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeStrictRedis(server=server)
+        client = RedisClient()
+        client._redis = self.redis  # pyright: ignore[reportAttributeAccessIssue]
+        client._aredis = fakeredis.FakeAsyncRedis(server=server)  # pyright: ignore[reportAttributeAccessIssue]
+        patcher = mock.patch.object(REDIS_CLIENT, '_wrapped', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)  # pyright: ignore[reportAttributeAccessIssue]
+
+
+class BatchWriterTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.flushed: list[tuple[str, list[Row]]] = []
+        self.writer = BatchWriter(
+            lambda table, rows: self.flushed.append((table, rows)), max_rows=3, max_delay=0.05, queue_size=10
+        )
+        self.addCleanup(self.writer.close)
+
+    def test_close_flushes_queued_rows_grouped_by_table(self) -> None:
+        for row in [('shows', (1,)), ('clicks', (2,)), ('shows', (3,))]:
+            self.assertTrue(self.writer.put(*row))
+        self.writer.close()
+
+        rows: dict[str, list[Row]] = {}
+        for table, batch in self.flushed:
+            rows.setdefault(table, []).extend(batch)
+        self.assertEqual(rows, {'shows': [(1,), (3,)], 'clicks': [(2,)]})
+        self.assertEqual(self.writer.stats().rows_written, 3)
+
+    def test_batches_are_limited_to_max_rows(self) -> None:
+        for index in range(7):
+            self.writer.put('shows', (index,))
+        self.writer.close()
+
+        self.assertLessEqual(max(len(rows) for _, rows in self.flushed), 3)
+        self.assertEqual(sum(len(rows) for _, rows in self.flushed), 7)
+
+    def test_put_after_close_is_dropped(self) -> None:
+        self.writer.put('shows', (1,))
+        self.writer.close()
+
+        self.assertFalse(self.writer.put('shows', (2,)))
+        self.assertEqual(self.writer.stats().dropped, 1)
+        self.assertEqual(self.flushed, [('shows', [(1,)])])
+
+    def test_failed_flush_is_counted(self) -> None:
+        writer = BatchWriter(lambda table, rows: 1 / 0, max_rows=10, max_delay=0.05, queue_size=10)
+        writer.put('shows', (1,))
+        with self.assertLogs('ads.ingest', 'ERROR'):
+            writer.close()
+
+        self.assertEqual(writer.stats().rows_failed, 1)
+        self.assertEqual(writer.stats().rows_written, 0)
+
+
+class EventJournalTests(SimpleTestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = Path(tmp.name)
+
+    def _journal(self, segment_max_bytes: int = 1 << 20) -> EventJournal:
+        journal = EventJournal(
+            self.directory,
+            FsyncPolicy.never,
+            fsync_interval=60,
+            segment_max_bytes=segment_max_bytes,
+            segment_max_age=60,
+        )
+        self.addCleanup(journal.close)
+        return journal
+
+    def test_round_trip_restores_column_types(self) -> None:
+        row = {
+            'event_id': uuid4(),
+            'timestamp': datetime(2026, 1, 2, 3, 4, 5, tzinfo=UTC),
+            'click_cost': Decimal('1.250000'),
+            'banner_id': 7,
+        }
+        journal = self._journal()
+        journal.append('reklamito.clicks', row)
+        journal.close()
+
+        [segment] = sealed_segments(self.directory)
+        self.assertEqual(list(read_segment(segment)), [('reklamito.clicks', row)])
+
+    def test_segment_is_sealed_by_size(self) -> None:
+        journal = self._journal(segment_max_bytes=1)
+        journal.append('reklamito.shows', {'banner_id': 1})
+        journal.append('reklamito.shows', {'banner_id': 2})
+
+        segments = sealed_segments(self.directory)
+        self.assertEqual(len(segments), 2)
+        self.assertEqual([row['banner_id'] for segment in segments for _, row in read_segment(segment)], [1, 2])
+
+    def test_torn_last_record_is_skipped(self) -> None:
+        journal = self._journal()
+        journal.append('reklamito.shows', {'banner_id': 1})
+        journal.close()
+        [segment] = sealed_segments(self.directory)
+        with segment.open('ab') as file:
+            file.write(b'{"t": "reklamito.shows", "r": {"ban')
+
+        with self.assertLogs('ads.journal', 'WARNING'):
+            self.assertEqual(list(read_segment(segment)), [('reklamito.shows', {'banner_id': 1})])
+
+
+def _snapshot(banner_id: int, campaign_id: int = 1) -> BannerSnapshot:
+    return BannerSnapshot(banner_id, campaign_id, {}, 'https://example.com', True, 'hash')
+
+
+class BannerCacheTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.cache = BannerCache(max_size=2, ttl=60)
+        self.load = mock.Mock(
+            side_effect=lambda ids: {banner_id: _snapshot(banner_id) for banner_id in ids if banner_id}
+        )
+        patcher = mock.patch.object(self.cache, '_load', self.load)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hits_do_not_load(self) -> None:
+        self.assertEqual(self.cache.get(1), _snapshot(1))
+        self.assertEqual(self.cache.get(1), _snapshot(1))
+
+        self.load.assert_called_once_with([1])
+        stats = self.cache.stats()
+        self.assertEqual((stats.hits, stats.misses), (1, 1))
+
+    def test_missing_banners_are_cached_as_none(self) -> None:
+        self.assertEqual(self.cache.get_many([0, 1]), {0: None, 1: _snapshot(1)})
+        self.assertIsNone(self.cache.get(0))
+        self.load.assert_called_once_with([0, 1])
+
+    def test_least_recently_used_is_evicted(self) -> None:
+        self.cache.get_many([1, 2])
+        self.cache.get(1)
+        self.cache.get(3)
+
+        self.cache.get_many([1, 3])
+        self.assertEqual(self.load.call_count, 2)
+        self.assertEqual(self.cache.stats().evictions, 1)
+
+    def test_invalidation_by_campaign(self) -> None:
+        self.cache.get(1)
+        self.cache.invalidate('campaign', 2)
+        self.cache.get(1)
+        self.assertEqual(self.load.call_count, 1)
+
+        self.cache.invalidate('campaign', 1)
+        self.cache.get(1)
+        self.assertEqual(self.load.call_count, 2)
+
+    def test_load_invalidated_in_flight_is_not_stored(self) -> None:
+        for kind, object_id in [('banner', 1), ('campaign', 1), (ALL, 0)]:
+            with self.subTest(kind=kind):
+                self.cache.invalidate(ALL, 0)
+
+                def load(ids: list[int], kind: str = kind, object_id: int = object_id) -> dict[int, BannerSnapshot]:
+                    self.cache.invalidate(kind, object_id)
+                    return {banner_id: _snapshot(banner_id) for banner_id in ids}
+
+                self.load.side_effect = load
+                # Вызывающий получает загруженный снимок, но следующий запрос загружает заново
+                self.assertEqual(self.cache.get(1), _snapshot(1))
+                self.assertEqual(self.cache.stats().size, 0)
+
+    def test_unrelated_invalidation_in_flight_keeps_load(self) -> None:
+        def load(ids: list[int]) -> dict[int, BannerSnapshot]:
+            self.cache.invalidate('banner', 2)
+            self.cache.invalidate('campaign', 2)
+            return {banner_id: _snapshot(banner_id) for banner_id in ids}
+
+        self.load.side_effect = load
+        self.cache.get(1)
+        self.assertEqual(self.cache.stats().size, 1)
+
+
+class CounterAggregatorTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.flushed: list[tuple[Deltas, Uniques]] = []
+        self.aggregator = CounterAggregator(
+            flush=self._flush, flush_interval=3600, flush_events=100, max_pending=5, flush_on_exit=False
+        )
+        self.fail = False
+
+    def _flush(self, deltas: Deltas, uniques: Uniques) -> None:
+        if self.fail:
+            raise ConnectionError('redis is down')
+        self.flushed.append((deltas, uniques))
+
+    def test_pending_counts_events_not_counters(self) -> None:
+        # Показ меняет несколько счетчиков, но это одно событие
+        self.aggregator.merge({('a', None): 1, ('b', 'f'): 1, ('c', 'f'): 1}, {'reach': {'u'}}, events=1)
+        self.aggregator.incr('a')
+
+        stats = self.aggregator.stats()
+        self.assertEqual(stats.pending_events, 2)
+        self.assertEqual(stats.pending_keys, 4)
+        self.assertEqual(self.aggregator.pending('a'), 2)
+
+    def test_flush_sends_summed_deltas(self) -> None:
+        self.aggregator.merge({('a', None): 2}, {'reach': {'u1'}}, events=2)
+        self.aggregator.merge({('a', None): 1, ('b', 'f'): 1}, {'reach': {'u2'}}, events=1)
+        self.aggregator.flush()
+
+        self.assertEqual(self.flushed, [({('a', None): 3, ('b', 'f'): 1}, {'reach': {'u1', 'u2'}})])
+        stats = self.aggregator.stats()
+        self.assertEqual((stats.pending_events, stats.flushes, stats.flushed_events), (0, 1, 3))
+
+    def test_failed_flush_keeps_increments(self) -> None:
+        self.aggregator.incr('a', 2)
+        self.fail = True
+        with self.assertLogs('ads.counters', 'ERROR'):
+            self.aggregator.flush()
+        self.aggregator.incr('a')
+        self.fail = False
+        self.aggregator.flush()
+
+        self.assertEqual(self.flushed, [({('a', None): 3}, {})])
+        self.assertEqual(self.aggregator.stats().lost_events, 0)
+
+    def test_max_pending_flushes_synchronously_and_drops_on_error(self) -> None:
+        self.fail = True
+        with self.assertLogs('ads.counters', 'ERROR'):
+            self.aggregator.merge({('a', None): 5}, {}, events=5)
+
+        stats = self.aggregator.stats()
+        self.assertEqual((stats.pending_events, stats.lost_events), (0, 5))
+
+
+@override_settings(SECRET_KEY='current', SECRET_KEY_FALLBACKS=['previous'], CLICK_TOKEN_TTL=3600)
+class ClickTokenTests(FakeRedisMixin, SimpleTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.show_uuid = uuid4()
+        self.show_time = now().replace(microsecond=123000)
+
+    def _sign(self, show_time: datetime | None = None) -> str:
+        return sign_click(12, 3, self.show_uuid, show_time or self.show_time, 'https://example.com/?q=тест')
+
+    def test_round_trip(self) -> None:
+        click = verify_click(self._sign())
+
+        self.assertEqual((click.banner_id, click.campaign_id, click.show_uuid), (12, 3, self.show_uuid))
+        self.assertEqual(click.show_time, self.show_time)
+        self.assertEqual(click.click_url, 'https://example.com/?q=тест')
+
+    def test_tampered_token_is_rejected(self) -> None:
+        token = self._sign()
+        tampered = token[:10] + ('A' if token[10] != 'A' else 'B') + token[11:]
+
+        for bad in [tampered, token[:-2], 'not a token!', '']:
+            with self.subTest(token=bad), self.assertRaises(InvalidClickToken):
+                verify_click(bad)
+
+    def test_previous_secret_is_accepted(self) -> None:
+        with self.settings(SECRET_KEY='previous'):
+            token = self._sign()
+        self.assertEqual(verify_click(token).show_uuid, self.show_uuid)
+
+        with self.settings(SECRET_KEY_FALLBACKS=[]), self.assertRaises(InvalidClickToken):
+            verify_click(token)
+
+    def test_ttl(self) -> None:
+        with self.assertRaises(InvalidClickToken):
+            verify_click(self._sign(now() - timedelta(seconds=3601)))
+        # Часы воркеров могут расходиться, но не на часы
+        verify_click(self._sign(now() + timedelta(seconds=30)))
+        with self.assertRaises(InvalidClickToken):
+            verify_click(self._sign(now() + timedelta(hours=1)))
+
+    def test_click_is_claimed_once_until_token_expires(self) -> None:
+        click = verify_click(self._sign())
+
+        self.assertTrue(REDIS_CLIENT.claim_click(click.show_uuid, click.expires_at))
+        self.assertFalse(REDIS_CLIENT.claim_click(click.show_uuid, click.expires_at))
+        self.assertTrue(REDIS_CLIENT.claim_click(uuid4(), click.expires_at))
+        ttl = self.redis.ttl(f'click:{self.show_uuid}')
+        self.assertAlmostEqual(ttl, click.expires_at - time.time(), delta=2)
+
+    def test_replayed_click_is_redirected_but_not_recorded(self) -> None:
+        token = self._sign()
+        request = RequestFactory().get(f'/click/{token}/')
+        with (
+            mock.patch('ads.views.CH_CLIENT') as ch_client,
+            mock.patch('ads.views.BUDGET_TRACKER') as budget_tracker,
+        ):
+            responses = [handle_click(request, token) for _ in range(3)]
+
+        self.assertEqual({response.status_code for response in responses}, {302})
+        ch_client.log_click.assert_called_once()
+        budget_tracker.debit_click.assert_called_once_with(3)
+        self.assertEqual(REDIS_CLIENT.get_clicks(12), 1)
+
+
+class BudgetTests(FakeRedisMixin, SimpleTestCase):
+    def _sync(self, campaign_id: int, budget: int, cost_model: str = CostModel.CPM, client_id: int = 1) -> int:
+        return sync_campaign_budget(campaign_id, client_id, Decimal(budget), cost_model, Decimal(100), Decimal(0))
+
+    def test_prices_are_stored_in_micros(self) -> None:
+        self._sync(1, 10, CostModel.CPM)
+        self._sync(2, 10, CostModel.CPC)
+
+        self.assertEqual(self.redis.hmget('campaign:1:budget', 'show_cost', 'click_cost'), [b'100000', b'0'])
+        self.assertEqual(self.redis.hmget('campaign:2:budget', 'show_cost', 'click_cost'), [b'0', b'100000000'])
+
+    def test_campaign_is_exhausted_once(self) -> None:
+        # 1 рубль при CPM 100 рублей - 10 показов
+        self._sync(1, 1)
+
+        self.assertEqual(REDIS_CLIENT.debit_budgets({('1', 'shows'): 9}), [])
+        self.assertEqual(REDIS_CLIENT.debit_budgets({('1', 'shows'): 1}), [1])
+        self.assertEqual(REDIS_CLIENT.debit_budgets({('1', 'shows'): 1}), [])
+        self.assertEqual(REDIS_CLIENT.get_spent([1]), {1: 1_100_000})
+        self.assertEqual(REDIS_CLIENT.get_exhausted_campaigns(), {1})
+
+    def test_raised_budget_resumes_campaign(self) -> None:
+        self._sync(1, 1)
+        REDIS_CLIENT.debit_budgets({('1', 'shows'): 10})
+
+        # Расход из Postgres не затирает расход в Redis
+        self.assertEqual(self._sync(1, 2), 1_000_000)
+        self.assertEqual(REDIS_CLIENT.get_exhausted_campaigns(), set())
+
+    def test_client_limit_exhausts_all_campaigns(self) -> None:
+        self._sync(1, 1000)
+        self._sync(2, 1000)
+        self._sync(3, 1000, client_id=2)
+        REDIS_CLIENT.settle_client(1, 0, 1_000_000)
+
+        self.assertEqual(sorted(REDIS_CLIENT.debit_budgets({('1', 'shows'): 5, ('2', 'shows'): 5})), [1, 2])
+        self.assertEqual(REDIS_CLIENT.get_unbilled(1), 1_000_000)
+        self.assertEqual(REDIS_CLIENT.get_exhausted_campaigns(), {1, 2})
+
+    def test_unknown_campaign_is_not_debited(self) -> None:
+        self.assertEqual(REDIS_CLIENT.debit_budgets({('9', 'shows'): 100, ('9', 'clicks'): 1}), [])
+        self.assertFalse(self.redis.exists('campaign:9:budget'))
+
+
+class CampaignBudgetSyncTests(FakeRedisMixin, TestCase):
+    def test_saved_campaign_is_synced_after_commit(self) -> None:
+        user = User.objects.create(username='owner')
+        client = Client.objects.create(name='Client', tax_id='7700000000', owner=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            campaign = Campaign.objects.create(
+                name='Campaign',
+                client=client,
+                author=user,
+                budget=Decimal(1000),
+                cost_model=CostModel.CPC,
+                price=Decimal('2.5'),
+                start_date=localdate(),
+                end_date=localdate(),
+            )
+
+        self.assertEqual(
+            self.redis.hmget(f'campaign:{campaign.pk}:budget', 'limit', 'click_cost', 'client'),
+            [b'1000000000', b'2500000', str(client.pk).encode()],
+        )
+
+
+class FrequencyCapperTests(FakeRedisMixin, SimpleTestCase):
+    # Среда, 14 октября 2026, 12:00 UTC
+    moment = datetime(2026, 10, 14, 12, tzinfo=UTC)
+
+    def _expire_at(self, period: int) -> datetime:
+        with mock.patch('ads.frequency.time.time', return_value=self.moment.timestamp()):
+            [(_, _, expire_at, _, _)] = FrequencyCapper()._fields('user', [(1, 1, period)])
+        return datetime.fromtimestamp(expire_at, UTC)
+
+    @override_settings(TIME_ZONE='UTC')
+    def test_windows_are_aligned_to_local_calendar(self) -> None:
+        self.assertEqual(self._expire_at(60 * 60), datetime(2026, 10, 14, 13, tzinfo=UTC))
+        self.assertEqual(self._expire_at(24 * 60 * 60), datetime(2026, 10, 15, tzinfo=UTC))
+        # Недели начинаются с понедельника
+        self.assertEqual(self._expire_at(7 * 24 * 60 * 60), datetime(2026, 10, 19, tzinfo=UTC))
+
+    @override_settings(TIME_ZONE='Europe/Moscow')
+    def test_windows_follow_time_zone(self) -> None:
+        self.assertEqual(self._expire_at(24 * 60 * 60), datetime(2026, 10, 14, 21, tzinfo=UTC))
+        self.assertEqual(self._expire_at(7 * 24 * 60 * 60), datetime(2026, 10, 18, 21, tzinfo=UTC))
+
+    def test_remaining_and_exceeded(self) -> None:
+        capper = FrequencyCapper()
+        caps = [frequency_cap(1, 2, 3600), frequency_cap(2, 1, 86400), frequency_cap(3, None, 3600)]
+
+        self.assertEqual(capper.remaining('user', caps), {1: 2, 2: 1})
+        capper.record('user', caps)
+        self.assertEqual(capper.remaining('user', caps), {1: 1, 2: 0})
+        self.assertEqual(capper.exceeded('user', caps), {2})
+        self.assertEqual(capper.exceeded('other', caps), set())
+        ttl = self.redis.ttl(next(iter(self.redis.scan_iter('fc:86400:*'))))
+        self.assertTrue(0 < ttl <= 86400)
+
+    def test_redis_failure_does_not_block_shows(self) -> None:
+        with (
+            mock.patch.object(REDIS_CLIENT, 'get_frequency_counts', side_effect=ConnectionError),
+            self.assertLogs('ads.frequency', 'ERROR'),
+        ):
+            self.assertEqual(FrequencyCapper().exceeded('user', [frequency_cap(1, 1, 3600)]), set())
+
+
+@override_settings(TIME_ZONE='UTC', REDIS_COUNTER_FLUSH_INTERVAL=0)
+class StatsRollupTests(FakeRedisMixin, SimpleTestCase):
+    hour = datetime(2026, 10, 14, 10, tzinfo=UTC)
+
+    def _at(self, minute: int, action: Callable[[], None]) -> None:
+        moment = self.hour + timedelta(minutes=minute)
+        with mock.patch('ads.redis.localtime', lambda value=None: localtime(value or moment)):
+            action()
+
+    def _stats(self, start: datetime, end: datetime) -> dict[str, int]:
+        with mock.patch('ads.redis.now', return_value=self.hour + timedelta(hours=2)):
+            return REDIS_CLIENT.get_stats('banner', 1, start, end)
+
+    def test_rollup_is_idempotent_and_picks_up_late_events(self) -> None:
+        for minute in (5, 5, 59):
+            self._at(minute, lambda: REDIS_CLIENT.increment_shows(1, 2))
+        self._at(30, lambda: REDIS_CLIENT.increment_clicks(1, 2))
+
+        self.assertEqual(REDIS_CLIENT.rollup_counters(self.hour), 2)
+        REDIS_CLIENT.set_rolled_until(self.hour + timedelta(hours=1))
+        self.assertEqual(REDIS_CLIENT.rollup_counters(self.hour), 0)
+        self.assertEqual(self.redis.hgetall('stats:banner:1:h:20261014'), {b'10:shows': b'3', b'10:clicks': b'1'})
+
+        # Опоздавшее событие переносится повторной сверткой, без удвоения перенесенного
+        self._at(40, lambda: REDIS_CLIENT.increment_shows(1, 2))
+        self.assertEqual(REDIS_CLIENT.rollup_counters(self.hour), 2)
+        self.assertEqual(self.redis.hget('stats:campaign:2:d:202610', '14:shows'), b'4')
+        self.assertEqual(self._stats(self.hour, self.hour + timedelta(hours=1)), {'shows': 4, 'clicks': 1})
+
+    def test_stats_of_partial_hour_are_read_from_minutes(self) -> None:
+        for minute in (5, 6, 7):
+            self._at(minute, lambda: REDIS_CLIENT.increment_shows(1))
+        REDIS_CLIENT.rollup_counters(self.hour)
+        REDIS_CLIENT.set_rolled_until(self.hour + timedelta(hours=1))
+
+        self.assertEqual(
+            self._stats(self.hour + timedelta(minutes=6), self.hour + timedelta(minutes=8)), {'shows': 2, 'clicks': 0}
+        )
+
+    def test_async_increments_are_applied_atomically(self) -> None:
+        aredis = REDIS_CLIENT._aredis
+        with mock.patch.object(aredis, 'pipeline', wraps=aredis.pipeline) as pipeline:
+            self._at(5, lambda: async_to_sync(REDIS_CLIENT.aincrement_shows)(1, 2))
+
+        pipeline.assert_called_once_with(transaction=True)
+        self.assertEqual(REDIS_CLIENT.get_shows(1), 1)
+        self.assertEqual(self.redis.hget('stats:campaign:2:m:2026101410', '05:shows'), b'1')
+
+    def test_minutes_expire_without_rollup(self) -> None:
+        self._at(5, lambda: REDIS_CLIENT.increment_shows(1))
+
+        for key in ('stats:banner:1:m:2026101410', 'stats:index:2026101410'):
+            self.assertAlmostEqual(self.redis.ttl(key), 48 * 60 * 60, delta=5)
+
+
+class ClientPermissionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.owner = User.objects.create(username='owner')
+        cls.editor = User.objects.create(username='editor')
+        cls.client_a = Client.objects.create(name='A', tax_id='7700000000', owner=cls.owner)
+        cls.client_b = Client.objects.create(name='B', tax_id='7700000001', owner=cls.editor)
+        User2Client.objects.create(user=cls.editor, client=cls.client_a, role=User2Client.ClientStaffRoles.EDITOR)
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def _roles(self, user: User) -> dict[int, str]:
+        # Новый объект: карта на объекте пользователя живет только в пределах запроса
+        return get_client_roles(User.objects.get(pk=user.pk))
+
+    def test_role_map(self) -> None:
+        self.assertEqual(self._roles(self.owner), {self.client_a.pk: OWNER})
+        self.assertEqual(self._roles(self.editor), {self.client_a.pk: 'editor', self.client_b.pk: OWNER})
+        self.assertEqual(get_client_roles(AnonymousUser()), {})
+        # Другие воркеры берут карту из общего кеша
+        editor = User.objects.get(pk=self.editor.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_client_roles(editor)[self.client_b.pk], OWNER)
+
+    def test_check_client_permission(self) -> None:
+        editor = User.objects.get(pk=self.editor.pk)
+        edit = (User2Client.ClientStaffRoles.ADMIN, User2Client.ClientStaffRoles.EDITOR)
+
+        self.assertTrue(check_client_permission(editor, self.client_a.pk, edit))
+        self.assertFalse(check_client_permission(editor, self.client_a.pk, (User2Client.ClientStaffRoles.ADMIN,)))
+        self.assertTrue(check_client_permission(editor, self.client_b.pk, (User2Client.ClientStaffRoles.ADMIN,)))
+        self.assertFalse(check_client_permission(User.objects.get(pk=self.owner.pk), self.client_b.pk, ALL_ROLES))
+        self.assertTrue(check_client_permission(User(is_superuser=True), self.client_b.pk, ALL_ROLES))
+
+    def test_staff_change_drops_cached_roles(self) -> None:
+        self._roles(self.editor)
+        with self.captureOnCommitCallbacks(execute=True):
+            User2Client.objects.filter(user=self.editor).delete()
+            User2Client.objects.create(user=self.editor, client=self.client_a, role=User2Client.ClientStaffRoles.READER)
+
+        self.assertEqual(self._roles(self.editor)[self.client_a.pk], 'reader')
+
+    def test_owner_change_drops_roles_of_both_owners(self) -> None:
+        self._roles(self.owner)
+        self._roles(self.editor)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_a.owner = self.editor
+            self.client_a.save()
+
+        self.assertEqual(self._roles(self.owner), {})
+        self.assertEqual(self._roles(self.editor), {self.client_a.pk: OWNER, self.client_b.pk: OWNER})
+
+
+class CHQueryTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.client = CHClient()
+        self.client._client = mock.Mock()  # pyright: ignore[reportAttributeAccessIssue]
+        self.execute = self.client._client.execute
+        self.execute.return_value = []
+
+    def test_rollup_choice(self) -> None:
+        moscow = ZoneInfo('Europe/Moscow')
+        day = datetime(2026, 10, 14, tzinfo=UTC)
+
+        daily = _pick_rollup(day, day + timedelta(days=2))
+        self.assertEqual((daily.table, daily.daily), ('reklamito.stats_daily', True))
+        self.assertEqual(
+            daily.where(campaign_id=3)[1], {'start': date(2026, 10, 14), 'end': date(2026, 10, 16), 'campaign_id': 3}
+        )
+        # Полночь по Москве - не полночь UTC; неполный час расширяется до целого
+        hourly = _pick_rollup(datetime(2026, 10, 14, tzinfo=moscow), day + timedelta(hours=5, minutes=1))
+        self.assertEqual(hourly.table, 'reklamito.stats_hourly')
+        self.assertEqual(hourly.where()[1], {'start': datetime(2026, 10, 13, 21), 'end': datetime(2026, 10, 14, 6)})
+        self.assertFalse(_pick_rollup(day, day + timedelta(days=1), Granularity.hour).daily)
+
+    def test_daily_series_of_hourly_rollup(self) -> None:
+        start = datetime(2026, 10, 14, 12, tzinfo=UTC)
+        self.client.get_time_series(start, start + timedelta(days=1), banner_id=5)
+
+        query, params = self.execute.call_args.args
+        self.assertIn('SELECT toStartOfDay(hour) AS moment', query)
+        self.assertIn('FROM reklamito.stats_hourly WHERE hour >= %(start)s AND hour < %(end)s AND banner_id', query)
+        self.assertEqual(params['banner_id'], 5)
+
+    def test_breakdown_source(self) -> None:
+        day = datetime(2026, 10, 14, tzinfo=UTC)
+        self.execute.return_value = [('mobile', 10, 7)]
+
+        rows = self.client.get_breakdown(Dimension.device_type, day, day + timedelta(days=1), campaign_id=3)
+        self.assertEqual(rows, [BreakdownRow('mobile', 10, 7)])
+        self.assertIn('FROM reklamito.breakdown_daily WHERE day >= %(start)s', self.execute.call_args.args[0])
+
+        self.client.get_breakdown(Dimension.os_family, day, day + timedelta(hours=3))
+        query = self.execute.call_args.args[0]
+        self.assertIn("SELECT ifNull(os_family, '') AS value", query)
+        self.assertIn('FROM reklamito.shows WHERE timestamp >= %(start)s', query)
+
+        with self.settings(CH_READ_EVENTS_V2=True):
+            self.client.get_breakdown(Dimension.os_family, day, day + timedelta(hours=3))
+        self.assertIn('FROM reklamito.shows_v2 WHERE', self.execute.call_args.args[0])
+
+    def test_top_banners_order_is_validated(self) -> None:
+        day = datetime(2026, 10, 14, tzinfo=UTC)
+        with self.assertRaises(ValueError):
+            self.client.get_top_banners(day, day + timedelta(days=1), order_by='shows; DROP TABLE')
+
+
+class SplitStatementsTests(SimpleTestCase):
+    def test_split(self) -> None:
+        sql = (
+            '-- Заголовок\n'
+            "CREATE TABLE t (s String DEFAULT ';') ENGINE = Memory;  -- комментарий\n"
+            '\n'
+            'ALTER TABLE t\n'
+            '    ADD COLUMN n UInt8;\n'
+            '-- только комментарий;\n'
+            'DROP TABLE t'
+        )
+        self.assertEqual(
+            split_statements(sql),
+            [
+                "-- Заголовок\nCREATE TABLE t (s String DEFAULT ';') ENGINE = Memory",
+                'ALTER TABLE t\n    ADD COLUMN n UInt8',
+                # Точка с запятой в конце комментария тоже завершает фрагмент, а он состоит из одного комментария
+                'DROP TABLE t',
+            ],
+        )
+
+    def test_migrations_are_split_into_queries(self) -> None:
+        for path in sorted(MIGRATIONS_DIR.glob('*.sql')):
+            with self.subTest(path=path.name):
+                statements = split_statements(path.read_text())
+                self.assertTrue(statements)
+                for statement in statements:
+                    self.assertNotRegex(statement, r';\s*$')
+
+
+class ColumnarInsertTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.client = CHClient()
+        self.client._client = mock.Mock()  # pyright: ignore[reportAttributeAccessIssue]
+        self.execute = self.client._client.execute
+
+    def _show(self, banner_id: int) -> ShowEvent:
+        return ShowEvent(uuid4(), now(), banner_id, 3, device_type=DeviceType.mobile)
+
+    def test_to_columns(self) -> None:
+        events = [self._show(1), self._show(2)]
+        columns = to_columns(events)
+
+        self.assertEqual(len(columns), len(ShowEvent._fields))
+        self.assertEqual(columns[ShowEvent._fields.index('banner_id')], [1, 2])
+        self.assertEqual(columns[ShowEvent._fields.index('device_type')], [DeviceType.mobile] * 2)
+        self.assertEqual(to_columns([]), [])
+
+    def test_insert_events(self) -> None:
+        events = [self._show(1), self._show(2)]
+        self.client.insert_events('reklamito.shows', events, dedup_token='batch:1')
+
+        self.execute.assert_called_once_with(
+            f'INSERT INTO reklamito.shows ({", ".join(ShowEvent._fields)}) VALUES',
+            to_columns(events),
+            columnar=True,
+            settings={'insert_deduplication_token': 'batch:1'},
+        )
+
+    def test_empty_batch_is_not_sent(self) -> None:
+        self.client.insert_events('reklamito.shows', [])
+        self.client.insert_columns('reklamito.shows', ShowEvent._fields, [[] for _ in ShowEvent._fields])
+        self.client.insert_rows('reklamito.shows', [])
+
+        self.execute.assert_not_called()
+
+    def test_insert_rows_are_sent_by_columns(self) -> None:
+        self.client.insert_rows(
+            'reklamito.pacing', [{'campaign_id': 1, 'throttle': 0.5}, {'campaign_id': 2, 'throttle': 1.0}]
+        )
+
+        self.assertEqual(
+            self.execute.call_args.args,
+            ('INSERT INTO reklamito.pacing (campaign_id, throttle) VALUES', [[1, 2], [0.5, 1.0]]),
+        )
+
+    @override_settings(CH_INGEST_MODE='sync')
+    def test_insert_error(self) -> None:
+        self.execute.side_effect = EOFError('connection closed')
+
+        with self.assertRaises(ClickHouseWriteError):
+            self.client.log_show(uuid4(), now(), 1, 3)
+
+
+class ImportEventsTests(SimpleTestCase):
+    def _line(self, **fields: Any) -> bytes:
+        return json.dumps({'event_id': str(uuid4()), 'banner_id': 1, 'campaign_id': 3} | fields).encode() + b'\n'
+
+    def test_parse_json_chunk(self) -> None:
+        lines = [
+            self._line(timestamp='2026-10-14T12:00:00', device_type='mobile', is_robot=0),
+            b'\n',
+            self._line(timestamp=1_792_000_000),
+            self._line(timestamp='2026-10-14T12:00:00', device_type='fridge'),
+            b'[1, 2]\n',
+            b'{"event_id": \n',
+            self._line(),
+        ]
+        result = parse_chunk('shows', None, lines)
+
+        self.assertEqual((result.rows, result.invalid), (2, 4))
+        # Номера в пачке совпадают с номерами строк файла, пустые строки не сдвигают их
+        self.assertEqual([index for index, _ in result.errors], [3, 4, 5, 6])
+        self.assertEqual(
+            result.columns[ShowEvent._fields.index('timestamp')][0], datetime(2026, 10, 14, 12, tzinfo=UTC)
+        )
+        self.assertEqual(result.columns[ShowEvent._fields.index('device_type')], [DeviceType.mobile, None])
+        self.assertEqual(result.columns[ShowEvent._fields.index('is_robot')], [False, None])
+
+    def test_parse_csv_chunk(self) -> None:
+        header = ['event_id', 'timestamp', 'banner_id', 'campaign_id', 'user_agent', 'is_robot']
+        user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/126.0 Safari/537.36'
+        rows = [
+            [str(uuid4()), '1792000000.5', '1', '3', user_agent, 'true'],
+            [],
+            [str(uuid4()), '2026-10-14 12:00:00+03:00', 'x', '3', '', ''],
+        ]
+        result = parse_chunk('shows', header, rows)
+
+        self.assertEqual((result.rows, result.invalid), (1, 1))
+        self.assertEqual(result.errors[0][0], 2)
+        self.assertEqual(
+            result.columns[ShowEvent._fields.index('timestamp')], [datetime.fromtimestamp(1_792_000_000.5, UTC)]
+        )
+        self.assertEqual(result.columns[ShowEvent._fields.index('browser_family')], ['Chrome'])
+        self.assertEqual(result.columns[ShowEvent._fields.index('is_robot')], [True])
+
+
+class BannerRendererTests(SimpleTestCase):
+    content: ClassVar[dict[str, Any]] = {
+        'title': 'Скидки <50%> & "бонусы"',
+        'text': 'Текст',
+        'image_url': 'https://example.com/a.png?x=1&y=2',
+        'badge_text': 'Новое',
+        'show_branding': True,
+        'style': {'primary_color': '#000'},
+    }
+
+    def _banner(self, content: dict[str, Any], content_hash: str = 'v1') -> BannerSnapshot:
+        return BannerSnapshot(7, 3, content, 'https://example.com', True, content_hash)
+
+    def test_skeleton_matches_template(self) -> None:
+        values = {'click_url': '/click/a&b="c"<d>/', 'show_uuid': str(uuid4())}
+        for content_hash, content in (('full', self.content), ('empty', {})):
+            banner = self._banner(content, content_hash)
+            with self.subTest(content=content):
+                self.assertEqual(
+                    BANNER_RENDERER.render(banner, **values),
+                    render_to_string(BANNER_TEMPLATE, {'banner': banner, **values}),
+                )
+
+    def test_recompiles_on_content_change(self) -> None:
+        renderer = BannerRenderer(max_size=10)
+        values = {'click_url': '/click/1/', 'show_uuid': 'uuid'}
+
+        renderer.render(self._banner(self.content), **values)
+        renderer.render(self._banner(self.content), **values)
+        self.assertEqual(renderer.compilations, 1)
+
+        html = renderer.render(self._banner({'title': 'Новый'}, content_hash='v2'), **values)
+        self.assertEqual(renderer.compilations, 2)
+        self.assertIn('Новый', html)
+
+
+class UserAgentParserTests(SimpleTestCase):
+    cases: ClassVar[list[tuple[str, str, DeviceType, bool]]] = [
+        (
+            'ipad',
+            'Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Version/17.4 Mobile/15E148 Safari/604.1',
+            DeviceType.tablet,
+            False,
+        ),
+        (
+            'android tablet',
+            'Mozilla/5.0 (Linux; Android 13; Lenovo TB-X606F) AppleWebKit/537.36 Chrome/126.0 Safari/537.36',
+            DeviceType.tablet,
+            False,
+        ),
+        (
+            'android phone',
+            'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 Chrome/126.0 Mobile Safari/537.36',
+            DeviceType.mobile,
+            False,
+        ),
+        (
+            'desktop',
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/126.0 Safari/537.36',
+            DeviceType.desktop,
+            False,
+        ),
+        (
+            'googlebot',
+            'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+            DeviceType.desktop,
+            True,
+        ),
+        ('empty', '', DeviceType.desktop, True),
+    ]
+
+    def test_classification(self) -> None:
+        parser = UserAgentParser(cache_size=100)
+        for name, user_agent, device_type, is_robot in self.cases:
+            with self.subTest(name):
+                info = parser.parse(user_agent)
+                self.assertEqual((info.device_type, info.is_robot), (device_type, is_robot))
+
+    def test_cache(self) -> None:
+        parser = UserAgentParser(cache_size=100)
+        user_agent = self.cases[2][1]
+
+        self.assertEqual(parser.parse(user_agent), parser.parse(user_agent))
+        parser.parse('')
+        stats = parser.stats()
+        self.assertEqual((stats.size, stats.hits, stats.misses), (2, 1, 2))
+        self.assertGreater(stats.parse_time_total, 0)
+
+
+def _item(banner_id: int, campaign_id: int = 1, **constraints: set[str]) -> LineItem:
+    return LineItem(banner_id, campaign_id, {name: frozenset(values) for name, values in constraints.items()})
+
+
+class TargetingIndexTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.index = TargetingIndex()
+        self.index.replace_campaign(1, [_item(1, geo={'ru'}, device={'mobile'}), _item(2)])
+        self.index.replace_campaign(2, [_item(3, 2, geo={'ru', 'by'}, placement={'top'})])
+
+    def _banners(self, **attributes: str) -> set[int]:
+        return {item.banner_id for item in self.index.candidates(RequestAttributes(**attributes))}
+
+    def test_candidates_match_every_constrained_attribute(self) -> None:
+        self.assertEqual(self._banners(geo='RU', device='mobile', placement='top'), {1, 2, 3})
+        self.assertEqual(self._banners(geo='by', placement='top'), {2, 3})
+        self.assertEqual(self._banners(geo='by'), {2})
+        self.assertEqual(self._banners(), {2})
+
+    def test_replace_and_remove_campaign(self) -> None:
+        self.index.replace_campaign(1, [_item(4, geo={'kz'})])
+        self.assertEqual(self._banners(geo='kz'), {4})
+        self.assertIsNone(self.index.campaign_of(1))
+
+        self.index.remove_campaign(2)
+        self.assertEqual(self._banners(geo='ru', placement='top'), set())
+        self.assertEqual(len(self.index), 1)
+        # Освободившиеся биты переиспользуются
+        self.index.replace_campaign(3, [_item(5, 3), _item(6, 3)])
+        self.assertEqual(len(self.index._items), 3)
+
+
+class LineItemWindowTests(SimpleTestCase):
+    def test_experiment_window(self) -> None:
+        start = datetime(2026, 5, 1, tzinfo=UTC)
+        item = LineItem(1, 1, {}, window=Window(start, start + timedelta(days=7)))
+        fallback = LineItem(1, 1, {}, fallback_for=(Window(start, None),))
+
+        self.assertFalse(item.is_live(start - timedelta(seconds=1)))
+        self.assertTrue(item.is_live(start))
+        self.assertFalse(item.is_live(start + timedelta(days=8)))
+        self.assertTrue(fallback.is_live(start - timedelta(seconds=1)))
+        self.assertFalse(fallback.is_live(start + timedelta(days=365)))
+
+
+class PacingControllerTests(SimpleTestCase):
+    controller = PacingController(kp=2.0, ki=0.5, min_throttle=0.05)
+
+    def test_throttle_between_bounds(self) -> None:
+        state = self.controller.update(PacingState(), error=-0.1, dt=1.0)
+
+        self.assertAlmostEqual(state.integral, -0.1)
+        self.assertAlmostEqual(state.throttle, 0.75)
+
+    def test_integral_freezes_while_saturated(self) -> None:
+        # Кампания недотрачивает при полной доле: интеграл не копится
+        state = PacingState()
+        for _ in range(10):
+            state = self.controller.update(state, error=0.1, dt=1.0)
+        self.assertEqual(state, PacingState(0.0, 1.0))
+
+        state = self.controller.update(PacingState(-2.0, 0.05), error=-0.2, dt=1.0)
+        self.assertEqual(state, PacingState(-2.0, 0.05))
+
+    def test_integral_unwinds_when_error_changes_sign(self) -> None:
+        state = self.controller.update(PacingState(0.4, 1.0), error=-0.01, dt=1.0)
+        self.assertEqual(state.throttle, 1.0)
+        self.assertAlmostEqual(state.integral, 0.39)
+
+        state = self.controller.update(PacingState(-2.0, 0.05), error=0.01, dt=1.0)
+        self.assertEqual(state.throttle, 0.05)
+        self.assertAlmostEqual(state.integral, -1.99)
+
+    @override_settings(TIME_ZONE='UTC')
+    def test_target_share(self) -> None:
+        start, end = date(2026, 10, 1), date(2026, 10, 10)
+
+        self.assertEqual(target_share(start, end, datetime(2026, 9, 30, tzinfo=UTC)), 0.0)
+        self.assertEqual(target_share(start, end, datetime(2026, 10, 1, tzinfo=UTC)), 0.0)
+        self.assertAlmostEqual(target_share(start, end, datetime(2026, 10, 6, tzinfo=UTC)), 0.5)
+        # Последний день кампании входит в период
+        self.assertAlmostEqual(target_share(start, end, datetime(2026, 10, 10, 12, tzinfo=UTC)), 0.95)
+        self.assertEqual(target_share(start, end, datetime(2026, 10, 12, tzinfo=UTC)), 1.0)
+
+
+class PacingGateTests(SimpleTestCase):
+    def test_one_decision_per_campaign(self) -> None:
+        gate = PacingGate(refresh_interval=60)
+        gate._pid = os.getpid()
+        gate._throttles = {1: 0.5, 2: 0.5, 4: 1.0}
+        candidates = [_item(1, 1), _item(2, 2), _item(3, 1), _item(4, 2), _item(5, 3), _item(6, 4)]
+
+        with mock.patch('ads.pacing.random.random', side_effect=[0.4, 0.9]) as random:
+            passed = gate.filter_candidates(candidates, RequestAttributes())
+
+        self.assertEqual([item.banner_id for item in passed], [1, 3, 5, 6])
+        self.assertEqual(random.call_count, 2)
+        self.assertEqual(gate.throttled, 2)
+
+
+class DecisionEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        user = User.objects.create(username='owner')
+        client = Client.objects.create(name='Client', tax_id='7700000000', owner=user)
+        today = localdate()
+        campaign = Campaign.objects.create(
+            name='Campaign',
+            client=client,
+            author=user,
+            budget=Decimal(1000),
+            start_date=today,
+            end_date=today + timedelta(days=30),
+        )
+        cls.banner = Banner.objects.create(name='Banner', campaign=campaign, content={}, click_url='https://e.com')
+        cls.start = now() + timedelta(hours=1)
+        experiment = Experiment.objects.create(
+            name='Geo', experiment_type='targeting', campaign=campaign, start_date=cls.start
+        )
+        TargetingGroup.objects.create(experiment=experiment, name='RU', criteria={'geo': ['RU']})
+
+    def _select(self, moment: datetime, geo: str) -> int | None:
+        with mock.patch('ads.decisioning.now', return_value=moment):
+            item = DecisionEngine().select(RequestAttributes(geo=geo))
+        return item.banner_id if item else None
+
+    def test_targeting_applies_only_while_experiment_runs(self) -> None:
+        # До начала эксперимента кампания показывается всем, после - только группе таргетинга
+        self.assertEqual(self._select(self.start - timedelta(minutes=1), 'de'), self.banner.pk)
+        self.assertEqual(self._select(self.start, 'ru'), self.banner.pk)
+        self.assertIsNone(self._select(self.start, 'de'))
+
+    def test_experiment_start_does_not_need_rebuild(self) -> None:
+        engine = DecisionEngine()
+        with mock.patch('ads.decisioning.now', return_value=self.start - timedelta(minutes=1)):
+            self.assertIsNotNone(engine.select(RequestAttributes(geo='de')))
+        with mock.patch('ads.decisioning.now', return_value=self.start):
+            self.assertIsNone(engine.select(RequestAttributes(geo='de')))
+        self.assertEqual(engine._built_for, localdate())
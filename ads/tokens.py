@@ -0,0 +1,87 @@
+import base64
+import binascii
+import struct
+import time
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from uuid import UUID
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+_SALT = 'ads.click-token'
+_VERSION = 1
+# версия, banner_id, campaign_id, время показа (мс), show_uuid. Дальше - click_url в UTF-8
+_HEADER = struct.Struct('>BIIQ16s')
+_MAC_SIZE = 16
+# Допустимое расхождение часов между воркерами, мс
+_CLOCK_SKEW_MS = 60_000
+
+
+class InvalidClickToken(Exception):
+    """Токен клика поддельный, поврежден или просрочен"""
+
+
+@dataclass(frozen=True, slots=True)
+class ClickToken:
+    banner_id: int
+    campaign_id: int
+    show_uuid: UUID
+    show_time: datetime
+    click_url: str
+
+    @property
+    def expires_at(self) -> int:
+        """Unix time, после которого verify_click отклоняет токен"""
+        return int(self.show_time.timestamp()) + settings.CLICK_TOKEN_TTL + 1
+
+
+def _mac(payload: bytes, secret: str) -> bytes:
+    return salted_hmac(_SALT, payload, secret=secret, algorithm='sha256').digest()[:_MAC_SIZE]
+
+
+def sign_click(banner_id: int, campaign_id: int, show_uuid: UUID, show_time: datetime, click_url: str) -> str:
+    """Самодостаточный подписанный токен для ссылки перехода по клику"""
+    payload = (
+        _HEADER.pack(_VERSION, banner_id, campaign_id, int(show_time.timestamp() * 1000), show_uuid.bytes)
+        + click_url.encode()
+    )
+    return base64.urlsafe_b64encode(payload + _mac(payload, settings.SECRET_KEY)).rstrip(b'=').decode()
+
+
+def verify_click(token: str) -> ClickToken:
+    """Проверка подписи и срока действия токена без обращения к базе"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise InvalidClickToken('Malformed token') from e
+    if len(raw) < _HEADER.size + _MAC_SIZE:
+        raise InvalidClickToken('Malformed token')
+
+    payload, mac = raw[:-_MAC_SIZE], raw[-_MAC_SIZE:]
+    if not any(
+        constant_time_compare(mac, _mac(payload, secret))
+        for secret in [settings.SECRET_KEY, *settings.SECRET_KEY_FALLBACKS]
+    ):
+        raise InvalidClickToken('Bad signature')
+
+    version, banner_id, campaign_id, show_ms, show_uuid = _HEADER.unpack_from(payload)
+    if version != _VERSION:
+        raise InvalidClickToken(f'Unsupported token version {version}')
+
+    age_ms = time.time() * 1000 - show_ms
+    if age_ms > settings.CLICK_TOKEN_TTL * 1000 or age_ms < -_CLOCK_SKEW_MS:
+        raise InvalidClickToken('Token expired')
+
+    try:
+        click_url = payload[_HEADER.size :].decode()
+    except UnicodeDecodeError as e:
+        raise InvalidClickToken('Malformed token') from e
+
+    return ClickToken(
+        banner_id=banner_id,
+        campaign_id=campaign_id,
+        show_uuid=UUID(bytes=show_uuid),
+        show_time=datetime.fromtimestamp(show_ms / 1000, tz=UTC),
+        click_url=click_url,
+    )
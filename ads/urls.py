@@ -1,9 +1,21 @@
 # urls.py
+from django.conf import settings
 from django.urls import path
 
 from ads import views
 
+# Под ASGI показы и клики обслуживаются асинхронными версиями вьюх
+if settings.ADS_ASYNC_VIEWS:
+    show_banner, show_banners, select_banner = views.ashow_banner, views.ashow_banners, views.aselect_banner
+    handle_click = views.ahandle_click
+else:
+    show_banner, show_banners, select_banner = views.show_banner, views.show_banners, views.select_banner
+    handle_click = views.handle_click
+
 urlpatterns = [
-    path('banner/show/<int:banner_id>/', views.show_banner, name='show_banner'),
-    path('banner/click/<int:banner_id>', views.handle_click, name='click'),
+    path('banner/show/<int:banner_id>/', show_banner, name='show_banner'),
+    path('banner/show/batch/', show_banners, name='show_banners'),
+    path('banner/select/<slug:placement>/', select_banner, name='select_banner'),
+    path('banner/click/<str:token>', handle_click, name='click'),
+    path('stats/', views.service_stats, name='service_stats'),
 ]
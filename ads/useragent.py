@@ -0,0 +1,114 @@
+import re
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, cast
+
+import httpagentparser  # pyright: ignore
+from django.conf import settings
+from django.utils.functional import LazyObject
+
+from ads.ch import DeviceType
+
+_ROBOT_RE = re.compile(
+    r'bot\b|bot/|crawl|spider|slurp|mediapartners|facebookexternalhit|preview|monitor|'
+    r'headless|phantomjs|curl/|wget/|python-|java/|go-http-client|okhttp|apache-httpclient',
+    re.IGNORECASE,
+)
+_TABLET_RE = re.compile(r'ipad|tablet|kindle|silk/|playbook|nexus (7|9|10)|sm-t\d+', re.IGNORECASE)
+_MOBILE_RE = re.compile(r'mobile|iphone|ipod|windows phone|opera mini|blackberry', re.IGNORECASE)
+
+
+@dataclass(frozen=True, slots=True)
+class UserAgentInfo:
+    browser_family: str | None
+    browser_version: str | None
+    os_family: str | None
+    os_version: str | None
+    device_type: DeviceType
+    is_robot: bool
+
+    def as_event_fields(self) -> dict[str, Any]:
+        """Поля события показа для CHClient.log_show"""
+        return {
+            'browser_family': self.browser_family,
+            'browser_version': self.browser_version,
+            'os_family': self.os_family,
+            'os_version': self.os_version,
+            'device_type': self.device_type,
+            'is_robot': self.is_robot,
+        }
+
+
+@dataclass
+class UserAgentParserStats:
+    size: int
+    hits: int
+    misses: int
+    parse_time_total: float
+    parse_time_avg: float
+
+
+def _device_type(user_agent: str) -> DeviceType:
+    if _TABLET_RE.search(user_agent):
+        return DeviceType.tablet
+    # Android без Mobile - планшет, с Mobile - телефон
+    if 'Android' in user_agent and 'Mobile' not in user_agent:
+        return DeviceType.tablet
+    if _MOBILE_RE.search(user_agent):
+        return DeviceType.mobile
+    return DeviceType.desktop
+
+
+class UserAgentParser:
+    """Разбор User-Agent с мемоизацией.
+
+    Почти весь трафик приходится на несколько тысяч различных строк User-Agent,
+    поэтому результаты держатся в ограниченном LRU-кеше воркера, а
+    httpagentparser вызывается только на промахах.
+    """
+
+    def __init__(self, cache_size: int) -> None:
+        self._cached_parse = lru_cache(maxsize=cache_size)(self._parse)
+        self._lock = threading.Lock()
+        self._parse_time_total = 0.0
+
+    def parse(self, user_agent: str) -> UserAgentInfo:
+        return self._cached_parse(user_agent)
+
+    def stats(self) -> UserAgentParserStats:
+        info = self._cached_parse.cache_info()
+        with self._lock:
+            parse_time_total = self._parse_time_total
+        return UserAgentParserStats(
+            size=info.currsize,
+            hits=info.hits,
+            misses=info.misses,
+            parse_time_total=parse_time_total,
+            parse_time_avg=parse_time_total / info.misses if info.misses else 0.0,
+        )
+
+    def _parse(self, user_agent: str) -> UserAgentInfo:
+        started = time.perf_counter()
+        data = httpagentparser.detect(user_agent)  # pyright: ignore
+        info = UserAgentInfo(
+            browser_family=data.get('browser', {}).get('name'),
+            browser_version=data.get('browser', {}).get('version'),
+            os_family=data.get('os', {}).get('name'),
+            os_version=data.get('os', {}).get('version'),
+            device_type=_device_type(user_agent),
+            # Браузеры всегда присылают User-Agent, пустой - признак скрипта
+            is_robot=not user_agent or bool(data.get('bot')) or bool(_ROBOT_RE.search(user_agent)),
+        )
+        with self._lock:
+            self._parse_time_total += time.perf_counter() - started
+        return info
+
+
+class LazyUserAgentParser(LazyObject):
+    def _setup(self) -> None:
+        self._wrapped = UserAgentParser(cache_size=settings.UA_CACHE_SIZE)
+
+
+UA_PARSER = cast(UserAgentParser, LazyUserAgentParser())
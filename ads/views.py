@@ -1,18 +1,32 @@
+import asyncio
+import logging
 import uuid
-from typing import Any
-from urllib.parse import urlencode
+from collections.abc import Awaitable
+from dataclasses import asdict
+from typing import Any, cast
 
-import httpagentparser  # pyright: ignore
 from django.conf import settings
-from django.http import Http404, HttpRequest, HttpResponse
-from django.shortcuts import get_object_or_404, redirect
-from django.template.loader import render_to_string
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import BadRequest
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils.timezone import now
 
-from ads.ch import CH_CLIENT, ClickHouseWriteError, DeviceType
-from ads.models import Banner
-from ads.redis import REDIS_CLIENT
+from ads.budget import BUDGET_TRACKER
+from ads.cache import BANNER_CACHE, BannerSnapshot
+from ads.ch import CH_BATCH_WRITER, CH_CLIENT, ClickHouseWriteError, IngestMode
+from ads.decisioning import DECISION_ENGINE, RequestAttributes
+from ads.frequency import FREQUENCY_CAPPER, FrequencyCap
+from ads.middleware import aattributed_user_id, attributed_user_id
+from ads.pacing import PACING_GATE
+from ads.redis import COUNTER_AGGREGATOR, REDIS_CLIENT
+from ads.rendering import BANNER_RENDERER
+from ads.tokens import ClickToken, InvalidClickToken, sign_click, verify_click
+from ads.useragent import UA_PARSER
+from experiments.bucketing import EXPERIMENT_BUCKETER, Assignment
+
+logger = logging.getLogger(__name__)
 
 
 def _get_client_ip(request: HttpRequest) -> str | None:
@@ -21,92 +35,426 @@ def _get_client_ip(request: HttpRequest) -> str | None:
     return x_forwarded_for.split(',')[0] if x_forwarded_for else request.META.get('REMOTE_ADDR')
 
 
-def _parse_user_agent(user_agent: str) -> dict[str, Any]:
-    """Парсинг User-Agent (упрощенная версия)"""
-    data = httpagentparser.detect(user_agent)  # pyright: ignore
-    return {
-        'browser_family': data.get('browser', {}).get('name'),
-        'browser_version': data.get('browser', {}).get('version'),
-        'os_family': data.get('os', {}).get('name'),
-        'device_type': DeviceType.mobile if 'Mobile' in user_agent else DeviceType.desktop,
-    }
+def _get_language(request: HttpRequest) -> str | None:
+    """Основной язык из Accept-Language: 'ru-RU,ru;q=0.9,en;q=0.8' -> 'ru'"""
+    accept_language = request.META.get('HTTP_ACCEPT_LANGUAGE', '')
+    return accept_language.split(',')[0].split(';')[0].split('-')[0].strip().lower() or None
 
 
-def show_banner(request: HttpRequest, banner_id: int) -> HttpResponse:
-    banner = get_object_or_404(Banner, pk=banner_id, is_active=True)
+def _get_unit_id(request: HttpRequest) -> str:
+    """Единица рандомизации экспериментов: кука посетителя, иначе IP + User-Agent"""
+    return request.COOKIES.get(settings.EXPERIMENT_UNIT_COOKIE) or '{}|{}'.format(
+        _get_client_ip(request), request.META.get('HTTP_USER_AGENT', '')
+    )
+
+
+def _parse_banner_id(raw_id: str) -> int | None:
+    """id баннера из слота ?ids=, None для нечислового"""
+    try:
+        return int(raw_id)
+    except ValueError:
+        return None
+
+
+def _is_servable(banner: BannerSnapshot | None) -> bool:
+    return banner is not None and not BUDGET_TRACKER.is_exhausted(banner.campaign_id)
+
+
+def _get_servable_banner(banner_id: int) -> BannerSnapshot:
+    banner = BANNER_CACHE.get(banner_id)
+    if not _is_servable(banner):
+        raise Http404()
+    return cast(BannerSnapshot, banner)
+
+
+def _show_context(request: HttpRequest, user_id: int | None) -> dict[str, Any]:
+    """Общие для всех показов запроса поля события: пользователь, IP, User-Agent"""
     user_agent = request.META.get('HTTP_USER_AGENT', '')
-    client_ip = _get_client_ip(request)
+    return dict(
+        user_id=user_id,
+        ip_address=_get_client_ip(request),
+        user_agent=user_agent,
+        country=request.META.get(settings.ADS_GEO_HEADER) or None,
+        language=_get_language(request),
+        **UA_PARSER.parse(user_agent).as_event_fields(),
+    )
+
+
+def _request_attributes(placement: str, context: dict[str, Any], unit_id: str) -> RequestAttributes:
+    """Атрибуты таргетинга из полей события показа"""
+    return RequestAttributes(
+        placement=placement,
+        geo=context['country'],
+        device=context['device_type'],
+        os=context['os_family'],
+        language=context['language'],
+        user=unit_id,
+    )
+
+
+def _resolve_variant(
+    banner: BannerSnapshot,
+    assignment: Assignment | None,
+    variant_banner: BannerSnapshot | None,
+) -> tuple[BannerSnapshot, int | None]:
+    """Баннер для показа и id варианта эксперимента.
+
+    Вариант без баннера (например, контрольный) показывает запрошенный баннер.
+    Если баннер варианта недоступен или бюджет его кампании исчерпан, показ идет вне эксперимента.
+    """
+    if assignment is None:
+        return banner, None
+    if assignment.banner_id is None:
+        return banner, assignment.variant_id
+    if not _is_servable(variant_banner):
+        return banner, None
+    return cast(BannerSnapshot, variant_banner), assignment.variant_id
+
+
+def _experiment_banner(banner: BannerSnapshot, unit_id: str) -> tuple[BannerSnapshot, int | None]:
+    assignment = EXPERIMENT_BUCKETER.assign(banner.pk, unit_id)
+    variant_banner = None
+    if assignment is not None and assignment.banner_id is not None:
+        variant_banner = BANNER_CACHE.get(assignment.banner_id)
+    return _resolve_variant(banner, assignment, variant_banner)
+
+
+def _build_show(banner: BannerSnapshot, context: dict[str, Any]) -> tuple[dict[str, Any], str]:
+    """Событие показа для ClickHouse и HTML баннера"""
     show_uuid = uuid.uuid4()
     timestamp = now()
 
-    ua_info = _parse_user_agent(user_agent)
+    event: dict[str, Any] = dict(
+        event_id=show_uuid,
+        timestamp=timestamp,
+        banner_id=banner.pk,
+        campaign_id=banner.campaign_id,
+        **context,
+    )
+
+    token = sign_click(banner.pk, banner.campaign_id, show_uuid, timestamp, banner.click_url)
+
+    html = BANNER_RENDERER.render(
+        banner,
+        click_url=reverse('click', args=[token]),
+        show_uuid=str(show_uuid),
+    )
+    return event, html
+
+
+def _parse_batch_ids(request: HttpRequest) -> list[str]:
+    ids = [banner_id.strip() for banner_id in request.GET.get('ids', '').split(',') if banner_id.strip()]
+    if not ids or len(ids) > settings.ADS_BATCH_MAX_SLOTS:
+        raise BadRequest(f'ids must contain from 1 to {settings.ADS_BATCH_MAX_SLOTS} banner ids')
+    return ids
+
+
+def _batch_banner_ids(ids: list[str], assignments: dict[int, Assignment]) -> set[int]:
+    """Запрошенные баннеры и баннеры назначенных вариантов, для одной загрузки из кеша"""
+    banner_ids = {banner_id for banner_id in map(_parse_banner_id, ids) if banner_id is not None}
+    return banner_ids | {a.banner_id for a in assignments.values() if a.banner_id is not None}
+
+
+def _build_batch(
+    request: HttpRequest,
+    ids: list[str],
+    banners: dict[int, BannerSnapshot | None],
+    assignments: dict[int, Assignment],
+    remaining: dict[int, int],
+    user_id: int | None,
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    """Ответы по слотам и события показов. Ошибка в слоте не влияет на остальные.
+
+    remaining - остаток лимита частоты по кампаниям, уменьшается на каждый показ пачки:
+    несколько слотов одной кампании не выходят за лимит
+    """
+    context = _show_context(request, user_id)
+    remaining = dict(remaining)
+    slots: list[dict[str, Any]] = []
+    events: list[dict[str, Any]] = []
+    for slot, raw_id in enumerate(ids):
+        banner_id = _parse_banner_id(raw_id)
+        banner = banners.get(banner_id) if banner_id is not None else None
+        if banner is None or not _is_servable(banner):
+            slots.append({'slot': slot, 'id': raw_id, 'error': 'not_found'})
+            continue
+        assignment = assignments.get(banner.pk)
+        variant_banner = banners.get(assignment.banner_id) if assignment and assignment.banner_id else None
+        banner, variant_id = _resolve_variant(banner, assignment, variant_banner)
+        left = remaining.get(banner.campaign_id)
+        if left == 0:
+            slots.append({'slot': slot, 'id': raw_id, 'error': 'not_found'})
+            continue
+        try:
+            event, html = _build_show(banner, context | {'variant_id': variant_id})
+        except Exception:
+            logger.exception('Failed to render banner %s', banner.pk)
+            slots.append({'slot': slot, 'id': raw_id, 'error': 'render_failed'})
+            continue
+        if left is not None:
+            remaining[banner.campaign_id] = left - 1
+        events.append(event)
+        slots.append({'slot': slot, 'id': raw_id, 'show_uuid': str(event['event_id']), 'html': html})
+    return slots, events
+
+
+def _shown_cap(banners: dict[int, BannerSnapshot | None], event: dict[str, Any]) -> FrequencyCap | None:
+    banner = banners.get(event['banner_id'])
+    return banner.frequency_cap if banner else None
+
+
+def _verify_click(token: str) -> ClickToken:
+    try:
+        return verify_click(token)
+    except InvalidClickToken:
+        raise Http404()
+
+
+def _claim_click(click: ClickToken) -> bool:
+    """Повторные переходы по той же ссылке не учитываются и не списываются. Если Redis недоступен, клик считается"""
+    try:
+        return REDIS_CLIENT.claim_click(click.show_uuid, click.expires_at)
+    except Exception:
+        if settings.DEBUG:
+            raise
+        return True
+
+
+async def _aclaim_click(click: ClickToken) -> bool:
+    try:
+        return await REDIS_CLIENT.aclaim_click(click.show_uuid, click.expires_at)
+    except Exception:
+        if settings.DEBUG:
+            raise
+        return True
+
+
+def _build_click(request: HttpRequest, click: ClickToken) -> dict[str, Any]:
+    """Событие клика для ClickHouse"""
+    click_time = now()
+
+    return {
+        'show_event_id': click.show_uuid,
+        'timestamp': click_time,
+        'banner_id': click.banner_id,
+        'campaign_id': click.campaign_id,
+        'time_to_click': (click_time - click.show_time).total_seconds(),
+        'referer_url': request.META.get('HTTP_REFERER'),
+    }
+
 
+def _record_show(event: dict[str, Any], banner: BannerSnapshot, unit_id: str) -> None:
     try:
-        CH_CLIENT.log_show(
-            event_id=show_uuid,
-            timestamp=timestamp,
-            banner_id=banner.pk,
-            campaign_id=banner.campaign_id,  # pyright: ignore
-            user_id=request.user.pk if request.user.is_authenticated else None,
-            ip_address=client_ip,
-            user_agent=user_agent,
-            **ua_info
-        )
+        CH_CLIENT.log_show(**event)
     except ClickHouseWriteError:
         if settings.DEBUG:
             raise
 
     try:
-        REDIS_CLIENT.increment_shows(banner.pk)
+        REDIS_CLIENT.increment_shows(event['banner_id'], event['campaign_id'], unit_id)
+        BUDGET_TRACKER.debit_shows([event['campaign_id']])
+        FREQUENCY_CAPPER.record(unit_id, [banner.frequency_cap])
     except:  # noqa: E722
         if settings.DEBUG:
             raise
 
-    show_time = timestamp.timestamp()
 
-    click_params: dict[str, Any] = {
-        'show_uuid': show_uuid,
-        'show_time': show_time,
-    }
+def show_banner(request: HttpRequest, banner_id: int) -> HttpResponse:
+    unit_id = _get_unit_id(request)
+    banner, variant_id = _experiment_banner(_get_servable_banner(banner_id), unit_id)
+    if FREQUENCY_CAPPER.exceeded(unit_id, [banner.frequency_cap]):
+        raise Http404()
+    context = _show_context(request, attributed_user_id(request))
+    event, html = _build_show(banner, context | {'variant_id': variant_id})
+    _record_show(event, banner, unit_id)
+    return HttpResponse(html)
 
-    html = render_to_string(
-        'ads/banner.html',
-        {'banner': banner, 'click_url': reverse('click', args=[banner.pk]) + '?' + urlencode(click_params)},
-    )
 
+def select_banner(request: HttpRequest, placement: str) -> HttpResponse:
+    """Показ баннера, подобранного под место размещения и таргетинг запроса"""
+    unit_id = _get_unit_id(request)
+    context = _show_context(request, attributed_user_id(request))
+    item = DECISION_ENGINE.select(_request_attributes(placement, context, unit_id))
+    banner = BANNER_CACHE.get(item.banner_id) if item else None
+    if banner is None:
+        return HttpResponse(status=204)
+
+    banner, variant_id = _experiment_banner(banner, unit_id)
+    event, html = _build_show(banner, context | {'ad_position': placement, 'variant_id': variant_id})
+    _record_show(event, banner, unit_id)
     return HttpResponse(html)
 
 
-def handle_click(request: HttpRequest, banner_id: int) -> HttpResponse:
-    banner = get_object_or_404(Banner, pk=banner_id, is_active=True)
+def show_banners(request: HttpRequest) -> JsonResponse:
+    """Показ нескольких баннеров (слотов страницы) за один запрос: ?ids=1,2,3"""
+    ids = _parse_batch_ids(request)
+    unit_id = _get_unit_id(request)
+    assignments = {
+        banner_id: assignment
+        for banner_id in map(_parse_banner_id, ids)
+        if banner_id is not None and (assignment := EXPERIMENT_BUCKETER.assign(banner_id, unit_id))
+    }
+    banners = BANNER_CACHE.get_many(_batch_banner_ids(ids, assignments))
+    remaining = FREQUENCY_CAPPER.remaining(unit_id, {banner.frequency_cap for banner in banners.values() if banner})
+    slots, events = _build_batch(request, ids, banners, assignments, remaining, attributed_user_id(request))
+
+    try:
+        CH_CLIENT.log_shows(events)
+    except ClickHouseWriteError:
+        if settings.DEBUG:
+            raise
+
+    try:
+        REDIS_CLIENT.increment_shows_many(((event['banner_id'], event['campaign_id']) for event in events), unit_id)
+        BUDGET_TRACKER.debit_shows(event['campaign_id'] for event in events)
+        FREQUENCY_CAPPER.record(unit_id, [_shown_cap(banners, event) for event in events])
+    except:  # noqa: E722
+        if settings.DEBUG:
+            raise
 
-    show_uuid = request.GET.get('show_uuid')
-    show_time = float(request.GET.get('show_time', 0))
+    return JsonResponse({'slots': slots})
 
-    if show_uuid is None:
-        raise Http404()
 
-    click_time = now()
-    time_to_click = (click_time.timestamp() - show_time) if show_time else None
+def handle_click(request: HttpRequest, token: str) -> HttpResponse:
+    click = _verify_click(token)
+    if not _claim_click(click):
+        return redirect(click.click_url)
+    event = _build_click(request, click)
 
     # Логируем клик
     try:
-        CH_CLIENT.log_click(
-            show_event_id=uuid.UUID(show_uuid),
-            timestamp=click_time,
-            banner_id=banner.pk,
-            campaign_id=banner.campaign_id,  # pyright: ignore
-            time_to_click=time_to_click,
-            referer_url=request.META.get('HTTP_REFERER'),
-        )
+        CH_CLIENT.log_click(**event)
     except ClickHouseWriteError:
         if settings.DEBUG:
             raise
 
     try:
-        REDIS_CLIENT.increment_clicks(banner.pk)
+        REDIS_CLIENT.increment_clicks(click.banner_id, click.campaign_id)
+        BUDGET_TRACKER.debit_click(click.campaign_id)
     except:  # noqa: E722
         if settings.DEBUG:
             raise
 
-    return redirect(banner.click_url)
+    return redirect(click.click_url)
+
+
+async def _aget_servable_banner(banner_id: int) -> BannerSnapshot:
+    banner = await BANNER_CACHE.aget(banner_id)
+    if not _is_servable(banner):
+        raise Http404()
+    return cast(BannerSnapshot, banner)
+
+
+async def _aexperiment_banner(banner: BannerSnapshot, unit_id: str) -> tuple[BannerSnapshot, int | None]:
+    assignment = await EXPERIMENT_BUCKETER.aassign(banner.pk, unit_id)
+    variant_banner = None
+    if assignment is not None and assignment.banner_id is not None:
+        variant_banner = await BANNER_CACHE.aget(assignment.banner_id)
+    return _resolve_variant(banner, assignment, variant_banner)
+
+
+async def _side_effect(awaitable: Awaitable[None]) -> None:
+    """Ошибки записи статистики не должны ломать показ (кроме DEBUG)"""
+    try:
+        await awaitable
+    except Exception:
+        if settings.DEBUG:
+            raise
+
+
+async def _arecord_show(event: dict[str, Any], banner: BannerSnapshot, unit_id: str) -> None:
+    """Запись в ClickHouse и Redis идет параллельно"""
+    await asyncio.gather(
+        _side_effect(CH_CLIENT.alog_show(**event)),
+        _side_effect(REDIS_CLIENT.aincrement_shows(event['banner_id'], event['campaign_id'], unit_id)),
+        _side_effect(BUDGET_TRACKER.adebit_shows([event['campaign_id']])),
+        _side_effect(FREQUENCY_CAPPER.arecord(unit_id, [banner.frequency_cap])),
+    )
+
+
+async def ashow_banner(request: HttpRequest, banner_id: int) -> HttpResponse:
+    """Асинхронная версия show_banner"""
+    unit_id = _get_unit_id(request)
+    banner, variant_id = await _aexperiment_banner(await _aget_servable_banner(banner_id), unit_id)
+    if await FREQUENCY_CAPPER.aexceeded(unit_id, [banner.frequency_cap]):
+        raise Http404()
+    context = _show_context(request, await aattributed_user_id(request))
+    event, html = _build_show(banner, context | {'variant_id': variant_id})
+    await _arecord_show(event, banner, unit_id)
+    return HttpResponse(html)
+
+
+async def aselect_banner(request: HttpRequest, placement: str) -> HttpResponse:
+    """Асинхронная версия select_banner"""
+    unit_id = _get_unit_id(request)
+    context = _show_context(request, await aattributed_user_id(request))
+    item = await DECISION_ENGINE.aselect(_request_attributes(placement, context, unit_id))
+    banner = await BANNER_CACHE.aget(item.banner_id) if item else None
+    if banner is None:
+        return HttpResponse(status=204)
+
+    banner, variant_id = await _aexperiment_banner(banner, unit_id)
+    event, html = _build_show(banner, context | {'ad_position': placement, 'variant_id': variant_id})
+    await _arecord_show(event, banner, unit_id)
+    return HttpResponse(html)
+
+
+async def ashow_banners(request: HttpRequest) -> JsonResponse:
+    """Асинхронная версия show_banners"""
+    ids = _parse_batch_ids(request)
+    unit_id = _get_unit_id(request)
+    assignments = {
+        banner_id: assignment
+        for banner_id in map(_parse_banner_id, ids)
+        if banner_id is not None and (assignment := await EXPERIMENT_BUCKETER.aassign(banner_id, unit_id))
+    }
+    banners = await BANNER_CACHE.aget_many(_batch_banner_ids(ids, assignments))
+    caps = {banner.frequency_cap for banner in banners.values() if banner}
+    remaining = await FREQUENCY_CAPPER.aremaining(unit_id, caps)
+    slots, events = _build_batch(request, ids, banners, assignments, remaining, await aattributed_user_id(request))
+
+    await asyncio.gather(
+        _side_effect(CH_CLIENT.alog_shows(events)),
+        _side_effect(
+            REDIS_CLIENT.aincrement_shows_many(
+                [(event['banner_id'], event['campaign_id']) for event in events], unit_id
+            )
+        ),
+        _side_effect(BUDGET_TRACKER.adebit_shows([event['campaign_id'] for event in events])),
+        _side_effect(FREQUENCY_CAPPER.arecord(unit_id, [_shown_cap(banners, event) for event in events])),
+    )
+    return JsonResponse({'slots': slots})
+
+
+async def ahandle_click(request: HttpRequest, token: str) -> HttpResponse:
+    """Асинхронная версия handle_click"""
+    click = _verify_click(token)
+    if not await _aclaim_click(click):
+        return redirect(click.click_url)
+    event = _build_click(request, click)
+
+    await asyncio.gather(
+        _side_effect(CH_CLIENT.alog_click(**event)),
+        _side_effect(REDIS_CLIENT.aincrement_clicks(click.banner_id, click.campaign_id)),
+        _side_effect(BUDGET_TRACKER.adebit_click(click.campaign_id)),
+    )
+    return redirect(click.click_url)
+
+
+@staff_member_required
+def service_stats(request: HttpRequest) -> JsonResponse:
+    """Внутренние счетчики текущего воркера"""
+    stats: dict[str, Any] = {
+        'banner_cache': asdict(BANNER_CACHE.stats()),
+        'banner_renderer': {'compilations': BANNER_RENDERER.compilations},
+        'decisioning': {'line_items': DECISION_ENGINE.size},
+        'experiments': {'running': EXPERIMENT_BUCKETER.size},
+        'budget': asdict(BUDGET_TRACKER.stats()),
+        'pacing': {'throttled_campaigns': PACING_GATE.throttled},
+        'user_agent': asdict(UA_PARSER.stats()),
+    }
+    if settings.CH_INGEST_MODE == IngestMode.batch:
+        stats['ingest'] = asdict(CH_BATCH_WRITER.stats())
+    if settings.REDIS_COUNTER_FLUSH_INTERVAL:
+        stats['counters'] = asdict(COUNTER_AGGREGATOR.stats())
+    return JsonResponse(stats)
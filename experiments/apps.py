@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ExperimentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'experiments'
+
+    def ready(self) -> None:
+        import experiments.signals  # noqa: F401  # pyright: ignore[reportUnusedImport]
@@ -0,0 +1,169 @@
+import hashlib
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+from typing import cast
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.utils.functional import LazyObject
+from django.utils.timezone import now
+
+from ads.invalidation import ALL, INVALIDATION_BUS
+from experiments.models import Experiment, Variant
+
+
+@dataclass(frozen=True, slots=True)
+class Assignment:
+    experiment_id: int
+    variant_id: int
+    banner_id: int | None
+
+
+@dataclass(frozen=True, slots=True)
+class ExperimentTable:
+    """Накопленные веса вариантов эксперимента: варианту i достаются бакеты [cumulative[i-1], cumulative[i])"""
+
+    experiment_id: int
+    start_date: datetime
+    end_date: datetime | None
+    cumulative: tuple[int, ...]
+    variant_ids: tuple[int, ...]
+    banner_ids: tuple[int | None, ...]
+
+    def is_running(self, moment: datetime) -> bool:
+        return self.start_date <= moment and (self.end_date is None or moment <= self.end_date)
+
+    def assign(self, unit_id: str) -> Assignment:
+        index = bisect_right(self.cumulative, bucket(self.experiment_id, unit_id, self.cumulative[-1]))
+        return Assignment(self.experiment_id, self.variant_ids[index], self.banner_ids[index])
+
+
+def bucket(experiment_id: int, unit_id: str, buckets: int) -> int:
+    """Номер бакета единицы в эксперименте.
+
+    Хеш не зависит от PYTHONHASHSEED и процесса, поэтому единица попадает
+    в один и тот же вариант на всех воркерах и нодах.
+    """
+    digest = hashlib.blake2b(f'{experiment_id}:{unit_id}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest) % buckets
+
+
+class ExperimentBucketer:
+    """Распределение трафика по вариантам экспериментов без обращений к базе на запрос.
+
+    Таблицы весов строятся для всех активных экспериментов с вариантами и
+    индексируются по id баннеров вариантов: запрос любого баннера эксперимента
+    получает баннер варианта, назначенного единице (сессии, посетителю).
+    Таблица эксперимента перестраивается при изменении его или его вариантов.
+    Баннер может входить и в идущий, и в запланированный эксперимент: из них
+    выбирается идущий, при пересечении - начавшийся раньше.
+    """
+
+    def __init__(self) -> None:
+        self._tables: dict[int, ExperimentTable] = {}
+        self._by_banner: dict[int, tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty: set[int] = set()
+
+    def assign(self, banner_id: int, unit_id: str) -> Assignment | None:
+        if self._needs_refresh():
+            self._refresh()
+        return self._assign(banner_id, unit_id)
+
+    async def aassign(self, banner_id: int, unit_id: str) -> Assignment | None:
+        if self._needs_refresh():
+            await sync_to_async(self._refresh)()
+        return self._assign(banner_id, unit_id)
+
+    def invalidate(self, kind: str, object_id: int) -> None:
+        with self._lock:
+            if kind == ALL:
+                self._loaded = False
+            elif kind == 'experiment':
+                self._dirty.add(object_id)
+
+    @property
+    def size(self) -> int:
+        return len(self._tables)
+
+    def _assign(self, banner_id: int, unit_id: str) -> Assignment | None:
+        moment = now()
+        for experiment_id in self._by_banner.get(banner_id, ()):
+            table = self._tables.get(experiment_id)
+            if table is not None and table.is_running(moment):
+                return table.assign(unit_id)
+        return None
+
+    def _needs_refresh(self) -> bool:
+        return not self._loaded or bool(self._dirty)
+
+    def _refresh(self) -> None:
+        with self._lock:
+            full = not self._loaded
+            dirty, self._dirty = self._dirty, set()
+
+        loaded = _load_tables(None if full else dirty)
+        with self._lock:
+            tables = {} if full else dict(self._tables)
+            for experiment_id in dirty:
+                tables.pop(experiment_id, None)
+            tables |= loaded
+            self._tables = tables
+            by_banner: dict[int, list[int]] = {}
+            for table in sorted(tables.values(), key=lambda table: (table.start_date, table.experiment_id)):
+                for banner_id in dict.fromkeys(table.banner_ids):
+                    if banner_id is not None:
+                        by_banner.setdefault(banner_id, []).append(table.experiment_id)
+            self._by_banner = {banner_id: tuple(experiment_ids) for banner_id, experiment_ids in by_banner.items()}
+            self._loaded = True
+
+
+def _load_tables(experiment_ids: set[int] | None = None) -> dict[int, ExperimentTable]:
+    experiments = Experiment.objects.filter(
+        Q(end_date__isnull=True) | Q(end_date__gte=now()),
+        is_active=True,
+    )
+    if experiment_ids is not None:
+        experiments = experiments.filter(pk__in=experiment_ids)
+
+    variants: dict[int, list[tuple[int, int, int | None]]] = {}
+    rows = (
+        Variant.objects.filter(experiment__in=experiments)
+        .order_by('experiment_id', 'pk')
+        .values_list('experiment_id', 'pk', 'weight', 'banner_id')
+    )
+    for experiment_id, variant_id, weight, banner_id in rows:
+        variants.setdefault(experiment_id, []).append((variant_id, weight, banner_id))
+
+    tables: dict[int, ExperimentTable] = {}
+    for experiment_id, start_date, end_date in experiments.values_list('pk', 'start_date', 'end_date'):
+        experiment_variants = variants.get(experiment_id)
+        if not experiment_variants:
+            continue
+        cumulative: list[int] = []
+        total = 0
+        for _, weight, _ in experiment_variants:
+            total += weight
+            cumulative.append(total)
+        tables[experiment_id] = ExperimentTable(
+            experiment_id=experiment_id,
+            start_date=start_date,
+            end_date=end_date,
+            cumulative=tuple(cumulative),
+            variant_ids=tuple(variant_id for variant_id, _, _ in experiment_variants),
+            banner_ids=tuple(banner_id for _, _, banner_id in experiment_variants),
+        )
+    return tables
+
+
+class LazyExperimentBucketer(LazyObject):
+    def _setup(self) -> None:
+        bucketer = ExperimentBucketer()
+        INVALIDATION_BUS.subscribe(bucketer.invalidate)
+        self._wrapped = bucketer
+
+
+EXPERIMENT_BUCKETER = cast(ExperimentBucketer, LazyExperimentBucketer())
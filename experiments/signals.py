@@ -0,0 +1,35 @@
+from typing import Any
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ads.invalidation import INVALIDATION_BUS
+from experiments.models import Experiment, TargetingGroup, Variant
+
+
+def _invalidate_campaign(campaign_id: int) -> None:
+    transaction.on_commit(lambda: INVALIDATION_BUS.publish('campaign', campaign_id))
+
+
+def _invalidate_experiment(experiment_id: int) -> None:
+    transaction.on_commit(lambda: INVALIDATION_BUS.publish('experiment', experiment_id))
+
+
+@receiver(post_save, sender=Experiment)
+@receiver(post_delete, sender=Experiment)
+def invalidate_experiment(sender: type[Experiment], instance: Experiment, **kwargs: Any) -> None:
+    _invalidate_campaign(instance.campaign_id)  # pyright: ignore[reportAttributeAccessIssue]
+    _invalidate_experiment(instance.pk)
+
+
+@receiver(post_save, sender=Variant)
+@receiver(post_delete, sender=Variant)
+def invalidate_variant(sender: type[Variant], instance: Variant, **kwargs: Any) -> None:
+    _invalidate_experiment(instance.experiment_id)  # pyright: ignore[reportAttributeAccessIssue]
+
+
+@receiver(post_save, sender=TargetingGroup)
+@receiver(post_delete, sender=TargetingGroup)
+def invalidate_targeting_group(sender: type[TargetingGroup], instance: TargetingGroup, **kwargs: Any) -> None:
+    _invalidate_campaign(instance.experiment.campaign_id)  # pyright: ignore[reportAttributeAccessIssue]
@@ -0,0 +1,109 @@
+from collections import Counter
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.utils.timezone import localdate, now
+
+from ads.models import Banner, Campaign, Client
+from experiments.bucketing import ExperimentBucketer, ExperimentTable, bucket
+from experiments.models import Experiment, Variant
+
+
+class BucketTests(SimpleTestCase):
+    def test_bucket_is_stable(self) -> None:
+        # blake2b не зависит от PYTHONHASHSEED: значения одинаковы в любом процессе и на любой ноде
+        self.assertEqual([bucket(7, f'u{i}', 100) for i in range(5)], [26, 44, 4, 67, 35])
+
+    def test_bucket_depends_on_experiment(self) -> None:
+        units = [f'u{i}' for i in range(100)]
+        self.assertNotEqual([bucket(1, unit, 100) for unit in units], [bucket(2, unit, 100) for unit in units])
+
+    def test_weights_split_traffic(self) -> None:
+        table = ExperimentTable(
+            experiment_id=1,
+            start_date=datetime(2026, 1, 1, tzinfo=UTC),
+            end_date=None,
+            cumulative=(20, 100),
+            variant_ids=(10, 11),
+            banner_ids=(None, 5),
+        )
+        shares = Counter(table.assign(f'unit-{i}').variant_id for i in range(20_000))
+
+        self.assertAlmostEqual(shares[10] / 20_000, 0.2, delta=0.02)
+        self.assertEqual(table.assign('unit-1'), table.assign('unit-1'))
+
+    def test_is_running(self) -> None:
+        start = datetime(2026, 1, 1, tzinfo=UTC)
+        table = ExperimentTable(1, start, start + timedelta(days=1), (100,), (1,), (None,))
+
+        self.assertFalse(table.is_running(start - timedelta(seconds=1)))
+        self.assertTrue(table.is_running(start))
+        self.assertFalse(table.is_running(start + timedelta(days=2)))
+
+
+class ExperimentBucketerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        user = User.objects.create(username='owner')
+        client = Client.objects.create(name='Client', tax_id='7700000000', owner=user)
+        campaign = Campaign.objects.create(
+            name='Campaign',
+            client=client,
+            author=user,
+            budget=Decimal(1000),
+            start_date=localdate(),
+            end_date=localdate() + timedelta(days=30),
+        )
+        cls.banners = [
+            Banner.objects.create(name=name, campaign=campaign, content={}, click_url='https://e.com')
+            for name in ('A', 'B')
+        ]
+        cls.experiment = Experiment.objects.create(
+            name='Design', experiment_type='banner_design', campaign=campaign, start_date=now() - timedelta(days=1)
+        )
+        cls.variants = [
+            Variant.objects.create(experiment=cls.experiment, name=banner.name, weight=50, config={}, banner=banner)
+            for banner in cls.banners
+        ]
+
+    def test_any_banner_of_experiment_gets_unit_variant(self) -> None:
+        bucketer = ExperimentBucketer()
+        for unit in ('u1', 'u2', 'u3'):
+            assignments = {bucketer.assign(banner.pk, unit) for banner in self.banners}
+            self.assertEqual(len(assignments), 1)
+            [assignment] = assignments
+            self.assertIsNotNone(assignment)
+            self.assertIn(assignment.banner_id, {banner.pk for banner in self.banners})  # pyright: ignore
+
+    def test_invalidated_experiment_is_reloaded(self) -> None:
+        bucketer = ExperimentBucketer()
+        self.assertIsNotNone(bucketer.assign(self.banners[0].pk, 'u1'))
+
+        Experiment.objects.filter(pk=self.experiment.pk).update(end_date=now() - timedelta(hours=1))
+        self.assertIsNotNone(bucketer.assign(self.banners[0].pk, 'u1'))
+        bucketer.invalidate('experiment', self.experiment.pk)
+        self.assertIsNone(bucketer.assign(self.banners[0].pk, 'u1'))
+
+    def test_scheduled_experiment_does_not_hide_running_one(self) -> None:
+        bucketer = ExperimentBucketer()
+        self.assertIsNotNone(bucketer.assign(self.banners[0].pk, 'u1'))
+        scheduled = Experiment.objects.create(
+            name='Next',
+            experiment_type='banner_design',
+            campaign=self.experiment.campaign,
+            start_date=now() + timedelta(days=7),
+        )
+        Variant.objects.create(experiment=scheduled, name='A', weight=100, config={}, banner=self.banners[0])
+        bucketer.invalidate('experiment', scheduled.pk)
+
+        assignment = bucketer.assign(self.banners[0].pk, 'u1')
+        self.assertIsNotNone(assignment)
+        self.assertEqual(assignment.experiment_id, self.experiment.pk)  # pyright: ignore
+
+        with mock.patch('experiments.bucketing.now', return_value=now() + timedelta(days=8)):
+            Experiment.objects.filter(pk=self.experiment.pk).update(end_date=now() + timedelta(days=1))
+            bucketer.invalidate('experiment', self.experiment.pk)
+            self.assertEqual(bucketer.assign(self.banners[0].pk, 'u1').experiment_id, scheduled.pk)  # pyright: ignore
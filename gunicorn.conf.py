@@ -0,0 +1,34 @@
+"""
+Конфигурация gunicorn.
+
+SERVER_MODE=wsgi - синхронные воркеры, один запрос на воркер в каждый момент времени.
+SERVER_MODE=asgi - uvicorn-воркеры поверх project.asgi, каждый воркер держит в одном
+event loop тысячи показов одновременно. Для этого режима нужно включить ADS_ASYNC_VIEWS
+и использовать CH_INGEST_MODE=batch или journal, чтобы запись в ClickHouse не блокировала loop.
+
+https://docs.gunicorn.org/en/stable/settings.html
+"""
+
+import multiprocessing
+import os
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8841')
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'project.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    # Воркер асинхронный, больше одного на ядро не нужно
+    workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+else:
+    wsgi_app = 'project.wsgi:application'
+    worker_class = 'sync'
+    workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# Перезапуск воркеров ограничивает рост памяти, jitter разносит рестарты во времени
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 100_000))
+max_requests_jitter = max_requests // 10
+
+# Время на досылку буферов событий и счетчиков при остановке воркера
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
@@ -54,6 +54,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ads.middleware.AdServingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +64,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Запросы показа и клика обходят MIDDLEWARE и проходят только через ADS_MIDDLEWARE
+ADS_SERVING_PATHS = ['/ads/banner/']
+ADS_MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+]
+# Атрибуция показов залогиненным пользователям по сессионной куке
+ADS_ATTRIBUTE_USERS: bool = env.bool('ADS_ATTRIBUTE_USERS', False)  # pyright: ignore
+
 ROOT_URLCONF = 'project.urls'
 
 TEMPLATES: list[dict[str, Any]] = [
@@ -144,6 +153,19 @@ CH_DATABASE: str = env.str('CH_DATABASE', os.environ.get('CH_DATABASE'))  # pyri
 CH_PASSWORD: str = env.str('CH_PASSWORD', os.environ.get('CH_PASSWORD'))  # pyright: ignore
 _ch_ssl_cert_path: str | None = env.str('CH_SSL_CERTIFICATE_PATH', os.environ.get('CH_SSL_CERTIFICATE_PATH', None))  # pyright: ignore
 CH_SSL_CERTIFICATE_PATH: Path | None = Path(_ch_ssl_cert_path) if _ch_ssl_cert_path else None  # pyright: ignore
+# sync - INSERT на каждое событие, batch - буферизованная запись пачками из фонового потока,
+# journal - запись в локальный журнал, отправку в ClickHouse выполняет `manage.py ship_events`
+CH_INGEST_MODE: str = env.str('CH_INGEST_MODE', os.environ.get('CH_INGEST_MODE', 'sync'))  # pyright: ignore
+CH_BATCH_MAX_ROWS: int = env.int('CH_BATCH_MAX_ROWS', 1000)  # pyright: ignore
+CH_BATCH_MAX_DELAY: float = env.float('CH_BATCH_MAX_DELAY', 1.0)  # pyright: ignore
+CH_BATCH_QUEUE_SIZE: int = env.int('CH_BATCH_QUEUE_SIZE', 100_000)  # pyright: ignore
+CH_JOURNAL_DIR: Path = env.path('CH_JOURNAL_DIR', BASE_DIR / 'journal')  # pyright: ignore
+CH_JOURNAL_FSYNC: str = env.str('CH_JOURNAL_FSYNC', 'interval')  # pyright: ignore
+CH_JOURNAL_FSYNC_INTERVAL: float = env.float('CH_JOURNAL_FSYNC_INTERVAL', 1.0)  # pyright: ignore
+CH_JOURNAL_SEGMENT_MAX_BYTES: int = env.int('CH_JOURNAL_SEGMENT_MAX_BYTES', 64 * 1024 * 1024)  # pyright: ignore
+CH_JOURNAL_SEGMENT_MAX_AGE: float = env.float('CH_JOURNAL_SEGMENT_MAX_AGE', 60.0)  # pyright: ignore
+# Читать сырые события из таблиц v2 (ads/ch_migrations/0004_events_v2.sql). Включать после backfill_events_v2
+CH_READ_EVENTS_V2: bool = env.bool('CH_READ_EVENTS_V2', False)  # pyright: ignore
 
 REDIS_DATABASE: int = env.int('REDIS_DATABASE', int(os.environ.get('REDIS_DATABASE', 0)))  # pyright: ignore
 REDIS_PASSWORD: str = env.str('REDIS_PASSWORD', os.environ.get('REDIS_PASSWORD'))  # pyright: ignore
@@ -151,3 +173,51 @@ REDIS_HOST: str = env.str('REDIS_HOST', os.environ.get('REDIS_HOST'))  # pyright
 REDIS_PORT: int = env.int('REDIS_PORT', int(os.environ.get('REDIS_PORT', 0)))  # pyright: ignore
 _redis_ssl_cert_path: str | None = env.str('REDIS_SSL_CERTIFICATE_PATH', os.environ.get('REDIS_SSL_CERTIFICATE_PATH', None))  # pyright: ignore
 REDIS_SSL_CERTIFICATE_PATH: Path | None = Path(_redis_ssl_cert_path) if _redis_ssl_cert_path else None  # pyright: ignore
+# Кеш Django общий для всех воркеров (роли пользователей в админке): сброс записи виден сразу везде.
+# Без REDIS_HOST (разработка, тесты) - память процесса
+if REDIS_HOST:
+    _redis_scheme = 'rediss' if REDIS_SSL_CERTIFICATE_PATH else 'redis'
+    _redis_cache_options: dict[str, Any] = {'password': REDIS_PASSWORD}
+    if REDIS_SSL_CERTIFICATE_PATH:
+        _redis_cache_options['ssl_ca_certs'] = str(REDIS_SSL_CERTIFICATE_PATH)
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f'{_redis_scheme}://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DATABASE}',
+            'KEY_PREFIX': 'django',
+            'OPTIONS': _redis_cache_options,
+        }
+    }
+# Локальная агрегация счетчиков: 0 - INCR на каждое событие, иначе период отправки в миллисекундах
+REDIS_COUNTER_FLUSH_INTERVAL: int = env.int('REDIS_COUNTER_FLUSH_INTERVAL', 0)  # pyright: ignore
+REDIS_COUNTER_FLUSH_EVENTS: int = env.int('REDIS_COUNTER_FLUSH_EVENTS', 1000)  # pyright: ignore
+# Сколько событий воркер может держать неотправленными (и потерять при падении)
+REDIS_COUNTER_MAX_PENDING: int = env.int('REDIS_COUNTER_MAX_PENDING', 10_000)  # pyright: ignore
+REDIS_COUNTER_FLUSH_ON_EXIT: bool = env.bool('REDIS_COUNTER_FLUSH_ON_EXIT', True)  # pyright: ignore
+# Сколько дней хранятся дневные HyperLogLog охвата (до 12 КБ на баннер или кампанию в день)
+REDIS_REACH_TTL_DAYS: int = env.int('REDIS_REACH_TTL_DAYS', 180)  # pyright: ignore
+# Хранение счетчиков по времени после свертки rollup_counters: минутные - часов, часовые и дневные - дней
+REDIS_STATS_MINUTES_TTL_HOURS: int = env.int('REDIS_STATS_MINUTES_TTL_HOURS', 48)  # pyright: ignore
+REDIS_STATS_HOURS_TTL_DAYS: int = env.int('REDIS_STATS_HOURS_TTL_DAYS', 35)  # pyright: ignore
+REDIS_STATS_DAYS_TTL_DAYS: int = env.int('REDIS_STATS_DAYS_TTL_DAYS', 400)  # pyright: ignore
+# Как часто воркер перечитывает множество исчерпанных бюджетов, секунд
+BUDGET_REFRESH_INTERVAL: float = env.float('BUDGET_REFRESH_INTERVAL', 5.0)  # pyright: ignore
+# Как часто воркер перечитывает доли пейсинга (дополнительно к оповещению от pace_campaigns), секунд
+PACING_REFRESH_INTERVAL: float = env.float('PACING_REFRESH_INTERVAL', 30.0)  # pyright: ignore
+
+# Асинхронные вьюхи показа и клика, включать вместе с запуском под ASGI (см. gunicorn.conf.py)
+ADS_ASYNC_VIEWS: bool = env.bool('ADS_ASYNC_VIEWS', False)  # pyright: ignore
+# Максимум слотов в одном запросе /ads/banner/show/batch/
+ADS_BATCH_MAX_SLOTS: int = env.int('ADS_BATCH_MAX_SLOTS', 20)  # pyright: ignore
+# Ключ request.META с кодом страны клиента (выставляется балансировщиком, например geoip2 в nginx)
+ADS_GEO_HEADER: str = env.str('ADS_GEO_HEADER', 'HTTP_X_COUNTRY_CODE')  # pyright: ignore
+# Кука с устойчивым id посетителя для распределения по вариантам экспериментов. Без нее - IP + User-Agent
+EXPERIMENT_UNIT_COOKIE: str = env.str('EXPERIMENT_UNIT_COOKIE', 'sessionid')  # pyright: ignore
+# Сколько секунд карта ролей пользователя по клиентам живет в кеше Django (права в админке)
+CLIENT_ROLES_CACHE_TTL: int = env.int('CLIENT_ROLES_CACHE_TTL', 60)  # pyright: ignore
+
+BANNER_CACHE_SIZE: int = env.int('BANNER_CACHE_SIZE', 10_000)  # pyright: ignore
+BANNER_CACHE_TTL: float = env.float('BANNER_CACHE_TTL', 300.0)  # pyright: ignore
+UA_CACHE_SIZE: int = env.int('UA_CACHE_SIZE', 10_000)  # pyright: ignore
+# Срок действия ссылки перехода по клику, секунд
+CLICK_TOKEN_TTL: int = env.int('CLICK_TOKEN_TTL', 24 * 60 * 60)  # pyright: ignore